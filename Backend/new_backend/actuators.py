@@ -0,0 +1,228 @@
+"""
+Per-actuator command queues for the motor and the cooler.
+
+Everything that wants an actuator to move (the decision engine's deliveries,
+POST /cooler, a restored cooler cycle) submits a command to that actuator's
+queue instead of starting its own task. One command runs at a time, in
+submission order, so hardware sequences can no longer overlap. submit()
+never blocks and always answers at once:
+
+    queued      accepted; runs after the commands ahead of it
+    coalesced   an identical command (same key) is already pending, or, for
+                actuators that coalesce with the running command, running;
+                the caller gets that command instead of a duplicate
+    rejected    the queue already holds max_depth pending commands
+
+A command that waited longer than max_wait_sec (on the patient's clock) is
+dropped unrun as expired: a delivery decided half a minute ago is worse
+than none. A running command is cancelled after timeout_sec; the runners'
+own finally blocks switch the relay off. Queue wait and execution times go
+to glucodose_actuator_queue_wait_seconds / _exec_seconds, outcomes to
+glucodose_actuator_commands_total.
+"""
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from clock import Clock
+from eventlog import log
+from metrics import ACTUATOR_COMMANDS, ACTUATOR_EXEC, ACTUATOR_QUEUE_DEPTH, ACTUATOR_QUEUE_WAIT
+from tracing import now_ns, tracer
+
+# --- CONFIGURATION ---
+# Pending commands (not counting the running one) before submit() rejects
+MOTOR_MAX_DEPTH = 2
+COOLER_MAX_DEPTH = 1
+# Longest a command may wait to start before it is dropped
+MOTOR_MAX_WAIT_SEC = 30.0
+COOLER_MAX_WAIT_SEC = 60.0
+# Longest a command may run: a 10 s pulse / 30 s cycle plus relay calls and retries
+MOTOR_TIMEOUT_SEC = 30.0
+COOLER_TIMEOUT_SEC = 60.0
+
+# Submission outcomes
+QUEUED = "queued"
+COALESCED = "coalesced"
+REJECTED = "rejected"
+
+_ids = itertools.count(1)
+
+
+class Command:
+    """One submitted actuator command; `status` moves pending -> running -> a final status."""
+
+    FINAL = ("done", "failed", "timeout", "expired", "cancelled")
+
+    def __init__(self, key: str, run: Callable[[], Awaitable[Any]], source: str, submitted_at: float):
+        self.id = next(_ids)
+        self.key = key
+        self.run = run
+        self.source = source
+        self.submitted_at = submitted_at       # patient clock
+        self._submitted_perf = time.perf_counter()
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.wait_sec: Optional[float] = None
+        self.exec_sec: Optional[float] = None
+        self._done = asyncio.get_running_loop().create_future()
+        self._task: Optional[asyncio.Future] = None
+
+    def _finish(self, status: str, error: Optional[str] = None) -> None:
+        self.status, self.error = status, error
+        if not self._done.done():
+            self._done.set_result(status)
+
+    async def wait(self) -> str:
+        """Final status, once the command has run or been dropped."""
+        return await asyncio.shield(self._done)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"id": self.id, "key": self.key, "source": self.source, "status": self.status,
+                "waitSec": self.wait_sec, "execSec": self.exec_sec, "error": self.error}
+
+
+class ActuatorQueue:
+    """
+    FIFO of commands for one actuator of one patient. The worker task only
+    exists while there is work, so idle sessions cost nothing.
+    """
+
+    def __init__(self, actuator: str, session_id: str, clock: Clock, max_depth: int,
+                 max_wait_sec: float, timeout_sec: float, coalesce_running: bool = False):
+        self.actuator = actuator
+        self.session_id = session_id
+        self.clock = clock
+        self.max_depth = max_depth
+        self.max_wait_sec = max_wait_sec
+        self.timeout_sec = timeout_sec
+        self.coalesce_running = coalesce_running
+        self.pending: Deque[Command] = deque()
+        self.running: Optional[Command] = None
+        self.last: Optional[Command] = None
+        self.outcomes: Dict[str, int] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self._observe_wait = ACTUATOR_QUEUE_WAIT.labels(actuator=actuator).observe
+        self._observe_exec = ACTUATOR_EXEC.labels(actuator=actuator).observe
+        self._depth = ACTUATOR_QUEUE_DEPTH.labels(actuator=actuator)
+
+    def _count(self, outcome: str) -> None:
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        ACTUATOR_COMMANDS.labels(actuator=self.actuator, outcome=outcome).inc()
+
+    def submit(self, key: str, run: Callable[[], Awaitable[Any]], source: str) -> Tuple[str, Optional[Command]]:
+        """
+        Enqueue `run` (a coroutine function) under `key`. Returns the outcome
+        and the command that will carry it out (None when rejected).
+        """
+        running = self.running
+        if self.coalesce_running and running is not None and running.key == key:
+            self._count(COALESCED)
+            return COALESCED, running
+        for command in self.pending:
+            if command.key == key:
+                self._count(COALESCED)
+                return COALESCED, command
+        if len(self.pending) >= self.max_depth:
+            self._count(REJECTED)
+            log.event("actuator.rejected", actuator=self.actuator, session=self.session_id, key=key,
+                      source=source, depth=len(self.pending))
+            return REJECTED, None
+
+        command = Command(key, run, source, self.clock.time())
+        self.pending.append(command)
+        self._depth.inc()
+        self._count(QUEUED)
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._drain())
+        return QUEUED, command
+
+    async def _drain(self) -> None:
+        try:
+            while self.pending:
+                command = self.pending.popleft()
+                self._depth.dec()
+                await self._execute(command)
+        finally:
+            self._worker = None
+
+    async def _execute(self, command: Command) -> None:
+        command.wait_sec = time.perf_counter() - command._submitted_perf
+        self._observe_wait(command.wait_sec)
+        if self.clock.time() - command.submitted_at > self.max_wait_sec:
+            command._finish("expired")
+            self._count("expired")
+            log.event("actuator.expired", actuator=self.actuator, session=self.session_id, key=command.key,
+                      waited_sec=round(self.clock.time() - command.submitted_at, 1))
+            return
+
+        self.running = command
+        command.status = "running"
+        started, started_ns = time.perf_counter(), now_ns()
+        # Race the runner against a timer on the patient's clock, as Scheduler._park does
+        runner = command._task = asyncio.ensure_future(command.run())
+        timer = asyncio.ensure_future(self.clock.sleep(self.timeout_sec))
+        try:
+            await asyncio.wait({runner, timer}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # The queue itself was cancelled (shutdown): take the runner down with it
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+            raise
+        finally:
+            timer.cancel()
+            command.exec_sec = time.perf_counter() - started
+            self._observe_exec(command.exec_sec)
+            self.running = None
+            self.last = command
+            if not runner.done():
+                runner.cancel()
+                await asyncio.gather(runner, return_exceptions=True)
+                status, error = "timeout", f"exceeded {self.timeout_sec:g} s"
+            elif runner.cancelled():
+                status, error = "cancelled", None
+            elif runner.exception() is not None:
+                status, error = "failed", repr(runner.exception())
+            else:
+                status, error = "done", None
+            command._finish(status, error)
+            self._count(status)
+            tracer.async_span(f"{self.actuator}.command", self.session_id, started_ns, key=command.key,
+                              source=command.source, status=status, wait_ms=round(command.wait_sec * 1000, 3))
+            if error:
+                log.event("actuator.error", actuator=self.actuator, session=self.session_id, key=command.key,
+                          status=status, error=error)
+
+    def cancel(self, command: Command) -> bool:
+        """Drop a pending command or cancel the running one. False if it had already finished."""
+        if command in self.pending:
+            self.pending.remove(command)
+            self._depth.dec()
+            command._finish("cancelled")
+            self._count("cancelled")
+            return True
+        if command is self.running and command._task is not None:
+            command._task.cancel()
+            return True
+        return False
+
+    async def close(self) -> None:
+        """Cancel everything queued or running and wait until the actuator is idle (shutdown)."""
+        for command in list(self.pending):
+            self.cancel(command)
+        if self.running is not None:
+            self.cancel(self.running)
+        if self._worker is not None:
+            await asyncio.gather(self._worker, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "actuator": self.actuator,
+            "depth": len(self.pending),
+            "maxDepth": self.max_depth,
+            "running": self.running.stats() if self.running else None,
+            "pending": [command.stats() for command in self.pending],
+            "last": self.last.stats() if self.last else None,
+            "outcomes": dict(self.outcomes),
+        }
@@ -1,57 +1,104 @@
+"""
+GlucoDose API.
+
+    python app.py                  # one process: simulation + API on :8000
+    python app.py --workers 4      # one writer process + 4 reader workers
+
+With --workers the simulation runs once, in a writer process on
+127.0.0.1:--writer-port, which publishes the demo patient's snapshot to
+shared memory (shmstate.py). The workers on --port serve /state and
+/ws/glucose from that segment and forward every other HTTP request,
+including the control POSTs, to the writer.
+"""
+import argparse
 import asyncio
-import random
-import requests
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import json
+import subprocess
+import sys
+from typing import Optional
+import httpx
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from fastapi.staticfiles import StaticFiles
 import os
 
-import state
-from glucose_simulator import run_glucose_simulator
-from fake_oref1 import run_fake_oref1
+from state import PatientState
+from sessions import manager, DEFAULT_SESSION_ID
+from broadcast import GlucoseBroadcaster
+from scheduler import PHASE_PUBLISH
 import cooler_control
+import hardware
+import shmstate
+import forecast
+import wire
+from actuators import QUEUED, REJECTED
+from tsstore import HistoryStore, MAX_QUERY_ROWS
+from downsample import CHART_SERIES, MAX_POINTS, METHODS
+from metrics import REGISTRY, monitor_loop_lag
+from eventlog import log
+from tracing import tracer
 
-# --- TEMPERATURE / HEAT SIMULATION ---
-async def run_temperature_simulation():
-    """
-    Simulates the device heating up slowly over time.
-    This forces the user to use the 'COOL' button.
-    """
-    print("🔥 Device Heating Simulation Started")
-    
-    # Start at a realistic ambient temp
-    state.insulin_temperature = 26.9
-    
-    while True:
-        # Check Pause
-        if not state.system_running:
-            await asyncio.sleep(1)
-            continue
-
-        # Only heat up if the cooler is OFF
-        if state.cooler_state == "OFF":
-            # Add small incremental heat (Simulating motor heat/battery heat)
-            # 0.005 to 0.02 degrees per second
-            # This causes the display (rounded to 0.1) to tick up every ~10 seconds.
-            heat_creep = random.uniform(0.005, 0.002)
-            state.insulin_temperature += heat_creep
-            
-        # If Cooler is ON, cooler_control.py handles the rapid drop.
-        
-        await asyncio.sleep(1.0) # Run every second
+# --- CONFIGURATION ---
+# "standalone" (default), or "writer" / "reader" as started by --workers
+ROLE = os.environ.get("GLUCODOSE_ROLE", "standalone")
+WRITER_URL = os.environ.get("GLUCODOSE_WRITER_URL", "http://127.0.0.1:8001")
+SHM_PUBLISH_INTERVAL_SEC = 0.1
+FORWARD_TIMEOUT_SEC = 10.0
+READER_RETRY_AFTER_SEC = 1      # Retry-After on a reader's /state before the first snapshot
+DEFAULT_CHART_POINTS = 500
+# Served by reader workers themselves; everything else goes to the writer
+READER_ROUTES = {"/", "/state", "/metrics"}
+
+# Reader workers only
+_mirror: Optional[shmstate.MirroredPatient] = None
+_mirror_hub: Optional[GlucoseBroadcaster] = None
+_writer_client: Optional[httpx.AsyncClient] = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Launch background tasks
-    asyncio.create_task(run_glucose_simulator())
-    asyncio.create_task(run_fake_oref1())
-    asyncio.create_task(run_temperature_simulation()) # New heating logic
-    print("🚀 System Started: API + Logic + Heat Sim")
+    if ROLE == "reader":
+        async with _reader_lifespan():
+            yield
+        return
+    # Startup: the demo patient drives the real relay board, extra sessions are virtual
+    await hardware.relay.open()
+    patient = manager.create(DEFAULT_SESSION_ID, hardware=True, verbose=True, persist=True)
+    shm_writer = shm_job = None
+    if ROLE == "writer":
+        shm_writer = shmstate.SharedStateWriter()
+        shm_job = manager.scheduler.add("shm", SHM_PUBLISH_INTERVAL_SEC, PHASE_PUBLISH,
+                                        lambda: shm_writer.publish_patient(patient), gated=False)
+    manager.start()
+    lag_monitor = asyncio.create_task(monitor_loop_lag())
+    print("🚀 System Started: API + Logic + Heat Sim" + (" (shared-memory writer)" if shm_writer else ""))
     yield
     # Shutdown
+    lag_monitor.cancel()
+    manager.stop()
+    if shm_writer:
+        manager.scheduler.remove(shm_job)
+        shm_writer.close()
+    await manager.close_actuators()
+    await hardware.relay.aclose()
     print("🛑 System Shutting Down")
 
+@asynccontextmanager
+async def _reader_lifespan():
+    global _mirror, _mirror_hub, _writer_client
+    reader = await shmstate.SharedStateReader.attach()
+    _mirror = shmstate.MirroredPatient()
+    _mirror_hub = GlucoseBroadcaster(_mirror)
+    _writer_client = httpx.AsyncClient(base_url=WRITER_URL, timeout=FORWARD_TIMEOUT_SEC)
+    follower = asyncio.create_task(shmstate.follow(reader, _mirror, _mirror_hub.tick))
+    lag_monitor = asyncio.create_task(monitor_loop_lag())
+    print(f"📖 Reader worker {os.getpid()} serving shared state, writer at {WRITER_URL}")
+    yield
+    lag_monitor.cancel()
+    follower.cancel()
+    await _writer_client.aclose()
+    reader.close()
+
 app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
@@ -62,45 +109,250 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Longest a GET /state?after= long-poll is held open
+LONG_POLL_TIMEOUT_SEC = 25.0
+
+if ROLE == "reader":
+    @app.middleware("http")
+    async def forward_to_writer(request: Request, call_next):
+        if request.url.path in READER_ROUTES:
+            return await call_next(request)
+        try:
+            upstream = await _writer_client.request(
+                request.method, request.url.path, params=request.query_params,
+                content=await request.body(),
+                headers={k: v for k, v in request.headers.items() if k.lower() in ("content-type", "if-none-match", "accept")})
+        except httpx.HTTPError as e:
+            return Response(content=f"Writer unavailable: {e!r}", status_code=503)
+        headers = {k: v for k, v in upstream.headers.items() if k.lower() in ("etag", "cache-control", "vary")}
+        return Response(content=upstream.content, status_code=upstream.status_code,
+                        media_type=upstream.headers.get("content-type"), headers=headers)
+
+def _session(session_id: str) -> PatientState:
+    try:
+        return manager.get(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown session '{session_id}'")
+
 @app.get("/")
 async def root(): return {"status": "ok"}
 
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/trace")
+async def get_trace(session: Optional[str] = None):
+    """Flight-recorder dump in Chrome trace format; open it in ui.perfetto.dev."""
+    if session is not None:
+        _session(session)
+    # A full ring is tens of thousands of events; format it off the event loop
+    records = tracer.snapshot(session)
+    body = await asyncio.to_thread(lambda: json.dumps(tracer.chrome_trace(records), separators=(",", ":")))
+    return Response(content=body, media_type="application/json")
+
+# --- SESSIONS ---
+@app.get("/sessions")
+async def list_sessions():
+    return [
+        {"sessionId": p.session_id, "isRunning": p.system_running, "currentBG": int(p.last_bg)}
+        for p in manager.sessions.values()
+    ]
+
+@app.post("/sessions")
+async def create_session(session_id: Optional[str] = None, seed: Optional[int] = None,
+                         start: bool = False, persist: bool = False):
+    try:
+        patient = manager.create(session_id, seed=seed, persist=persist)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    patient.system_running = start
+    patient.touch()
+    return {"sessionId": patient.session_id, "isRunning": patient.system_running}
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if session_id == DEFAULT_SESSION_ID:
+        raise HTTPException(status_code=400, detail="The default session cannot be deleted")
+    _session(session_id)
+    await manager.close_actuators([manager.remove(session_id)])
+    return {"status": "deleted"}
+
+@app.get("/sessions/{session_id}/state")
+async def get_session_state(session_id: str, request: Request, after: Optional[int] = None,
+                            timeout: float = LONG_POLL_TIMEOUT_SEC):
+    """
+    Cached snapshot with ETag support. With ?after=<version> the request is held
+    until the state moves past that version (or the timeout runs out).
+    `Accept: application/vnd.glucodose+binary` selects the wire.py encoding.
+    """
+    return await _serve_state(_session(session_id), request, after, timeout)
+
+async def _serve_state(patient, request: Request, after: Optional[int], timeout: float):
+    # patient is a PatientState, or a MirroredPatient in a reader worker
+    if after is not None:
+        await patient.wait_for_version(after, max(0.0, min(timeout, LONG_POLL_TIMEOUT_SEC)))
+
+    binary = wire.accepts_binary(request.headers.get("accept", ""))
+    etag = patient.etag()
+    if binary:
+        etag = etag[:-1] + '-bin"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if binary:
+        return Response(content=patient.snapshot_binary(), media_type=wire.BINARY_MEDIA_TYPE, headers=headers)
+    return Response(content=patient.snapshot_json(), media_type="application/json", headers=headers)
+
+@app.get("/sessions/{session_id}/history")
+async def get_session_history(session_id: str, t_from: int = Query(0, alias="from"),
+                              t_to: Optional[int] = Query(None, alias="to"),
+                              series: str = "glucose", limit: int = MAX_QUERY_ROWS):
+    """Range query over the persisted series; from/to are epoch ms, series is comma separated."""
+    patient = _session(session_id)
+    if patient.recorder is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' is not persisted")
+    names = [name.strip() for name in series.split(",") if name.strip()]
+    unknown = [name for name in names if name not in HistoryStore.SERIES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown series {unknown}, expected {list(HistoryStore.SERIES)}")
+    t_to = patient.now_ms() if t_to is None else t_to
+    limit = max(1, min(limit, MAX_QUERY_ROWS))
+    return {
+        "from": t_from,
+        "to": t_to,
+        "series": {name: patient.recorder.query(name, t_from, t_to, limit) for name in names},
+    }
+
+@app.get("/sessions/{session_id}/chart")
+async def get_session_chart(session_id: str, t_from: int = Query(0, alias="from"),
+                            t_to: Optional[int] = Query(None, alias="to"), series: str = "glucose,basal",
+                            points: int = DEFAULT_CHART_POINTS, method: str = "lttb"):
+    """Series downsampled to about `points` points over from/to (epoch ms), from the rollups."""
+    patient = _session(session_id)
+    if patient.charts is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' is not persisted")
+    names = [name.strip() for name in series.split(",") if name.strip()]
+    unknown = [name for name in names if name not in CHART_SERIES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown series {unknown}, expected {list(CHART_SERIES)}")
+    if method not in METHODS:
+        raise HTTPException(status_code=400, detail=f"Unknown method '{method}', expected {list(METHODS)}")
+    t_to = patient.now_ms() if t_to is None else t_to
+    points = max(3, min(points, MAX_POINTS))
+    return {
+        "from": t_from,
+        "to": t_to,
+        "method": method,
+        "series": {name: patient.charts.query(name, t_from, t_to, points, method) for name in names},
+    }
+
+@app.get("/sessions/{session_id}/forecast")
+async def get_session_forecast(session_id: str):
+    """Predicted BG curves from the newest reading; cached, so polling it is cheap."""
+    patient = _session(session_id)
+    if not patient.glucose_history:
+        raise HTTPException(status_code=404, detail="No readings to forecast from yet")
+    return {"sessionId": session_id, "version": patient.version, **forecast.predict(patient)}
+
+@app.websocket("/sessions/{session_id}/ws/glucose")
+async def ws_session_glucose(ws: WebSocket, session_id: str):
+    hub = manager.broadcasters.get(session_id)
+    if hub is None:
+        await ws.close(code=4404)
+        return
+    # Binary frames for clients that offer the wire.py subprotocol, JSON otherwise
+    protocol = wire.negotiate_subprotocol(ws.scope.get("subprotocols", []))
+    await ws.accept(subprotocol=protocol)
+    try:
+        await hub.serve(ws, binary=protocol == wire.BINARY_SUBPROTOCOL)
+    except WebSocketDisconnect: pass
+    log.event("ws.disconnect", session=session_id)
+
+@app.post("/sessions/{session_id}/spike")
+async def trigger_session_spike(session_id: str):
+    patient = _session(session_id)
+    patient.simulation_spike = True
+    patient.spike_countdown = 3
+    if patient.verbose: log.event("api.spike", session=session_id)
+    return {"status": "ok"}
+
+@app.post("/sessions/{session_id}/start")
+async def start_session(session_id: str):
+    patient = _session(session_id)
+    patient.system_running = True
+    patient.touch()
+    return {"status": "started"}
+
+@app.post("/sessions/{session_id}/stop")
+async def stop_session(session_id: str):
+    patient = _session(session_id)
+    patient.system_running = False
+    patient.touch()
+    return {"status": "stopped"}
+
+@app.post("/sessions/{session_id}/cooler")
+async def session_cooler(session_id: str):
+    patient = _session(session_id)
+    outcome, _ = cooler_control.request_cooler(patient, source="api")
+    if outcome == REJECTED:
+        raise HTTPException(status_code=429, detail="Cooler command queue is full")
+    return {"status": "cooling started" if outcome == QUEUED else "already cooling"}
+
+@app.get("/sessions/{session_id}/actuators")
+async def get_session_actuators(session_id: str):
+    patient = _session(session_id)
+    return {"motor": patient.motor_queue.stats(), "cooler": patient.cooler_queue.stats()}
+
+# --- DEMO PATIENT (the dashboard's original routes) ---
 @app.get("/state")
-async def get_state_http(): return state.get_state_snapshot()
+async def get_state_http(request: Request, after: Optional[int] = None, timeout: float = LONG_POLL_TIMEOUT_SEC):
+    if ROLE == "reader":
+        if not _mirror.ready:
+            # The writer hasn't published yet; an empty 200 would be cached and fail to parse
+            return Response(content="Waiting for the writer's first snapshot", status_code=503,
+                            headers={"Retry-After": str(READER_RETRY_AFTER_SEC)})
+        return await _serve_state(_mirror, request, after, timeout)
+    return await get_session_state(DEFAULT_SESSION_ID, request, after, timeout)
+
+@app.get("/history")
+async def get_history(t_from: int = Query(0, alias="from"), t_to: Optional[int] = Query(None, alias="to"),
+                      series: str = "glucose", limit: int = MAX_QUERY_ROWS):
+    return await get_session_history(DEFAULT_SESSION_ID, t_from, t_to, series, limit)
+
+@app.get("/chart")
+async def get_chart(t_from: int = Query(0, alias="from"), t_to: Optional[int] = Query(None, alias="to"),
+                    series: str = "glucose,basal", points: int = DEFAULT_CHART_POINTS, method: str = "lttb"):
+    return await get_session_chart(DEFAULT_SESSION_ID, t_from, t_to, series, points, method)
+
+@app.get("/forecast")
+async def get_forecast(): return await get_session_forecast(DEFAULT_SESSION_ID)
 
 @app.websocket("/ws/glucose")
 async def ws_glucose(ws: WebSocket):
-    await ws.accept()
+    if ROLE != "reader":
+        return await ws_session_glucose(ws, DEFAULT_SESSION_ID)
+    protocol = wire.negotiate_subprotocol(ws.scope.get("subprotocols", []))
+    await ws.accept(subprotocol=protocol)
     try:
-        while True:
-            snapshot = state.get_state_snapshot()
-            await ws.send_json(snapshot)
-            await asyncio.sleep(1.0) 
-    except WebSocketDisconnect: print("🔌 Client disconnected")
+        await _mirror_hub.serve(ws, binary=protocol == wire.BINARY_SUBPROTOCOL)
+    except WebSocketDisconnect: pass
+    log.event("ws.disconnect", session=DEFAULT_SESSION_ID)
 
 @app.post("/spike")
-async def trigger_spike():
-    state.simulation_spike = True
-    state.spike_countdown = 3
-    print("⚠️ MANUAL SPIKE TRIGGERED")
-    return {"status": "ok"}
+async def trigger_spike(): return await trigger_session_spike(DEFAULT_SESSION_ID)
 
 @app.post("/start")
-async def start_system():
-    state.system_running = True
-    return {"status": "started"}
+async def start_system(): return await start_session(DEFAULT_SESSION_ID)
 
 @app.post("/stop")
-async def stop_system():
-    state.system_running = False
-    return {"status": "stopped"}
+async def stop_system(): return await stop_session(DEFAULT_SESSION_ID)
 
 @app.post("/cooler")
-async def manual_cooler():
-    if state.cooler_state == "OFF":
-        asyncio.create_task(cooler_control.trigger_cooler())
-        return {"status": "cooling started"}
-    return {"status": "already cooling"}
+async def manual_cooler(): return await session_cooler(DEFAULT_SESSION_ID)
+
+@app.get("/actuators")
+async def get_actuators(): return await get_session_actuators(DEFAULT_SESSION_ID)
 
 # Serve Frontend
 if os.path.isdir("dist"):
@@ -108,4 +360,26 @@ if os.path.isdir("dist"):
 
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="GlucoDose API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="reader workers; >1 starts a shared-memory writer")
+    parser.add_argument("--writer-port", type=int, default=8001)
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        uvicorn.run(app, host=args.host, port=args.port)
+        raise SystemExit(0)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    writer_url = f"http://127.0.0.1:{args.writer_port}"
+    writer = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(args.writer_port)],
+        cwd=here, env=dict(os.environ, GLUCODOSE_ROLE="writer"))
+    # Workers are spawned processes and pick their role up from the environment
+    os.environ.update(GLUCODOSE_ROLE="reader", GLUCODOSE_WRITER_URL=writer_url)
+    try:
+        uvicorn.run("app:app", host=args.host, port=args.port, workers=args.workers, app_dir=here)
+    finally:
+        writer.terminate()
+        writer.wait()
@@ -0,0 +1,344 @@
+"""
+Benchmarks for the hot paths, reported as machine-readable JSON.
+
+    python bench.py                              # run everything, JSON to stdout
+    python bench.py --out baseline.json          # save a baseline
+    python bench.py --compare baseline.json      # exit 1 if anything regressed
+    python bench.py --only physics,snapshot --quick
+
+Each result has ops_per_sec and, for the synchronous paths, allocation
+figures from a second pass under tracemalloc: net_blocks_per_op (memory
+blocks still alive afterwards, i.e. growth) and peak_kib (transient peak
+above the starting point). motor.loop_lag reports how late a 10 ms timer
+fires while motor_pulse talks to a local fake relay.
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+import state
+import fake_oref1
+import glucose_simulator
+import motor_control
+from broadcast import GlucoseBroadcaster
+from fake_relay import FakeRelayServer, _probe_lag, _start_in_thread
+from hardware import relay
+from ringbuffer import basal_ring, glucose_ring
+
+# --- CONFIGURATION ---
+SNAPSHOT_SIZES = (180, 1000, 10000)
+FANOUT_CLIENTS = (1, 100, 1000)
+REGRESSION_THRESHOLD = 0.10      # --compare fails on >10% worse
+REPEATS = 3                      # best-of-N timing, to keep --compare out of the noise
+RELAY_LATENCY_SEC = 0.05
+BENCH_PULSE_SEC = 0.02           # motor_pulse's 10 s "movement" shortened for the bench
+
+# Metrics where a smaller number is better; everything else compared is ops_per_sec
+LOWER_IS_BETTER = ("lag_max_ms", "lag_p99_ms", "lag_mean_ms")
+LAG_NOISE_FLOOR_MS = 1.0         # lag changes smaller than this are timer noise, never a regression
+
+
+def _time_ops(run: Callable[[int], None], ops: int) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        gc.collect()
+        start = time.perf_counter()
+        run(ops)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _allocations(run: Callable[[int], None], ops: int) -> Dict[str, float]:
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    run(ops)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    return {
+        "net_blocks_per_op": round((sys.getallocatedblocks() - blocks_before) / ops, 3),
+        "peak_kib": round((peak - base) / 1024, 1),
+    }
+
+
+def _measure(run: Callable[[int], None], ops: int, alloc_ops: int) -> Dict[str, Any]:
+    run(max(1, ops // 20))   # warm-up
+    elapsed = _time_ops(run, ops)
+    result = {"ops": ops, "ops_per_sec": round(ops / elapsed, 1), "us_per_op": round(elapsed / ops * 1e6, 3)}
+    result.update(_allocations(run, alloc_ops))
+    return result
+
+
+# --- Benchmarks ---
+def bench_physics(quick: bool) -> Dict[str, Dict[str, Any]]:
+    patient = state.PatientState("bench-physics", seed=1)
+    bg = [state.START_BG]
+
+    def run(ops):
+        step = glucose_simulator._step_bg_physics
+        for i in range(ops):
+            if i % 12 == 0:
+                patient.insulin.add_dose(motor_control.SAFE_PHYSICS_DOSE)
+            bg[0] = step(patient, bg[0])
+
+    ops = 20_000 if quick else 200_000
+    return {"physics.step": _measure(run, ops, ops // 10)}
+
+
+def bench_decision(quick: bool) -> Dict[str, Dict[str, Any]]:
+    """One oref1_tick per op, cycling DELIVER / in-range / SUSPEND; no sleeps involved."""
+    patient = state.PatientState("bench-oref1", seed=1)
+    glucose_simulator.seed_glucose_history(patient)
+    scenarios = (250.0, 105.0, 85.0)
+
+    def run(ops):
+        for i in range(ops):
+            patient.last_bg = scenarios[i % 3]
+            fake_oref1.oref1_tick(patient)
+        # DELIVER only flags the actuation phase, which is not part of the decision
+        patient.pending_delivery = False
+
+    ops = 5_000 if quick else 50_000
+    return {"oref1.decision": _measure(run, ops, ops // 10)}
+
+
+def _patient_with_history(rows: int) -> state.PatientState:
+    patient = state.PatientState(f"bench-snapshot-{rows}", seed=1)
+    patient.glucose_history = glucose_ring(rows)
+    patient.basal_history = basal_ring(rows)
+    t0 = patient.now_ms() - rows * 5000
+    for i in range(rows):
+        patient.glucose_history.append(ts=t0 + i * 5000, bg=100 + i % 80, trend="Flat")
+        patient.basal_history.append(ts=t0 + i * 5000, rate=1.0, duration=30,
+                                     eventualBG=110, reason="Pred 110 is safe.")
+    patient.last_bg = 110.0
+    return patient
+
+
+def bench_snapshot(quick: bool) -> Dict[str, Dict[str, Any]]:
+    """Uncached state.get_state_snapshot() + JSON or wire.py encoding (the /state miss path)."""
+    results = {}
+    for rows in SNAPSHOT_SIZES:
+        patient = _patient_with_history(rows)
+        for name, encode in (("json", patient.snapshot_json), ("binary", patient.snapshot_binary)):
+
+            def run(ops, encode=encode):
+                for _ in range(ops):
+                    patient.touch()
+                    encode()
+
+            ops = max(20, (2_000 if quick else 20_000) * 180 // rows)
+            result = _measure(run, ops, max(5, ops // 10))
+            result["bytes"] = len(encode())
+            results[f"snapshot.{name}[{rows}]"] = result
+    return results
+
+
+class _NullSocket:
+    """Stands in for a websocket: send_text() only counts, receive() never disconnects."""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self._closed = asyncio.Event()
+
+    async def receive(self) -> dict:
+        await self._closed.wait()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send_text(self, text: str) -> None:
+        self.frames += 1
+        self.bytes += len(text)
+
+
+async def _fanout(clients: int, rounds: int) -> Dict[str, Any]:
+    patient = state.PatientState(f"bench-ws-{clients}", seed=1)
+    glucose_simulator.seed_glucose_history(patient)
+    hub = GlucoseBroadcaster(patient)
+    sockets = [_NullSocket() for _ in range(clients)]
+    tasks = [asyncio.create_task(hub.serve(ws)) for ws in sockets]
+
+    async def drain():
+        while any(not sub.queue.empty() for sub in hub.subscribers) or len(hub.subscribers) < clients:
+            await asyncio.sleep(0)
+
+    await drain()   # initial snapshot frames
+    sent_before = sum(ws.bytes for ws in sockets)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        glucose_simulator.glucose_tick(patient)
+        hub.tick()
+        await drain()
+    elapsed = time.perf_counter() - start
+    sent = sum(ws.bytes for ws in sockets) - sent_before
+    resyncs = sum(sub.resyncs for sub in hub.subscribers)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        "rounds": rounds,
+        "ops_per_sec": round(rounds / elapsed, 1),
+        "frames_per_sec": round(rounds * clients / elapsed, 1),
+        "us_per_round": round(elapsed / rounds * 1e6, 1),
+        "bytes_per_round": round(sent / rounds, 1),
+        "resyncs": resyncs,
+    }
+
+
+def bench_fanout(quick: bool) -> Dict[str, Dict[str, Any]]:
+    """A delta broadcast per round, delivered through serve() to N in-process clients."""
+    results = {}
+    for clients in FANOUT_CLIENTS:
+        rounds = max(20, (200 if quick else 2_000) // max(1, clients // 10))
+        result = max((asyncio.run(_fanout(clients, rounds)) for _ in range(REPEATS)),
+                     key=lambda r: r["ops_per_sec"])
+        result.update(_allocations(lambda n, c=clients: asyncio.run(_fanout(c, n)), max(5, rounds // 4)))
+        results[f"ws.fanout[{clients}]"] = result
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _motor_lag(pulses: int) -> Dict[str, Any]:
+    server = FakeRelayServer(port=_free_port(), latency=RELAY_LATENCY_SEC)
+    _start_in_thread(server)
+    relay.base_url = f"http://{server.host}:{server.port}"
+    await relay.open()
+
+    patient = state.PatientState("bench-motor", seed=1, hardware=True)
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe_lag(stop))
+    start = time.perf_counter()
+    for _ in range(pulses):
+        await motor_control.motor_pulse(patient)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lags = sorted(await probe)
+    await relay.aclose()
+    return {
+        "pulses": pulses,
+        "relay_latency_ms": RELAY_LATENCY_SEC * 1000,
+        "us_per_pulse": round(elapsed / pulses * 1e6, 1),
+        "lag_max_ms": round(lags[-1], 2),
+        "lag_p99_ms": round(lags[int(0.99 * (len(lags) - 1))], 2),
+        "lag_mean_ms": round(statistics.mean(lags), 3),
+        "samples": len(lags),
+    }
+
+
+def bench_motor(quick: bool) -> Dict[str, Dict[str, Any]]:
+    """Event-loop lag while motor_pulse's relay calls are in flight."""
+    original = motor_control.MOTOR_PULSE_DURATION_SEC
+    motor_control.MOTOR_PULSE_DURATION_SEC = BENCH_PULSE_SEC
+    try:
+        return {"motor.loop_lag": asyncio.run(_motor_lag(5 if quick else 20))}
+    finally:
+        motor_control.MOTOR_PULSE_DURATION_SEC = original
+
+
+BENCHMARKS = {
+    "physics": bench_physics,
+    "decision": bench_decision,
+    "snapshot": bench_snapshot,
+    "fanout": bench_fanout,
+    "motor": bench_motor,
+}
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(names: List[str], quick: bool) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    # Keep stdout for the JSON report; the code under test prints as it runs
+    with contextlib.redirect_stdout(sys.stderr):
+        for name in names:
+            print(f"⏱️ {name}...")
+            results.update(BENCHMARKS[name](quick))
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Prints a table of changes; returns False if any metric regressed past the threshold."""
+    ok = True
+    print(f"{'benchmark':<26} {'metric':<14} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<26} {'(new)':<14}")
+            continue
+        for metric in ("ops_per_sec",) + LOWER_IS_BETTER:
+            if metric not in result or metric not in base or not base[metric]:
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            worse = -change if metric == "ops_per_sec" else change
+            flag = ""
+            if metric in LOWER_IS_BETTER and abs(result[metric] - base[metric]) < LAG_NOISE_FLOOR_MS:
+                worse = 0.0
+            if worse > threshold:
+                flag, ok = "  ❌", False
+            print(f"{name:<26} {metric:<14} {base[metric]:>12.1f} {result[metric]:>12.1f} {change:>+7.1%}{flag}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hot-path benchmarks")
+    parser.add_argument("--only", help=f"comma-separated subset of {','.join(BENCHMARKS)}")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, for a smoke run")
+    parser.add_argument("--out", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against a saved results file")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    selected = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    report = run(selected, args.quick)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.out}", file=sys.stderr)
+    elif not args.compare:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.threshold):
+            raise SystemExit(1)
@@ -0,0 +1,174 @@
+import asyncio
+import functools
+import json
+import time
+from typing import Any, Dict, Optional, Set, Union
+
+from metrics import WS_BYTES, WS_CLIENTS, WS_FRAMES, WS_RESYNCS, WS_SEND
+import wire
+
+# --- CONFIGURATION ---
+BROADCAST_INTERVAL_SEC = 1.0
+
+# Frames a client may fall behind before it is dropped back to a full snapshot
+CLIENT_QUEUE_SIZE = 8
+
+# History series that are streamed as appended rows instead of being resent
+HISTORY_KEYS = ("glucoseHistory", "basalHistory")
+
+
+def _encode(frame: Dict[str, Any]) -> str:
+    return json.dumps(frame, separators=(",", ":"))
+
+
+async def _until_disconnect(ws) -> None:
+    """Read and ignore client messages until the client goes away."""
+    try:
+        while (await ws.receive())["type"] != "websocket.disconnect":
+            pass
+    except Exception:
+        pass   # receiving on a socket that already failed: gone either way
+
+
+class Subscriber:
+    """One websocket client: a bounded queue of already-encoded frames, JSON text or wire.py bytes."""
+
+    def __init__(self, maxsize: int = CLIENT_QUEUE_SIZE, binary: bool = False):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.binary = binary
+        self.resyncs = 0
+
+    def offer(self, frame: str, full_frame) -> None:
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop the backlog and start over from a full
+            # snapshot, otherwise the client would apply deltas to a stale base.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(full_frame())
+            self.resyncs += 1
+            WS_RESYNCS.inc()
+
+
+class GlucoseBroadcaster:
+    """
+    Builds the /ws/glucose payload once per tick and fans it out to every client.
+    New clients get one 'snapshot' frame, after that only 'delta' frames with the
+    new glucose points, new basal recs and the scalar fields that changed.
+    Each frame is encoded once per format that has subscribers (JSON, and
+    wire.py binary for clients that negotiated it).
+    """
+
+    def __init__(self, source, queue_size: int = CLIENT_QUEUE_SIZE):
+        # A PatientState, or anything exposing version, get_state_snapshot() and the two history rings
+        self.source = source
+        self.queue_size = queue_size
+        self.subscribers: Set[Subscriber] = set()
+
+        self._fields: Dict[str, Any] = {}
+        # Ring sequence number of the newest row already streamed, per series
+        self._last_seq: Dict[str, Optional[int]] = {key: None for key in HISTORY_KEYS}
+        self._full_frames: Dict[bool, Union[str, bytes]] = {}
+        self._full_frame_of = {binary: functools.partial(self.full_frame, binary) for binary in (False, True)}
+        self._version: Optional[int] = None
+
+    def _histories(self) -> Dict[str, Any]:
+        return {
+            "glucoseHistory": self.source.glucose_history,
+            "basalHistory": self.source.basal_history,
+        }
+
+    def full_frame(self, binary: bool = False) -> Union[str, bytes]:
+        """Encoded full snapshot, built at most once per tick and format however many clients join."""
+        if binary not in self._full_frames:
+            # The snapshot reflects the last tick, so the next delta applies on top of it
+            if not self._fields:
+                self._fields = self.source.get_state_snapshot(include_history=False)
+            histories = self._histories()
+            for key, hist in histories.items():
+                if self._last_seq[key] is None:
+                    self._last_seq[key] = hist.seq
+            limits = {key: hist.maxlen for key, hist in histories.items()}
+            if binary:
+                columns = [hist.slice(upto_seq=self._last_seq[key]) for key, hist in histories.items()]
+                self._full_frames[binary] = wire.encode(wire.SNAPSHOT, self._fields, *columns, limits=limits)
+            else:
+                frame = {"type": "snapshot", **self._fields}
+                for key, hist in histories.items():
+                    frame[key] = hist.rows(upto_seq=self._last_seq[key])
+                frame["historyLimits"] = limits
+                self._full_frames[binary] = _encode(frame)
+        return self._full_frames[binary]
+
+    def subscribe(self, binary: bool = False) -> Subscriber:
+        sub = Subscriber(self.queue_size, binary)
+        sub.queue.put_nowait(self.full_frame(binary))
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self.subscribers.discard(sub)
+
+    def tick(self) -> None:
+        """Diff the source against the last broadcast and push one delta to all clients."""
+        if self.source.version == self._version:
+            return  # nothing changed since the last frame
+        self._version = self.source.version
+        self._full_frames.clear()
+        scalars = self.source.get_state_snapshot(include_history=False)
+        changed = {k: v for k, v in scalars.items() if self._fields.get(k) != v}
+        self._fields = scalars
+
+        histories = self._histories()
+        spans = {}
+        for key, hist in histories.items():
+            spans[key] = (self._last_seq[key], hist.seq)
+            self._last_seq[key] = hist.seq
+
+        if not self.subscribers:
+            return
+        formats = {sub.binary for sub in self.subscribers}
+        encoded: Dict[bool, Union[str, bytes]] = {}
+        if False in formats:
+            frame: Dict[str, Any] = {"type": "delta", "fields": changed}
+            for key, hist in histories.items():
+                frame[key] = hist.rows(*spans[key])
+            encoded[False] = _encode(frame)
+        if True in formats:
+            columns = [hist.slice(*spans[key]) for key, hist in histories.items()]
+            encoded[True] = wire.encode(wire.DELTA, changed, *columns)
+        for sub in self.subscribers:
+            sub.offer(encoded[sub.binary], self._full_frame_of[sub.binary])
+
+    async def _pump(self, ws, sub: Subscriber) -> None:
+        send = ws.send_bytes if sub.binary else ws.send_text
+        while True:
+            frame = await sub.queue.get()
+            started = time.perf_counter()
+            await send(frame)
+            WS_SEND.observe(time.perf_counter() - started)
+            WS_FRAMES.inc()
+            WS_BYTES.inc(len(frame))
+
+    async def serve(self, ws, binary: bool = False) -> None:
+        """
+        Pump one client's queue into its websocket until it disconnects.
+        Returns once the client closes; a failed send raises as before.
+        """
+        sub = self.subscribe(binary)
+        WS_CLIENTS.inc()
+        # Unchanged versions send nothing, so a failed send can't be relied on to
+        # notice a closed client: watch the receive side for the disconnect too
+        pump = asyncio.ensure_future(self._pump(ws, sub))
+        watcher = asyncio.ensure_future(_until_disconnect(ws))
+        try:
+            done, _ = await asyncio.wait({pump, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if pump in done:
+                pump.result()
+        finally:
+            # No await in here: under anyio a cancelled caller is cancelled again at every await
+            pump.cancel()
+            watcher.cancel()
+            WS_CLIENTS.dec()
+            self.unsubscribe(sub)
@@ -0,0 +1,288 @@
+"""
+Binary checkpoints of a patient's simulation and controller state, so a
+redeploy picks the trajectory up where it stopped instead of re-seeding 180
+flat readings at START_BG with an empty insulin ledger.
+
+A checkpoint holds the glucose and basal histories, the insulin model (dose
+ring, running sums, ledger), the physics and device RNG states, the trend accumulators, the last
+delivery/decision times, the cooler and temperature state and the motor
+pulses owed: a pending delivery, a queued pulse or one that was running but
+had not dosed yet. Those are re-queued on start, as a cooler cycle in
+progress is resumed, so the IOB ledger doesn't silently lose them.
+Deliberately not restored: isRunning.
+
+The physics doesn't run while the process is down, so a restored patient
+resumes from the checkpointed instant; its history simply has a gap.
+
+File layout (little endian):
+
+    0   magic       4s   b"GDCK"
+    4   layout      u16  LAYOUT_VERSION
+    6   reserved    u16
+    8   crc32       u32  of the payload
+    12  length      u32  payload bytes
+    16  payload     session id, scalars, RNGs, insulin model, histories
+
+Files are written to a temp name, fsynced and renamed over the previous
+checkpoint, so a crash mid-write leaves the last good one in place. A file
+that fails the magic, layout, CRC or session/insulin-curve checks is
+rejected and the patient is seeded as before.
+"""
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from eventlog import log
+from insulin_model import Dose
+from state import PatientState
+
+# --- CONFIGURATION ---
+CHECKPOINT_INTERVAL_SEC = 30.0
+CHECKPOINT_FILE = "checkpoint.bin"
+LAYOUT_VERSION = 3
+
+_MAGIC = b"GDCK"
+_HEADER = struct.Struct("<4sHHII")
+# saved_at, last_bg, trend_drift, smoothed_trend, last_delivery_time, last_decision_time,
+# insulin_temperature, suggested_rate, last_plunger_mm, last_motor_rotations, last_bolus_amount,
+# last_encoder_pulses, spike_countdown, simulation_spike, cooler_seconds_left, pulses_owed
+_SCALARS = struct.Struct("<11dqi?ii")
+_RNG = struct.Struct("<i625I?d")
+# dia, peak, tick_seconds, ticks, tick, pending, sum, x0, x1, x2, iob, activity, total_units
+_INSULIN = struct.Struct("<3d2q8d")
+_COUNT = struct.Struct("<I")
+_TEXT = struct.Struct("<H")
+_LEDGER_DTYPE = np.dtype([("ts", "<i8"), ("units", "<f8"), ("tick", "<i8")])
+
+
+class _Writer:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def pack(self, fmt: struct.Struct, *values) -> None:
+        self.buf += fmt.pack(*values)
+
+    def text(self, value: str) -> None:
+        data = value.encode("utf-8")
+        self.pack(_TEXT, len(data))
+        self.buf += data
+
+    def array(self, values: np.ndarray) -> None:
+        self.buf += np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("<")).tobytes()
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def take(self, size: int) -> memoryview:
+        if self.pos + size > len(self.data):
+            raise ValueError("checkpoint payload is truncated")
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        return fmt.unpack(self.take(fmt.size))
+
+    def text(self) -> str:
+        return bytes(self.take(self.unpack(_TEXT)[0])).decode("utf-8")
+
+    def array(self, dtype, count: int) -> np.ndarray:
+        dtype = np.dtype(dtype).newbyteorder("<")
+        return np.frombuffer(self.take(dtype.itemsize * count), dtype=dtype).copy()
+
+
+def _write_ring(w: _Writer, ring) -> None:
+    w.pack(_COUNT, len(ring))
+    for name in ring.columns:
+        values = ring.raw(name)
+        if values.dtype == object:
+            for value in values:
+                w.text(value)
+        else:
+            w.array(values)
+
+
+def _read_ring(r: _Reader, ring) -> Dict[str, object]:
+    count = r.unpack(_COUNT)[0]
+    columns = {}
+    for name in ring.columns:
+        dtype = ring.view(name).dtype
+        columns[name] = [r.text() for _ in range(count)] if dtype == object else r.array(dtype, count)
+    return columns
+
+
+def _pulses_owed(patient: PatientState) -> int:
+    """Deliveries decided but not yet added to the insulin model."""
+    queue = patient.motor_queue
+    return (patient.pulses_owed + int(patient.pending_delivery) + len(queue.pending)
+            + (queue.running is not None))
+
+
+def encode(patient: PatientState) -> bytes:
+    """Serialize the patient. Runs on the event loop, so the state can't move underneath it."""
+    w = _Writer()
+    w.text(patient.session_id)
+    w.pack(_SCALARS, patient.clock.time(), patient.last_bg, patient.trend_drift, patient.smoothed_trend,
+           patient.last_delivery_time, patient.last_decision_time, patient.insulin_temperature,
+           patient.suggested_rate, patient.last_plunger_mm, patient.last_motor_rotations,
+           patient.last_bolus_amount, patient.last_encoder_pulses, patient.spike_countdown,
+           patient.simulation_spike, patient.cooler_seconds_left if patient.cooler_state == "ON" else 0,
+           _pulses_owed(patient))
+
+    for rng in (patient.rng, patient.device_rng):
+        version, internal, gauss = rng.getstate()
+        w.pack(_RNG, version, *internal, gauss is not None, gauss or 0.0)
+
+    model = patient.insulin
+    curve = model.curve
+    w.pack(_INSULIN, curve.dia_minutes, curve.peak_minutes, curve.tick_seconds, curve.ticks, model._tick,
+           model._pending, model._sum, *model._x, model.iob, model.activity, model.total_units)
+    w.array(model._ring)
+    w.pack(_COUNT, len(model.ledger))
+    w.array(np.array([tuple(dose) for dose in model.ledger], dtype=_LEDGER_DTYPE))
+
+    _write_ring(w, patient.glucose_history)
+    _write_ring(w, patient.basal_history)
+
+    payload = bytes(w.buf)
+    return _HEADER.pack(_MAGIC, LAYOUT_VERSION, 0, zlib.crc32(payload), len(payload)) + payload
+
+
+def decode_into(patient: PatientState, data: bytes) -> float:
+    """
+    Validate a checkpoint and apply it to a freshly created patient. Everything
+    is decoded and checked before the patient is touched, so a bad file leaves
+    it as it was. Returns the clock time the checkpoint was taken at.
+    """
+    if len(data) < _HEADER.size:
+        raise ValueError("checkpoint is shorter than its header")
+    magic, layout, _, crc, length = _HEADER.unpack_from(data)
+    if magic != _MAGIC or layout != LAYOUT_VERSION:
+        raise ValueError(f"not a layout {LAYOUT_VERSION} GlucoDose checkpoint")
+    payload = data[_HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise ValueError("checkpoint failed its CRC check")
+
+    r = _Reader(payload)
+    session_id = r.text()
+    if session_id != patient.session_id:
+        raise ValueError(f"checkpoint belongs to session '{session_id}'")
+    scalars = r.unpack(_SCALARS)
+    rngs = [r.unpack(_RNG) for _ in range(2)]
+    insulin = r.unpack(_INSULIN)
+    curve = patient.insulin.curve
+    if insulin[:4] != (curve.dia_minutes, curve.peak_minutes, curve.tick_seconds, curve.ticks):
+        raise ValueError("checkpoint was taken with a different insulin curve")
+    dose_ring = r.array(np.float64, curve.ticks)
+    ledger = r.array(_LEDGER_DTYPE, r.unpack(_COUNT)[0])
+    glucose = _read_ring(r, patient.glucose_history)
+    basal = _read_ring(r, patient.basal_history)
+    if r.pos != len(payload):
+        raise ValueError("checkpoint has trailing bytes")
+
+    (saved_at, patient.last_bg, patient.trend_drift, patient.smoothed_trend, patient.last_delivery_time,
+     patient.last_decision_time, patient.insulin_temperature, patient.suggested_rate, patient.last_plunger_mm,
+     patient.last_motor_rotations, patient.last_bolus_amount, patient.last_encoder_pulses,
+     patient.spike_countdown, patient.simulation_spike, patient.cooler_seconds_left, patient.pulses_owed) = scalars
+    for rng, saved in zip((patient.rng, patient.device_rng), rngs):
+        rng.setstate((saved[0], tuple(saved[1:626]), saved[627] if saved[626] else None))
+
+    model = patient.insulin
+    model._tick, model._pending, model._sum = insulin[4], insulin[5], insulin[6]
+    model._x = list(insulin[7:10])
+    model.iob, model.activity, model.total_units = insulin[10:13]
+    model._ring = dose_ring
+    model.ledger.clear()
+    model.ledger.extend(Dose(int(d["ts"]), float(d["units"]), int(d["tick"])) for d in ledger)
+
+    patient.glucose_history.load(glucose)
+    patient.basal_history.load(basal)
+    patient.touch()
+    return saved_at
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Temp file + fsync + rename, then fsync the directory so the rename itself is durable."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def checkpoint_path(patient: PatientState) -> Optional[str]:
+    """Checkpoints live next to the session's persisted history."""
+    return os.path.join(patient.recorder.root, CHECKPOINT_FILE) if patient.recorder else None
+
+
+def restore(patient: PatientState, path: str) -> bool:
+    """Warm-start the patient from `path`. False (patient untouched) if there is no usable checkpoint."""
+    if not os.path.exists(path):
+        return False
+    started = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            saved_at = decode_into(patient, f.read())
+    except (OSError, ValueError, struct.error) as e:
+        log.event("checkpoint.rejected", session=patient.session_id, path=path, error=str(e))
+        return False
+    log.event("checkpoint.restored", session=patient.session_id, bg=int(patient.last_bg),
+              iob=round(patient.current_iob, 3), age_sec=round(patient.clock.time() - saved_at, 1),
+              ms=round((time.perf_counter() - started) * 1000, 2))
+    return True
+
+
+class Checkpointer:
+    """
+    Scheduler job body: encode every persisted patient that changed since its
+    last checkpoint and hand the bytes to a single writer thread. One thread
+    keeps the renames in submission order; a patient whose previous write is
+    still in flight is skipped until the next period rather than queued.
+    """
+
+    def __init__(self, sessions: Dict[str, PatientState]):
+        self.sessions = sessions
+        self._saved: Dict[str, int] = {}
+        self._writes: Dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+
+    def _due(self) -> List[PatientState]:
+        return [p for p in self.sessions.values()
+                if p.recorder is not None and self._saved.get(p.session_id) != p.version]
+
+    def tick(self) -> None:
+        for patient in self._due():
+            write = self._writes.get(patient.session_id)
+            if write is not None and not write.done():
+                continue
+            self._saved[patient.session_id] = patient.version
+            write = self._executor.submit(write_atomic, checkpoint_path(patient), encode(patient))
+            write.add_done_callback(lambda f, sid=patient.session_id: self._failed(sid, f))
+            self._writes[patient.session_id] = write
+
+    def _failed(self, session_id: str, write: Future) -> None:
+        if write.exception() is not None:
+            self._saved.pop(session_id, None)    # retry on the next period
+            log.event("checkpoint.write_error", session=session_id, error=repr(write.exception()))
+
+    def flush(self) -> None:
+        """Final synchronous checkpoint, on shutdown, after any write still in flight."""
+        for write in self._writes.values():
+            write.exception()
+        for patient in self._due():
+            write_atomic(checkpoint_path(patient), encode(patient))
+            self._saved[patient.session_id] = patient.version
@@ -0,0 +1,115 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Optional, Tuple
+
+# Fallback number of loop passes per settle on loops without a ready queue
+SETTLE_PASSES = 64
+
+
+class Clock:
+    """Time source for the simulation: wall-clock epoch seconds plus sleep."""
+
+    def time(self) -> float:
+        raise NotImplementedError
+
+    async def sleep(self, seconds: float) -> None:
+        raise NotImplementedError
+
+    async def sleep_until(self, when: float) -> None:
+        """Sleep to an absolute deadline (epoch seconds), for drift-free periodic work."""
+        raise NotImplementedError
+
+
+class RealClock(Clock):
+    def time(self) -> float:
+        return time.time()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    async def sleep_until(self, when: float) -> None:
+        await asyncio.sleep(max(0.0, when - time.time()))
+
+
+def _loop_is_idle(loop: asyncio.AbstractEventLoop) -> Optional[bool]:
+    # asyncio keeps runnable callbacks in loop._ready; None means we can't tell
+    ready = getattr(loop, "_ready", None)
+    return None if ready is None else not ready
+
+
+class VirtualClock(Clock):
+    """
+    Discrete-event clock. Sleepers queue up on a heap and time only advances
+    when every task is parked on the clock, then jumps straight to the next
+    wake-up. Wake-ups at the same instant fire deadline sleepers first, then
+    in the order they were scheduled, so a run is fully determined by its
+    seeds. Deadline sleepers go first because on a real clock a relative
+    sleep always starts a little after the instant it was computed from.
+    """
+
+    def __init__(self, start: Optional[float] = None):
+        self._now = time.time() if start is None else start
+        self._heap: List[Tuple[float, int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    def time(self) -> float:
+        return self._now
+
+    async def _wait(self, when: float, rank: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (max(self._now, when), rank, next(self._seq), future))
+        await future
+
+    async def sleep(self, seconds: float) -> None:
+        await self._wait(self._now + max(0.0, seconds), 1)
+
+    async def sleep_until(self, when: float) -> None:
+        await self._wait(when, 0)
+
+    async def _settle(self) -> None:
+        """Yield until every runnable task has reached its next clock.sleep()."""
+        loop = asyncio.get_running_loop()
+        for _ in range(SETTLE_PASSES):
+            await asyncio.sleep(0)
+            if _loop_is_idle(loop):
+                return
+
+    async def run_until(self, end: float) -> None:
+        """Drive all clock sleepers until virtual time reaches `end`."""
+        while True:
+            await self._settle()
+            while self._heap and self._heap[0][3].done():
+                heapq.heappop(self._heap)  # sleeper was cancelled
+            if not self._heap or self._heap[0][0] > end:
+                break
+            when, _, _, future = heapq.heappop(self._heap)
+            self._now = when
+            future.set_result(None)
+        self._now = max(self._now, end)
+
+    async def run_for(self, seconds: float) -> None:
+        await self.run_until(self._now + seconds)
+
+
+class ManualClock(Clock):
+    """Time is whatever the driver last set; for synchronous replays where nothing sleeps."""
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def set(self, now: float) -> None:
+        self.now = now
+
+    async def sleep(self, seconds: float) -> None:
+        raise RuntimeError("ManualClock can't sleep; advance it with set()")
+
+    async def sleep_until(self, when: float) -> None:
+        raise RuntimeError("ManualClock can't sleep; advance it with set()")
+
+
+REAL_CLOCK = RealClock()
@@ -1,37 +1,78 @@
-import asyncio
-import requests
-import state
+from typing import Optional, Tuple
+from state import PatientState
+from hardware import relay
+from eventlog import log
+from events import COOLER_CHANGED
+from tracing import now_ns, tracer
+from actuators import Command
 
 # Cooler runs for 5 seconds
 COOLER_DURATION = 30
 
-def _hardware_cooler_on():
-    try:
-        # Example URL for your relay
-        requests.get("http://192.168.1.17/cooler/on", timeout=1) 
-        print("[HARDWARE] Cooler ON")
-    except: pass
+async def _hardware_cooler_on():
+    result = await relay.call("/cooler/on")
+    log.event("hardware.cooler", state="ON", ok=result.ok, latency_ms=round(result.latency_ms, 1), error=result.error)
+    return result
 
-def _hardware_cooler_off():
-    try:
-        requests.get("http://192.168.1.17/cooler/off", timeout=1)
-        print("[HARDWARE] Cooler OFF")
-    except: pass
+async def _hardware_cooler_off():
+    result = await relay.call("/cooler/off")
+    log.event("hardware.cooler", state="OFF", ok=result.ok, latency_ms=round(result.latency_ms, 1), error=result.error)
+    return result
 
-async def trigger_cooler():
-    print("❄️ COOLER SEQUENCE STARTED")
-    state.cooler_state = "ON"
-    _hardware_cooler_on()
+async def trigger_cooler(patient: PatientState, seconds: int = COOLER_DURATION):
+    """Run the cooler for `seconds`; a restored checkpoint resumes with the seconds it had left."""
+    if patient.verbose: log.event("cooler.start", session=patient.session_id)
+    cycle_started = now_ns()
+    patient.cooler_state = "ON"
+    patient.touch()
+    patient.events.publish(COOLER_CHANGED, patient, ts=patient.now_ms(), state="ON")
+    if patient.recorder: patient.recorder.record_event(patient.now_ms(), "cooler", "ON")
+    if patient.hardware: await _hardware_cooler_on()
     
     # While cooler is on, drop the temp in state for visual effect
     # Drop temp by 2 degrees over 5 seconds
-    start_temp = state.insulin_temperature
+    start_temp = patient.insulin_temperature
     
-    for _ in range(COOLER_DURATION):
-        await asyncio.sleep(1)
-        # Visually drop temp while cooling
-        state.insulin_temperature -= 0.1
-        
-    state.cooler_state = "OFF"
-    _hardware_cooler_off()
-    print("❄️ COOLER SEQUENCE END")
\ No newline at end of file
+    patient.cooler_seconds_left = seconds
+    # A cancelled cycle (timeout, shutdown) still switches the relay off
+    try:
+        while patient.cooler_seconds_left > 0:
+            await patient.clock.sleep(1)
+            # Visually drop temp while cooling
+            patient.insulin_temperature -= 0.1
+            patient.cooler_seconds_left -= 1
+            patient.touch()
+    finally:
+        patient.cooler_state = "OFF"
+        patient.touch()
+        patient.events.publish(COOLER_CHANGED, patient, ts=patient.now_ms(), state="OFF")
+        if patient.recorder: patient.recorder.record_event(patient.now_ms(), "cooler", "OFF")
+        if patient.hardware: await _hardware_cooler_off()
+    tracer.async_span("cooler.cycle", patient.session_id, cycle_started, seconds=seconds,
+                      temperature=round(patient.insulin_temperature, 2))
+    if patient.verbose: log.event("cooler.end", session=patient.session_id)
+
+def request_cooler(patient: PatientState, seconds: int = COOLER_DURATION,
+                   source: str = "api") -> Tuple[str, Optional[Command]]:
+    """Queue a cooling cycle; while one is queued or running, another request joins it."""
+    return patient.cooler_queue.submit("cycle", lambda: trigger_cooler(patient, seconds), source)
+
+# --- TEMPERATURE / HEAT SIMULATION ---
+def temperature_tick(patient: PatientState):
+    """
+    Simulates the device heating up slowly over time.
+    This forces the user to use the 'COOL' button.
+    """
+    # Only heat up if the cooler is OFF
+    if patient.cooler_state == "OFF":
+        # Add small incremental heat (Simulating motor heat/battery heat)
+        # 0.005 to 0.02 degrees per second
+        # This causes the display (rounded to 0.1) to tick up every ~10 seconds.
+        heat_creep = patient.device_rng.uniform(0.005, 0.002)
+        shown = round(patient.insulin_temperature, 1)
+        patient.insulin_temperature += heat_creep
+        # Only a change in the displayed value is a new version
+        if round(patient.insulin_temperature, 1) != shown:
+            patient.touch()
+
+    # If Cooler is ON, trigger_cooler handles the rapid drop.
\ No newline at end of file
@@ -0,0 +1,245 @@
+"""
+Shape-preserving downsampling for the chart endpoints.
+
+Every charted series keeps a stack of rollup levels that are updated as
+points arrive: the newest raw points, then 1 min, 5 min, 15 min, 1 h and
+4 h buckets. Each bucket stores its min and max points (value and ts) plus
+sum and count. A query picks the finest level whose buckets in the window
+number at most OVERSAMPLE x the requested points, takes each bucket's min
+and max points as candidates, and reduces those with LTTB or min/max
+bucketing. The work depends on the requested point count, not the window
+length, so 7 days at 500 points costs the same as 1 hour.
+
+    GET /chart?series=glucose,basal&from=<ms>&to=<ms>&points=500&method=lttb
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from ringbuffer import ColumnRing
+
+# --- CONFIGURATION ---
+LEVEL_WIDTHS_SEC = (0, 60, 300, 900, 3600, 4 * 3600)   # 0 = raw points
+LEVEL_CAPACITY = 4096          # buckets per level: ~5.7 h raw at 5 s ... ~680 days of 4 h
+OVERSAMPLE = 4                 # buckets per requested point before a coarser level is used
+MAX_POINTS = 5000
+METHODS = ("lttb", "minmax")
+
+# Charted series -> the value key of their rows, as in the snapshot histories
+CHART_SERIES = {"glucose": "bg", "basal": "rate"}
+
+_BUCKET_SCHEMA = [("ts", np.int64), ("lo", np.float64), ("lo_ts", np.int64),
+                  ("hi", np.float64), ("hi_ts", np.int64), ("sum", np.float64), ("count", np.int32)]
+
+
+# --- ALGORITHMS ---
+def lttb(ts: np.ndarray, values: np.ndarray, points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Largest-Triangle-Three-Buckets: keep the point forming the largest triangle per bucket."""
+    n = len(ts)
+    if points >= n or points < 3:
+        return ts, values
+    x = ts.astype(np.float64)
+    y = values.astype(np.float64)
+    # Interior buckets; the third vertex for bucket i is the mean of bucket i + 1
+    # (the last point for the last bucket), which doesn't depend on the choices so far
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    sizes = np.diff(np.append(edges, n))
+    mean_x = np.add.reduceat(x, edges) / sizes
+    mean_y = np.add.reduceat(y, edges) / sizes
+    xs, ys, bounds = x.tolist(), y.tolist(), edges.tolist()
+    cxs, cys = mean_x[1:].tolist(), mean_y[1:].tolist()
+    keep = [0]
+    ax, ay = xs[0], ys[0]
+    for i in range(points - 2):
+        cx, cy = cxs[i], cys[i]
+        best, best_area = bounds[i], -1.0
+        for j in range(bounds[i], bounds[i + 1]):
+            area = abs((ax - cx) * (ys[j] - ay) - (ax - xs[j]) * (cy - ay))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        ax, ay = xs[best], ys[best]
+    keep.append(n - 1)
+    keep = np.asarray(keep, dtype=np.int64)
+    return ts[keep], values[keep]
+
+
+def minmax(ts: np.ndarray, values: np.ndarray, points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Min and max of points // 2 equal-count buckets, in time order."""
+    n = len(ts)
+    if points >= n or points < 2:
+        return ts, values
+    edges = np.linspace(0, n, points // 2 + 1).astype(np.int64)
+    keep = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        window = values[lo:hi]
+        i, j = lo + int(window.argmin()), lo + int(window.argmax())
+        keep.extend((i, j) if i < j else (j, i) if j < i else (i,))
+    keep = np.asarray(keep, dtype=np.int64)
+    return ts[keep], values[keep]
+
+
+_REDUCERS = {"lttb": lttb, "minmax": minmax}
+
+
+# --- ROLLUPS ---
+class _Level:
+    """One resolution: closed buckets in a ColumnRing plus the bucket still filling."""
+
+    def __init__(self, width_sec: int, capacity: int):
+        self.width_ms = width_sec * 1000
+        self.ring = ColumnRing(capacity, _BUCKET_SCHEMA)
+        self.open: Optional[List[Any]] = None   # [ts, lo, lo_ts, hi, hi_ts, sum, count]
+        self.complete = True                    # False once old buckets have been dropped
+
+    def add(self, ts: int, value: float) -> None:
+        if self.width_ms == 0:
+            self._close([ts, value, ts, value, ts, value, 1])
+            return
+        start = ts - ts % self.width_ms
+        bucket = self.open
+        if bucket is None or bucket[0] != start:
+            if bucket is not None:
+                self._close(bucket)
+            self.open = [start, value, ts, value, ts, value, 1]
+            return
+        if value < bucket[1]:
+            bucket[1], bucket[2] = value, ts
+        if value > bucket[3]:
+            bucket[3], bucket[4] = value, ts
+        bucket[5] += value
+        bucket[6] += 1
+
+    def _close(self, bucket: List[Any]) -> None:
+        ring = self.ring
+        if len(ring) == ring.capacity:
+            self.complete = False
+        ring.append(ts=bucket[0], lo=bucket[1], lo_ts=bucket[2], hi=bucket[3], hi_ts=bucket[4],
+                    sum=bucket[5], count=bucket[6])
+
+    def extend(self, ts: np.ndarray, values: np.ndarray) -> None:
+        """Bulk add of time-ordered points (backfill), vectorized per bucket."""
+        if self.width_ms == 0:
+            tail = slice(max(0, len(ts) - self.ring.capacity), None)
+            if tail.start:
+                self.complete = False
+            for t, v in zip(ts[tail].tolist(), values[tail].tolist()):
+                self._close([t, v, t, v, t, v, 1])
+            return
+        starts = ts - ts % self.width_ms
+        first = np.concatenate(([0], np.flatnonzero(np.diff(starts)) + 1))
+        group = np.repeat(np.arange(len(first)), np.diff(np.append(first, len(ts))))
+        lo_at = np.lexsort((values, group))[first]          # earliest minimum of each bucket
+        hi_at = np.lexsort((-values, group))[first]         # earliest maximum
+        sums = np.add.reduceat(values, first)
+        counts = np.diff(np.append(first, len(ts)))
+        buckets = [list(row) for row in zip(starts[first].tolist(), values[lo_at].tolist(), ts[lo_at].tolist(),
+                                            values[hi_at].tolist(), ts[hi_at].tolist(), sums.tolist(),
+                                            counts.tolist())]
+        if self.open is not None and self.open[0] == buckets[0][0]:
+            buckets[0] = _merge(self.open, buckets[0])
+        elif self.open is not None:
+            self._close(self.open)
+        self.open = buckets.pop()
+        if len(buckets) > self.ring.capacity:
+            buckets = buckets[-self.ring.capacity:]
+            self.complete = False
+        for bucket in buckets:
+            self._close(bucket)
+
+    def covers(self, t_from: int) -> bool:
+        return self.complete or (bool(self.ring) and self.ring.view("ts")[0] <= t_from)
+
+    def _span(self, t_from: int, t_to: int) -> Tuple[int, int, bool]:
+        # Buckets overlapping [t_from, t_to]: ring slice bounds, and whether the open one does
+        starts = self.ring.view("ts")
+        after = t_from - max(self.width_ms, 1)
+        lo = int(np.searchsorted(starts, after, side="right"))
+        hi = int(np.searchsorted(starts, t_to, side="right"))
+        return lo, hi, self.open is not None and after < self.open[0] <= t_to
+
+    def count(self, t_from: int, t_to: int) -> int:
+        lo, hi, with_open = self._span(t_from, t_to)
+        return hi - lo + int(with_open)
+
+    def candidates(self, t_from: int, t_to: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Min and max points of the buckets overlapping the window, in time order."""
+        lo, hi, with_open = self._span(t_from, t_to)
+        cols = {name: self.ring.view(name)[lo:hi] for name in ("lo", "lo_ts", "hi", "hi_ts")}
+        bucket = self.open
+        if with_open:
+            cols = {"lo": np.append(cols["lo"], bucket[1]), "lo_ts": np.append(cols["lo_ts"], bucket[2]),
+                    "hi": np.append(cols["hi"], bucket[3]), "hi_ts": np.append(cols["hi_ts"], bucket[4])}
+        if self.width_ms == 0:
+            ts, values = cols["lo_ts"], cols["lo"]
+        else:
+            # Both extremes of each bucket, earlier one first; single-point buckets once
+            lo_first = cols["lo_ts"] <= cols["hi_ts"]
+            ts = np.column_stack((np.where(lo_first, cols["lo_ts"], cols["hi_ts"]),
+                                  np.where(lo_first, cols["hi_ts"], cols["lo_ts"]))).ravel()
+            values = np.column_stack((np.where(lo_first, cols["lo"], cols["hi"]),
+                                      np.where(lo_first, cols["hi"], cols["lo"]))).ravel()
+            distinct = np.ones(len(ts), dtype=bool)
+            distinct[1::2] = ts[1::2] != ts[0::2]
+            ts, values = ts[distinct], values[distinct]
+        inside = (ts >= t_from) & (ts <= t_to)
+        return ts[inside], values[inside]
+
+
+def _merge(a: List[Any], b: List[Any]) -> List[Any]:
+    lo = a[1:3] if a[1] <= b[1] else b[1:3]
+    hi = a[3:5] if a[3] >= b[3] else b[3:5]
+    return [a[0], *lo, *hi, a[5] + b[5], a[6] + b[6]]
+
+
+class Rollup:
+    """Multi-resolution aggregates of one series, maintained incrementally."""
+
+    def __init__(self, widths: Iterable[int] = LEVEL_WIDTHS_SEC, capacity: int = LEVEL_CAPACITY):
+        self.levels = [_Level(width, capacity) for width in widths]
+
+    def add(self, ts: int, value: float) -> None:
+        for level in self.levels:
+            level.add(ts, value)
+
+    def extend(self, ts: np.ndarray, values: np.ndarray) -> None:
+        if len(ts):
+            values = values.astype(np.float64)
+            for level in self.levels:
+                level.extend(ts, values)
+
+    def pick_level(self, t_from: int, t_to: int, points: int) -> _Level:
+        """Finest level that holds the whole window in at most OVERSAMPLE x points buckets."""
+        for level in self.levels:
+            if level.covers(t_from) and level.count(t_from, t_to) <= OVERSAMPLE * points:
+                return level
+        return self.levels[-1]
+
+    def query(self, t_from: int, t_to: int, points: int, method: str = "lttb") -> Dict[str, Any]:
+        level = self.pick_level(t_from, t_to, points)
+        ts, values = _REDUCERS[method](*level.candidates(t_from, t_to), points)
+        return {"resolutionSec": level.width_ms // 1000, "ts": ts.tolist(), "values": values.tolist()}
+
+
+class ChartRollups:
+    """The charted series of one session (PatientState.charts)."""
+
+    def __init__(self, **options):
+        self.series = {name: Rollup(**options) for name in CHART_SERIES}
+
+    def add(self, series: str, ts: int, value: float) -> None:
+        self.series[series].add(ts, value)
+
+    def backfill(self, recorder) -> None:
+        """Seed the rollups from a persisted tsstore.HistoryStore, one segment at a time."""
+        for name, (store, column) in (("glucose", ("glucose", "bg")), ("basal", ("oref1", "rate"))):
+            for records in recorder.series[store].scan():
+                self.series[name].extend(records["ts"], records[column])
+
+    def query(self, series: str, t_from: int, t_to: int, points: int, method: str = "lttb") -> Dict[str, Any]:
+        result = self.series[series].query(t_from, t_to, points, method)
+        key = CHART_SERIES[series]
+        return {"resolutionSec": result["resolutionSec"],
+                "points": [{"ts": t, key: v} for t, v in zip(result["ts"], result["values"])]}
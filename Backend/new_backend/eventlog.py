@@ -0,0 +1,52 @@
+"""
+Structured event log for the per-tick and actuator messages.
+
+    GLUCODOSE_LOG=text   (default) "HH:MM:SS.mmm event key=value ..." lines
+    GLUCODOSE_LOG=json   one JSON object per line, for log shippers
+    GLUCODOSE_LOG=off    events are dropped before anything is formatted
+
+Call sites pass raw values as keyword fields; nothing is formatted unless
+the log is on, so leaving it off costs one attribute check per event.
+"""
+import json
+import os
+import sys
+import time
+from typing import Any, Optional, TextIO
+
+# --- CONFIGURATION ---
+LOG_FORMATS = ("text", "json", "off")
+DEFAULT_FORMAT = os.environ.get("GLUCODOSE_LOG", "text")
+
+
+def _text_value(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    text = str(value)
+    return f'"{text}"' if " " in text else text
+
+
+class EventLog:
+    def __init__(self, fmt: str = DEFAULT_FORMAT, stream: Optional[TextIO] = None):
+        self.stream = stream
+        self.set_format(fmt)
+
+    def set_format(self, fmt: str) -> None:
+        if fmt not in LOG_FORMATS:
+            raise ValueError(f"Unknown log format '{fmt}', expected one of {LOG_FORMATS}")
+        self.format = fmt
+        self.enabled = fmt != "off"
+
+    def event(self, name: str, **fields: Any) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        if self.format == "json":
+            line = json.dumps({"ts": round(now, 3), "event": name, **fields}, separators=(",", ":"), default=str)
+        else:
+            stamp = time.strftime("%H:%M:%S", time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+            line = " ".join([stamp, name] + [f"{key}={_text_value(value)}" for key, value in fields.items()])
+        (self.stream or sys.stdout).write(line + "\n")
+
+
+log = EventLog()
@@ -0,0 +1,56 @@
+"""
+In-process publish/subscribe for patient state changes.
+
+Producers publish right where the change happens (a new CGM reading, a
+finished delivery, the cooler switching) and every subscriber runs
+synchronously inside publish(), so a handler sees the state exactly as the
+producer left it and nothing waits for the next polling period.
+
+Handlers must be quick and must not block; anything slow should schedule
+its own task. A failing handler is logged and skipped so it can't take the
+physics tick down with it.
+"""
+import time
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from eventlog import log
+
+# --- TOPICS ---
+GLUCOSE_READING = "glucose.reading"       # data: ts, bg, trend
+DELIVERY_COMPLETE = "delivery.complete"   # data: ts, units
+COOLER_CHANGED = "cooler.changed"         # data: ts, state
+
+
+class Event(NamedTuple):
+    topic: str
+    patient: Any            # PatientState
+    data: Dict[str, Any]
+    published_at: float     # perf_counter(), for end-to-end latency
+
+
+Handler = Callable[[Event], None]
+
+
+class EventBus:
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+        # Handler calls that raised, so batch runs (sweep.py) can tell a broken run from a bad one
+        self.errors = 0
+
+    def subscribe(self, topic: str, handler: Handler) -> Callable[[], None]:
+        """Handlers run in subscription order. Returns a function that unsubscribes."""
+        self._handlers.setdefault(topic, []).append(handler)
+        return lambda: self._handlers[topic].remove(handler)
+
+    def publish(self, topic: str, patient, **data: Any) -> None:
+        handlers = self._handlers.get(topic)
+        if not handlers:
+            return
+        event = Event(topic, patient, data, time.perf_counter())
+        for handler in list(handlers):
+            try:
+                handler(event)
+            except Exception as e:
+                self.errors += 1
+                log.event("bus.handler_error", topic=topic, session=patient.session_id,
+                          handler=getattr(handler, "__qualname__", repr(handler)), error=repr(e))
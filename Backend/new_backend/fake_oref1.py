@@ -1,96 +1,128 @@
-import asyncio
 import time
-from datetime import datetime
-import state
-from motor_control import motor_pulse
+from typing import Optional
+from state import PatientState
+from eventlog import log
+from events import Event
+from metrics import DECISION_LATENCY, DECISIONS_RATE_LIMITED
+from tracing import now_ns, tracer
+import forecast
 
-INTERVAL_SECONDS = 10 
-MAX_ALLOWED_IOB = 0.40  
+# Decisions run on each new CGM reading, but no more often than this
+INTERVAL_SECONDS = 10
+# Readings land on the physics tick grid; the slack keeps scheduling jitter
+# from pushing one to the wrong side of the limit
+DECISION_INTERVAL_SLACK_SEC = 0.5
 
-def _get_smooth_trend_per_minute():
-    history = list(state.glucose_history)
-    if len(history) < 6: return 0.0 
-    latest = history[-1]['bg']
-    past = history[-6]['bg'] 
-    per_minute = (latest - past) * 2 
+# Readings back the raw trend is measured over
+TREND_READINGS = 5
+
+def _get_smooth_trend_per_minute(patient: PatientState):
+    history = patient.glucose_history
+    if len(history) < 6: return 0.0
+    latest = history.ago("bg", 0)
+    past = history.ago("bg", 5)
+    per_minute = (latest - past) * 2
+    return max(-2.0, min(2.0, per_minute))
+
+def timestamp_trend_per_minute(patient: PatientState):
+    """mg/dL per minute over the last TREND_READINGS readings, from their timestamps (replayed CGM traces)."""
+    history = patient.glucose_history
+    if len(history) < TREND_READINGS + 1: return 0.0
+    minutes = (int(history.ago("ts", 0)) - int(history.ago("ts", TREND_READINGS))) / 60000
+    if minutes <= 0: return 0.0
+    per_minute = (int(history.ago("bg", 0)) - int(history.ago("bg", TREND_READINGS))) / minutes
     return max(-2.0, min(2.0, per_minute))
 
-async def run_fake_oref1():
-    print("OpenAPS (oref1) Started.")
-    smoothed_trend = 0.0
-    
-    while True:
-        # --- 🛑 PAUSE CHECK 🛑 ---
-        # If paused, stop making decisions.
-        if not state.system_running:
-            await asyncio.sleep(1)
-            continue
+def decision_due(patient: PatientState) -> bool:
+    """Minimum-interval rate limit; a skipped reading is still in the history the next decision sees."""
+    if patient.clock.time() - patient.last_decision_time < INTERVAL_SECONDS - DECISION_INTERVAL_SLACK_SEC:
+        DECISIONS_RATE_LIMITED.inc()
+        return False
+    return True
+
+def on_glucose_reading(event: Event):
+    """GLUCOSE_READING subscriber: decide on the new reading unless rate limited."""
+    patient = event.patient
+    if patient.system_running and decision_due(patient):
+        oref1_tick(patient, event)
+
+def oref1_tick(patient: PatientState, reading: Optional[Event] = None) -> str:
+    """Run one oref1 decision for a patient and flag a delivery if it says DELIVER. Returns the action."""
+    started = now_ns()
+    now = patient.clock.time()
+    patient.last_decision_time = now
+    current_bg = patient.last_bg
 
-        now = time.time()
-        current_bg = state.last_bg
-        
-        # 1. Trend Smoothing
-        raw_trend = _get_smooth_trend_per_minute()
-        smoothed_trend = (smoothed_trend * 0.7) + (raw_trend * 0.3)
-        
-        # 2. Prediction
-        future_rise = smoothed_trend * 20
-        insulin_impact = state.current_iob * state.ISF
-        eventual_bg = int(current_bg + future_rise - insulin_impact)
-        eventual_bg = max(60, eventual_bg)
-        
-        # 3. Decision Logic
-        time_since_delivery = now - state.last_delivery_time
-        reason = ""
-        suggested_action = "None"
-        rate = state.BASE_BASAL
-        
-        if time_since_delivery < 60:
-            reason = "Waiting for absorption."
-            suggested_action = "WAIT"
-        elif state.motor_state == "ON":
-            reason = "Motor Moving."
-            suggested_action = "WAIT"
-        elif state.current_iob >= MAX_ALLOWED_IOB:
-            reason = f"Max IOB ({state.current_iob:.2f}). Safety Hold."
-            suggested_action = "WAIT"
+    # 1. Trend Smoothing
+    raw_trend = (patient.raw_trend or _get_smooth_trend_per_minute)(patient)
+    params = patient.params
+    alpha = params.trend_smoothing
+    patient.smoothed_trend = (patient.smoothed_trend * (1 - alpha)) + (raw_trend * alpha)
+    smoothed_trend = patient.smoothed_trend
+
+    # 2. Prediction: the cached forecast for this reading and the updated trend,
+    # the same curves the dashboard and /forecast get
+    eventual_bg = max(60, forecast.predict(patient)["eventualBG"])
+
+    # 3. Decision Logic
+    time_since_delivery = now - patient.last_delivery_time
+    reason = ""
+    suggested_action = "None"
+    rate = params.base_basal
+
+    if time_since_delivery < 60:
+        reason = "Waiting for absorption."
+        suggested_action = "WAIT"
+    elif patient.motor_state == "ON":
+        reason = "Motor Moving."
+        suggested_action = "WAIT"
+    elif patient.current_iob >= params.max_allowed_iob:
+        reason = f"Max IOB ({patient.current_iob:.2f}). Safety Hold."
+        suggested_action = "WAIT"
+    else:
+        if eventual_bg > params.target_max_bg:
+            rate = 2.0
+            reason = f"Pred {eventual_bg} > {params.target_max_bg:g}. Need IOB."
+            suggested_action = "DELIVER"
+        elif eventual_bg < params.target_min_bg:
+            rate = 0.0
+            reason = f"Pred {eventual_bg} < {params.target_min_bg:g}. Suspending."
+            suggested_action = "SUSPEND"
         else:
-            if eventual_bg > state.TARGET_MAX_BG:
-                rate = 2.0
-                reason = f"Pred {eventual_bg} > {state.TARGET_MAX_BG}. Need IOB."
-                suggested_action = "DELIVER"
-            elif eventual_bg < state.TARGET_MIN_BG:
-                rate = 0.0
-                reason = f"Pred {eventual_bg} < {state.TARGET_MIN_BG}. Suspending."
-                suggested_action = "SUSPEND"
-            else:
-                rate = state.BASE_BASAL
-                reason = f"Pred {eventual_bg} is safe."
-                suggested_action = "NONE"
+            rate = params.base_basal
+            reason = f"Pred {eventual_bg} is safe."
+            suggested_action = "NONE"
+
+    # 4. Execute (the actuation phase starts the motor right after this tick)
+    if suggested_action == "DELIVER":
+        if patient.verbose: log.event("oref1.deliver", session=patient.session_id, reason=reason)
+        patient.pending_delivery = True
 
-        # 4. Execute
-        if suggested_action == "DELIVER":
-            print(f"💉 [ACTION TRIGGERED] {reason}")
-            asyncio.create_task(motor_pulse())
-        
-        rec = {
-            "ts": int(now * 1000),
-            "rate": rate,
-            "duration": 30,
-            "eventualBG": eventual_bg,
-            "reason": reason
-        }
-        state.basal_history.append(rec)
-        state.suggested_rate = rate
+    rec = {
+        "ts": int(now * 1000),
+        "rate": rate,
+        "duration": 30,
+        "eventualBG": eventual_bg,
+        "reason": reason
+    }
+    patient.basal_history.append(**rec)
+    if patient.recorder: patient.recorder.record_oref1(rec)
+    if patient.charts: patient.charts.add("basal", rec["ts"], rate)
+    patient.suggested_rate = rate
+    patient.touch()
 
-        local_time = datetime.fromtimestamp(now).strftime("%H:%M:%S")
-        print(
-            f"[OREF1] {local_time} | "
-            f"BG:{int(current_bg)} | "
-            f"Trend:{smoothed_trend:+.2f} | "
-            f"IOB:{state.current_iob:.2f}U | "
-            f"Pred:{eventual_bg} -> "
-            f"[{suggested_action}]"
-        )
+    # Reading published -> decision recorded, on the wall clock
+    latency = None
+    if reading is not None:
+        latency = time.perf_counter() - reading.published_at
+        DECISION_LATENCY.observe(latency)
 
-        await asyncio.sleep(INTERVAL_SECONDS)
\ No newline at end of file
+    tracer.span("oref1.decision", patient.session_id, started, bg=int(current_bg), trend=round(smoothed_trend, 2),
+                iob=round(patient.current_iob, 2), pred=eventual_bg, action=suggested_action, rate=rate,
+                reason=reason)
+    if patient.verbose:
+        log.event("oref1.decision", session=patient.session_id, bg=int(current_bg),
+                  trend=round(smoothed_trend, 2), iob=round(patient.current_iob, 2),
+                  pred=eventual_bg, action=suggested_action,
+                  latency_us=None if latency is None else round(latency * 1e6, 1))
+    return suggested_action
@@ -0,0 +1,142 @@
+"""
+Local stand-in for the relay board.
+
+    python fake_relay.py --port 8081 --latency 0.3
+    RELAY_BASE_URL=http://127.0.0.1:8081 python app.py
+
+    python fake_relay.py --measure --latency 0.3
+
+--measure starts the stand-in on a background thread and reports how long the
+event loop stalls while actuating through the old blocking requests.get path
+versus the pooled async RelayDriver.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import threading
+import time
+
+RELAY_PATHS = {"/relay/on", "/relay/off", "/cooler/on", "/cooler/off"}
+
+
+class FakeRelayServer:
+    """Minimal HTTP/1.1 keep-alive server answering the relay board's GET endpoints."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, latency: float = 0.2,
+                 jitter: float = 0.0, fail_rate: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.requests_served = 0
+        self.connections_opened = 0
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections_opened += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                # Drain headers, we never need them
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+
+                parts = request_line.decode("latin-1").split()
+                path = parts[1] if len(parts) > 1 else "/"
+                await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+                if random.random() < self.fail_rate:
+                    status, body = "503 Service Unavailable", b"fail"
+                elif path in RELAY_PATHS:
+                    status, body = "200 OK", b"ok"
+                else:
+                    status, body = "404 Not Found", b"unknown"
+                self.requests_served += 1
+
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode("latin-1") + body
+                )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"🔌 Fake relay on http://{self.host}:{self.port} (latency {self.latency}s)")
+        async with server:
+            await server.serve_forever()
+
+
+def _start_in_thread(server: FakeRelayServer) -> None:
+    thread = threading.Thread(target=lambda: asyncio.run(server.serve_forever()), daemon=True)
+    thread.start()
+    time.sleep(0.3)
+
+
+async def _probe_lag(stop: asyncio.Event, period: float = 0.01):
+    """Sample how late a periodic 10 ms timer fires while the actuations run."""
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(period)
+        lags.append(max(0.0, time.perf_counter() - start - period) * 1000)
+    return lags
+
+
+async def _measure(label: str, actuate, calls: int):
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe_lag(stop))
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    for i in range(calls):
+        await actuate("/relay/on" if i % 2 == 0 else "/relay/off")
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lags = await probe
+    print(
+        f"{label:<10} {calls} calls in {elapsed:.2f}s | "
+        f"loop lag max {max(lags):7.1f} ms, mean {statistics.mean(lags):6.2f} ms"
+    )
+
+
+async def _run_measurement(base_url: str, calls: int):
+    import requests
+    from hardware import RelayDriver
+
+    async def blocking(path):
+        # The pre-driver code path: a synchronous GET inside a coroutine
+        try:
+            requests.get(base_url + path, timeout=1)
+        except Exception:
+            pass
+
+    driver = RelayDriver(base_url=base_url)
+    await driver.open()
+    await _measure("blocking", blocking, calls)
+    await _measure("async", driver.call, calls)
+    await driver.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in relay board with configurable latency")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of random latency")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    parser.add_argument("--measure", action="store_true", help="measure loop stall, blocking vs async")
+    parser.add_argument("--calls", type=int, default=10)
+    args = parser.parse_args()
+
+    relay_server = FakeRelayServer(args.host, args.port, args.latency, args.jitter, args.fail_rate)
+    if args.measure:
+        _start_in_thread(relay_server)
+        asyncio.run(_run_measurement(f"http://{args.host}:{args.port}", args.calls))
+    else:
+        asyncio.run(relay_server.serve_forever())
@@ -0,0 +1,113 @@
+"""
+Multi-horizon glucose forecast, computed once per reading and shared by the
+snapshot, GET /forecast and the oref1 decision.
+
+Predicted BG curves at FORECAST_STEP_SEC steps out to FORECAST_HORIZON_SEC,
+in the spirit of oref0's predBGs:
+
+    iob     insulin only: current BG minus ISF x the insulin still to be
+            absorbed by each step (InsulinModel.project)
+    trend   iob plus the smoothed trend carried forward for TREND_MINUTES,
+            the decision's momentum term
+    uam     iob plus the current deviation (observed slope minus the slope
+            insulin activity explains), decaying linearly to zero over
+            UAM_DECAY_MINUTES, for rises nobody announced
+
+eventualBG is where the trend curve settles once all insulin on board has
+acted: BG + trend x TREND_MINUTES - ISF x IOB, the value oref1 decides on.
+Curves are clipped to the CGM range and rounded; eventualBG is not.
+
+The result is cached per patient and keyed by what it depends on (newest
+reading, insulin tick and doses, trend EMA), so the many state versions in
+between (temperature, motor display, cooler) reuse it.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+# --- CONFIGURATION ---
+FORECAST_STEP_SEC = 300             # 5-minute steps
+FORECAST_HORIZON_SEC = 3 * 3600
+TREND_MINUTES = 20.0                # how long the smoothed trend is carried forward
+UAM_DECAY_MINUTES = 60.0            # a deviation fades to zero over this long
+DEVIATION_READINGS = 3              # deltas averaged for the observed slope
+CGM_MIN_BG, CGM_MAX_BG = 39, 400
+
+
+class ForecastCache:
+    """PatientState.forecast_cache: the last forecast and the inputs it was built from."""
+
+    __slots__ = ("key", "value")
+
+    def __init__(self):
+        self.key: Optional[Tuple] = None
+        self.value: Optional[Dict[str, Any]] = None
+
+
+def _inputs(patient) -> Tuple:
+    model = patient.insulin
+    return (patient.glucose_history.seq, model._tick, model.total_units, patient.smoothed_trend, patient.last_bg)
+
+
+def _observed_slope(patient) -> float:
+    """mg/dL per minute over the last DEVIATION_READINGS deltas, 0 without enough history."""
+    history = patient.glucose_history
+    n = min(len(history), DEVIATION_READINGS + 1)
+    if n < 2:
+        return 0.0
+    ts, bg = history.view("ts", n), history.view("bg", n)
+    minutes = (int(ts[-1]) - int(ts[0])) / 60000
+    return (int(bg[-1]) - int(bg[0])) / minutes if minutes > 0 else 0.0
+
+
+def compute(patient) -> Dict[str, Any]:
+    """The forecast for the patient's current state (uncached)."""
+    model = patient.insulin
+    curve = model.curve
+    params = patient.params
+    bg = patient.last_bg
+    iob = patient.current_iob
+
+    # Sample the insulin projection every `every` model ticks
+    every = max(1, round(FORECAST_STEP_SEC / curve.tick_seconds))
+    step_min = every * curve.tick_seconds / 60
+    steps = int(FORECAST_HORIZON_SEC // (every * curve.tick_seconds))
+    iob_future, _ = model.project(steps * every, every=every)
+    minutes = np.arange(steps + 1) * step_min
+
+    insulin_effect = params.isf * (iob - np.concatenate(([iob], iob_future)))
+    iob_curve = bg - insulin_effect
+    trend = patient.smoothed_trend
+    trend_curve = bg + trend * np.minimum(minutes, TREND_MINUTES) - insulin_effect
+
+    # Deviation: how much faster BG is moving than insulin activity alone explains
+    bgi_per_min = -params.isf * model.activity * 60 / curve.tick_seconds
+    deviation = _observed_slope(patient) - bgi_per_min
+    fading = np.minimum(minutes, UAM_DECAY_MINUTES)
+    uam_curve = iob_curve + deviation * (fading - fading * fading / (2 * UAM_DECAY_MINUTES))
+
+    # All three curves rounded and clipped to the CGM range in one pass
+    shown = np.clip(np.rint(np.stack((iob_curve, trend_curve, uam_curve))), CGM_MIN_BG, CGM_MAX_BG)
+    iob_bgs, trend_bgs, uam_bgs = shown.astype(np.int64).tolist()
+
+    history = patient.glucose_history
+    return {
+        "ts": history.ago("ts") if history else patient.now_ms(),
+        "stepMin": step_min,
+        "iob": iob_bgs,
+        "trend": trend_bgs,
+        "uam": uam_bgs,
+        "deviation": round(deviation, 2),
+        # Same arithmetic, in the same order, as the decision always used
+        "eventualBG": int(bg + trend * TREND_MINUTES - iob * params.isf),
+    }
+
+
+def predict(patient) -> Dict[str, Any]:
+    """The cached forecast, recomputed only when one of its inputs moved."""
+    cache = patient.forecast_cache
+    key = _inputs(patient)
+    if cache.key != key:
+        cache.value = compute(patient)
+        cache.key = key
+    return cache.value
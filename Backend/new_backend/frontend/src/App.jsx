@@ -2,6 +2,8 @@ import React, { useState, useEffect, useRef } from "react";
 import GlucoseChart from "./components/GlucoseChart";
 import InsulinChart from "./components/InsulinChart";
 import GlucoseGauge from "./components/GlucoseGauge";
+import { applyFrame } from "./wsFrames";
+import { BINARY_SUBPROTOCOL, decodeFrame } from "./wire";
 import "./styles.css";
 
 const SOCKET_URL = "ws://127.0.0.1:8000/ws/glucose";
@@ -9,24 +11,55 @@ const SPIKE_URL = "http://127.0.0.1:8000/spike";
 const START_URL = "http://127.0.0.1:8000/start";
 const STOP_URL = "http://127.0.0.1:8000/stop";
 const COOLER_URL = "http://127.0.0.1:8000/cooler";
+const CHART_URL = "http://127.0.0.1:8000/chart";
+
+// Chart windows: "live" uses the websocket history, the rest ask the server
+// for a downsampled series
+const CHART_RANGES = { live: null, "6h": 6, "24h": 24, "7d": 168 };
+const CHART_POINTS = 500;
+const CHART_REFRESH_MS = 30000;
 
 export default function App() {
   const [socketData, setSocketData] = useState(null);
   const [connectionStatus, setConnectionStatus] = useState("Disconnected");
   const ws = useRef(null);
+  const [chartRange, setChartRange] = useState("live");
+  const [chartData, setChartData] = useState(null);
 
   useEffect(() => {
     const connect = () => {
       setConnectionStatus("Connecting...");
-      ws.current = new WebSocket(SOCKET_URL);
+      // Ask for the compact binary frames; a server without them answers in JSON text
+      ws.current = new WebSocket(SOCKET_URL, [BINARY_SUBPROTOCOL]);
+      ws.current.binaryType = "arraybuffer";
       ws.current.onopen = () => setConnectionStatus("Connected");
-      ws.current.onmessage = (event) => { try { setSocketData(JSON.parse(event.data)); } catch (e) { } };
+      ws.current.onmessage = (event) => {
+        try {
+          const frame = typeof event.data === "string" ? JSON.parse(event.data) : decodeFrame(event.data);
+          setSocketData((prev) => applyFrame(prev, frame));
+        } catch (e) { }
+      };
       ws.current.onclose = () => { setConnectionStatus("Disconnected"); setTimeout(connect, 3000); };
     };
     connect();
     return () => { if (ws.current) ws.current.close(); };
   }, []);
 
+  useEffect(() => {
+    const hours = CHART_RANGES[chartRange];
+    if (!hours) { setChartData(null); return undefined; }
+    const load = async () => {
+      const params = new URLSearchParams({ from: Date.now() - hours * 3600 * 1000, points: CHART_POINTS });
+      try {
+        const res = await fetch(`${CHART_URL}?${params}`);
+        if (res.ok) setChartData((await res.json()).series);
+      } catch (e) { }
+    };
+    load();
+    const timer = setInterval(load, CHART_REFRESH_MS);
+    return () => clearInterval(timer);
+  }, [chartRange]);
+
   const handleInitiate = async () => { try { await fetch(SPIKE_URL, { method: "POST" }); } catch (e) { } };
 
   const handleToggleSystem = async () => {
@@ -40,14 +73,18 @@ export default function App() {
   };
 
   // Data Parsing
-  const glucoseHistory = socketData?.glucoseHistory || [];
-  const basalHistory = socketData?.basalHistory || [];
+  const glucoseHistory = chartData ? chartData.glucose.points : socketData?.glucoseHistory || [];
+  const basalHistory = chartData ? chartData.basal.points : socketData?.basalHistory || [];
+  const multiDay = CHART_RANGES[chartRange] > 24;
+  const formatTime = (ts) => multiDay
+    ? new Date(ts).toLocaleString([], { weekday: "short", hour: "2-digit", minute: "2-digit" })
+    : new Date(ts).toLocaleTimeString([], { hour: "2-digit", minute: "2-digit", second: "2-digit" });
   const formattedGlucoseData = glucoseHistory.map((item) => ({
-    time: new Date(item.ts).toLocaleTimeString([], { hour: "2-digit", minute: "2-digit", second: "2-digit" }),
+    time: formatTime(item.ts),
     value: item.bg,
   }));
   const formattedInsulinData = basalHistory.map((item) => ({
-    time: new Date(item.ts).toLocaleTimeString([], { hour: "2-digit", minute: "2-digit", second: "2-digit" }),
+    time: formatTime(item.ts),
     value: item.rate,
   }));
 
@@ -91,13 +128,20 @@ export default function App() {
             {/* PANEL 1 */}
             <div className="vertical-panel">
               <h3 className="panel-title">Glucose Trend</h3>
+              <div className="range-selector">
+                {Object.keys(CHART_RANGES).map((key) => (
+                  <button key={key} className={`range-btn ${chartRange === key ? "active" : ""}`} onClick={() => setChartRange(key)}>
+                    {key}
+                  </button>
+                ))}
+              </div>
               {/* Max gauge increased to 400 for High BG scenario */}
               <GlucoseGauge value={currentBG} max={400} />
               <div style={{ marginTop: "0.75rem", flex: 1 }}>
                 <GlucoseChart data={formattedGlucoseData} />
               </div>
               <div className="chart-legend-bottom">
-                <div className="legend-item"><span className="legend-dot legend-glucose"></span><span>Live BG</span></div>
+                <div className="legend-item"><span className="legend-dot legend-glucose"></span><span>{chartRange === "live" ? "Live BG" : `BG, last ${chartRange}`}</span></div>
               </div>
             </div>
 
@@ -1,5 +1,8 @@
 import React from "react";
 
+const MAX_X_LABELS = 8;
+const MAX_MARKED_POINTS = 60;
+
 export default function GlucoseChart({ data }) {
   if (!data || data.length === 0) {
     return <div className="chart-empty">No data available</div>;
@@ -9,6 +12,10 @@ export default function GlucoseChart({ data }) {
   const minValue = Math.min(...values, 80);   // ensure target range visible
   const maxValue = Math.max(...values, 180);  // ensure target range visible
 
+  // Long downsampled windows: label and mark only a handful of points
+  const labelEvery = Math.ceil(data.length / MAX_X_LABELS);
+  const showPoints = data.length <= MAX_MARKED_POINTS;
+
   const padding = 20;
   const width = 800;
   const height = 300;
@@ -100,7 +107,7 @@ export default function GlucoseChart({ data }) {
         ))}
 
         {/* Time labels on X axis */}
-        {data.map((point, i) => (
+        {data.map((point, i) => i % labelEvery === 0 && (
           <text
             key={i}
             x={toX(i)}
@@ -116,7 +123,7 @@ export default function GlucoseChart({ data }) {
         <path d={pathD} className="chart-line" fill="none" />
 
         {/* Points */}
-        {data.map((point, i) => (
+        {showPoints && data.map((point, i) => (
           <circle
             key={i}
             cx={toX(i)}
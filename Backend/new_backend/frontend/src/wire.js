@@ -0,0 +1,68 @@
+// Decoder for the binary /ws/glucose and /state encoding (Backend wire.py).
+// A decoded frame has exactly the shape of the JSON frame, so applyFrame()
+// merges both the same way.
+
+export const BINARY_SUBPROTOCOL = "glucodose.bin.v1";
+export const BINARY_MEDIA_TYPE = "application/vnd.glucodose+binary";
+
+const WIRE_VERSION = 1;
+const SNAPSHOT = 1;
+const DELTA = 2;
+// Must match ringbuffer.TREND_LABELS
+const TREND_LABELS = ["Flat", "Slight Up", "Rising", "Slight Down", "Falling"];
+
+const utf8 = new TextDecoder();
+
+export function decodeFrame(buffer) {
+  const view = new DataView(buffer);
+  let pos = 0;
+
+  const u8 = () => view.getUint8(pos++);
+  const u16 = () => { const v = view.getUint16(pos, true); pos += 2; return v; };
+  const i16 = () => { const v = view.getInt16(pos, true); pos += 2; return v; };
+  const u32 = () => { const v = view.getUint32(pos, true); pos += 4; return v; };
+  const i32 = () => { const v = view.getInt32(pos, true); pos += 4; return v; };
+  const f64 = () => { const v = view.getFloat64(pos, true); pos += 8; return v; };
+  // Epoch ms fit comfortably in a double
+  const i64 = () => { const v = Number(view.getBigInt64(pos, true)); pos += 8; return v; };
+  const text = (length) => { const s = utf8.decode(new Uint8Array(buffer, pos, length)); pos += length; return s; };
+  const column = (n, read) => { const out = new Array(n); for (let i = 0; i < n; i++) out[i] = read(); return out; };
+  const timestamps = (n) => {
+    const ts = [i64()];
+    for (let i = 1; i < n; i++) ts.push(ts[i - 1] + i32());
+    return ts;
+  };
+
+  if (u8() !== 0x47 || u8() !== 0x44 || u8() !== WIRE_VERSION) {
+    throw new Error("not a GlucoDose binary frame");
+  }
+  const type = u8();
+  const fields = JSON.parse(text(u32()));
+  let historyLimits = null;
+  if (type === SNAPSHOT) historyLimits = { glucoseHistory: u16(), basalHistory: u16() };
+
+  const glucoseHistory = [];
+  let n = u32();
+  if (n) {
+    const ts = timestamps(n), bg = column(n, u16), trend = column(n, u8);
+    for (let i = 0; i < n; i++) glucoseHistory.push({ ts: ts[i], bg: bg[i], trend: TREND_LABELS[trend[i]] });
+  }
+
+  const basalHistory = [];
+  n = u32();
+  if (n) {
+    const ts = timestamps(n), rate = column(n, f64), duration = column(n, u16), eventualBG = column(n, i16);
+    const reasons = column(u16(), () => text(u16()));
+    const reason = column(n, u16);
+    for (let i = 0; i < n; i++) {
+      basalHistory.push({ ts: ts[i], rate: rate[i], duration: duration[i], eventualBG: eventualBG[i], reason: reasons[reason[i]] });
+    }
+  }
+
+  if (type === DELTA) return { type: "delta", fields, glucoseHistory, basalHistory };
+  const frame = type === SNAPSHOT ? { type: "snapshot", ...fields } : { ...fields };
+  frame.glucoseHistory = glucoseHistory;
+  frame.basalHistory = basalHistory;
+  if (historyLimits) frame.historyLimits = historyLimits;
+  return frame;
+}
@@ -0,0 +1,23 @@
+// Merges /ws/glucose frames into the dashboard state.
+// The server sends one "snapshot" frame on connect, then "delta" frames that
+// only carry new history rows and the scalar fields that changed.
+
+const HISTORY_KEYS = ["glucoseHistory", "basalHistory"];
+
+export function applyFrame(prev, frame) {
+  if (frame.type === "snapshot") {
+    const { type, ...snapshot } = frame;
+    return snapshot;
+  }
+  if (!prev) return prev;
+
+  const next = { ...prev, ...frame.fields };
+  for (const key of HISTORY_KEYS) {
+    const rows = frame[key];
+    if (!rows || rows.length === 0) continue;
+    const limit = prev.historyLimits?.[key] || Infinity;
+    const merged = prev[key].concat(rows);
+    next[key] = merged.length > limit ? merged.slice(merged.length - limit) : merged;
+  }
+  return next;
+}
@@ -1,95 +1,89 @@
-import asyncio
-import time
-import random
 import state
+from state import PatientState
+from eventlog import log
+from events import GLUCOSE_READING
+from tracing import tracer
 
 # --- CONFIGURATION ---
-INTERVAL_SECONDS = 5  
+INTERVAL_SECONDS = 5
 
-# CHANGED: Increased to 25.0 to handle the high start (295) effectively
-INSULIN_POWER_FACTOR = 23.0
+# BG drop (mg/dL) per unit of insulin absorbed; the activity curve itself
+# (DIA, peak) lives in insulin_model
+INSULIN_SENSITIVITY = state.INSULIN_SENSITIVITY   # default; each patient uses params.insulin_sensitivity
 
-IOB_DECAY_RATE = 0.004 
-_trend_drift = 0.4 
+def _step_bg_physics(patient: PatientState, prev_bg: float) -> float:
+    rng = patient.rng
+    # Both draws happen every tick, spike or not, so batch_engine can replay the
+    # same random stream column by column.
+    change = rng.uniform(-0.05, 0.1)
+    noise = rng.uniform(-0.05, 0.05)
 
-def _step_bg_physics(prev_bg: float) -> float:
-    global _trend_drift
-    
     # 1. SPIKE HANDLING
-    if state.spike_countdown > 0:
-        print(f"🍬 SUPER SPIKE ACTIVE! Ticks left: {state.spike_countdown}")
-        _trend_drift = 6.0 
-        state.spike_countdown -= 1
+    if patient.spike_countdown > 0:
+        if patient.verbose: log.event("physics.spike", session=patient.session_id, ticks_left=patient.spike_countdown)
+        patient.trend_drift = 6.0
+        patient.spike_countdown -= 1
     else:
         # 2. NORMAL PHYSICS
-        change = random.uniform(-0.05, 0.1) 
-        _trend_drift += change
-        
+        patient.trend_drift += change
+
         # Brake: If IOB exists, kill upward momentum
-        if state.current_iob > 0.05:
-            _trend_drift -= (state.current_iob * 0.5) 
-            
-        _trend_drift = max(-2.0, min(2.0, _trend_drift)) 
+        if patient.current_iob > 0.05:
+            patient.trend_drift -= (patient.current_iob * 0.5)
+
+        patient.trend_drift = max(-2.0, min(2.0, patient.trend_drift))
 
-    # 3. INSULIN DROP (Stronger now with Factor 25.0)
-    insulin_drop = 0
-    if state.current_iob > 0:
-        insulin_drop = -(state.current_iob * INSULIN_POWER_FACTOR)
+    # 3. INSULIN DROP: this tick's share of every dose still acting
+    absorbed = patient.insulin.step()
+    insulin_drop = -(absorbed * patient.params.insulin_sensitivity)
 
     # 4. SAFETY FLOOR
     liver_resistance = 0
-    if prev_bg < 110: 
+    if prev_bg < 110:
         dist = (110 - prev_bg)
-        liver_resistance = dist * 0.5 
+        liver_resistance = dist * 0.5
+
+    new_bg = prev_bg + patient.trend_drift + insulin_drop + liver_resistance + noise
 
-    noise = random.uniform(-0.05, 0.05)
-    new_bg = prev_bg + _trend_drift + insulin_drop + liver_resistance + noise
-    
     # Absolute Limits
     new_bg = max(80.0, min(400.0, new_bg))
-    
-    # 5. METABOLISM
-    if state.current_iob > 0:
-        state.current_iob -= IOB_DECAY_RATE
-        if state.current_iob < 0: state.current_iob = 0
 
     return new_bg
 
-def seed_glucose_history():
-    if state.glucose_history: return
-    now = time.time()
+def _trend_label(delta: float) -> str:
+    if delta > 1.0: return "Rising"
+    elif delta > 0.3: return "Slight Up"
+    elif delta < -1.0: return "Falling"
+    elif delta < -0.3: return "Slight Down"
+    return "Flat"
+
+def seed_glucose_history(patient: PatientState):
+    if patient.glucose_history: return
+    now = patient.clock.time()
     # Seed with the High Start Value
-    sim_bg = state.START_BG 
+    sim_bg = state.START_BG
     for i in range(state.MAX_HISTORY):
         # Create a history that was flat/high
         t = now - ((state.MAX_HISTORY - i) * INTERVAL_SECONDS)
-        state.glucose_history.append({
-            "ts": int(t * 1000), "bg": int(sim_bg), "trend": "Flat"
-        })
-    state.last_bg = sim_bg 
-    print(f"✅ Physics Engine Ready. Starting BG: {state.START_BG}")
-
-async def run_glucose_simulator():
-    if not state.glucose_history: seed_glucose_history()
-    print("✅ Physics Task Started.")
-    while True:
-        if not state.system_running:
-            await asyncio.sleep(1)
-            continue
-            
-        prev_bg = state.last_bg
-        new_bg = _step_bg_physics(prev_bg)
-        state.last_bg = new_bg
-        
-        delta = new_bg - prev_bg
-        if delta > 1.0: t = "Rising"
-        elif delta > 0.3: t = "Slight Up"
-        elif delta < -1.0: t = "Falling"
-        elif delta < -0.3: t = "Slight Down"
-        else: t = "Flat"
-        
-        state.glucose_history.append({
-            "ts": int(time.time() * 1000), "bg": int(new_bg), "trend": t
-        })
-        
-        await asyncio.sleep(INTERVAL_SECONDS)
\ No newline at end of file
+        patient.glucose_history.append(ts=int(t * 1000), bg=int(sim_bg), trend="Flat")
+    patient.last_bg = sim_bg
+    if patient.verbose: log.event("physics.ready", session=patient.session_id, start_bg=state.START_BG)
+
+def glucose_tick(patient: PatientState):
+    """Advance one patient by one CGM reading."""
+    prev_bg = patient.last_bg
+    new_bg = _step_bg_physics(patient, prev_bg)
+    patient.last_bg = new_bg
+
+    ts, bg, trend = patient.now_ms(), int(new_bg), _trend_label(new_bg - prev_bg)
+    patient.glucose_history.append(ts=ts, bg=bg, trend=trend)
+
+    patient.touch()
+    tracer.instant("glucose.reading", patient.session_id, bg=bg, trend=trend)
+    patient.events.publish(GLUCOSE_READING, patient, ts=ts, bg=bg, trend=trend)
+
+    if patient.recorder:
+        patient.recorder.record_glucose(ts, bg, trend)
+        patient.recorder.record_iob(ts, patient.current_iob)
+    if patient.charts:
+        patient.charts.add("glucose", ts, bg)
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+
+from metrics import RELAY_FAILURES, RELAY_LATENCY, RELAY_REQUESTS
+from tracing import RELAY_TRACK, now_ns, tracer
+
+# --- CONFIGURATION ---
+# Point this at fake_relay.py to develop without the board
+RELAY_BASE_URL = os.environ.get("RELAY_BASE_URL", "http://192.168.1.17")
+
+DEFAULT_TIMEOUT_SEC = 1.0
+DEFAULT_RETRIES = 1
+RETRY_BACKOFF_SEC = 0.1
+
+# The relay board is a single small device; a couple of kept-alive sockets is plenty
+MAX_CONNECTIONS = 2
+
+
+@dataclass
+class RelayResult:
+    path: str
+    ok: bool
+    status: Optional[int]
+    attempts: int
+    latency_ms: float
+    error: Optional[str] = None
+
+
+class RelayDriver:
+    """
+    Async client for the relay board. Keeps one pooled keep-alive connection
+    instead of opening a socket per actuation, and never blocks the event loop.
+    """
+
+    def __init__(self, base_url: str = RELAY_BASE_URL, timeout: float = DEFAULT_TIMEOUT_SEC,
+                 retries: int = DEFAULT_RETRIES, max_connections: int = MAX_CONNECTIONS):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running loop, not the import-time one.
+        # Building the client loads an SSL context (~100s of ms), so call open()
+        # at startup rather than paying for it in the middle of an actuation.
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def open(self) -> None:
+        self._get_client()
+
+    async def call(self, path: str, timeout: Optional[float] = None,
+                   retries: Optional[int] = None) -> RelayResult:
+        """GET a relay endpoint. Failures are reported in the result, never raised."""
+        client = self._get_client()
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+
+        start = time.perf_counter()
+        start_ns = now_ns()
+        status, error = None, None
+        for attempt in range(1, retries + 2):
+            try:
+                response = await client.get(path, timeout=timeout)
+                status, error = response.status_code, None
+                if response.is_success:
+                    break
+                error = f"HTTP {status}"
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            if attempt <= retries:
+                await asyncio.sleep(RETRY_BACKOFF_SEC * attempt)
+
+        latency = time.perf_counter() - start
+        RELAY_REQUESTS.labels(path=path).inc()
+        RELAY_LATENCY.labels(path=path).observe(latency)
+        if error is not None:
+            RELAY_FAILURES.labels(path=path).inc()
+        tracer.async_span(f"relay {path}", RELAY_TRACK, start_ns, status=status, attempts=attempt, error=error)
+        return RelayResult(
+            path=path,
+            ok=error is None,
+            status=status,
+            attempts=attempt,
+            latency_ms=latency * 1000,
+            error=error,
+        )
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Shared driver for the physical board
+relay = RelayDriver()
@@ -0,0 +1,212 @@
+"""
+Insulin action model: dose ledger + exponential activity curve.
+
+The curve is the exponential model oref0 and Loop use, parameterised by DIA
+and peak time, sampled once per physics tick into lookup tables:
+
+    iob[k]       fraction of a dose still on board k ticks after delivery
+    activity[k]  fraction absorbed during tick k (iob[k] - iob[k + 1])
+
+Current IOB is the convolution of the per-tick dose ring with iob[]. The
+curve is C + e^(-t/tau) * (P0 + P1 t + P2 t^2), so the convolution is kept
+as four running sums (sum of doses and sum of dose * k^j * r^k for j = 0..2)
+that age in O(1) per tick; the dose ring is only read to expire the dose
+leaving the DIA window and for an exact re-sync once per window.
+"""
+import math
+from collections import deque
+from functools import lru_cache
+from typing import Deque, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# --- CONFIGURATION ---
+# The simulator compresses hours into minutes, so the default action time is
+# minutes too. A real rapid-acting analog is roughly DIA 300 / peak 75.
+INSULIN_DIA_MINUTES = 5.0
+INSULIN_PEAK_MINUTES = 1.25
+TICK_SECONDS = 5
+
+
+class InsulinCurve:
+    """Lookup tables and recurrence coefficients for one (DIA, peak, tick) curve."""
+
+    def __init__(self, dia_minutes: float, peak_minutes: float, tick_seconds: float):
+        td = dia_minutes * 60.0
+        tp = peak_minutes * 60.0
+        if not 0 < tp < td / 2:
+            raise ValueError("insulin peak must be positive and less than half the DIA")
+        self.dia_minutes = dia_minutes
+        self.peak_minutes = peak_minutes
+        self.tick_seconds = tick_seconds
+
+        tau = tp * (1 - tp / td) / (1 - 2 * tp / td)
+        a = 2 * tau / td
+        s = 1 / (1 - a + (1 + a) * math.exp(-td / tau))
+        dt = tick_seconds
+        # iob(t) = C + e^(-t/tau) * (P0 + P1 t + P2 t^2), written per tick k = t / dt
+        self.const = 1 - s * (1 - a)
+        self.poly = (s * (1 - a), s * (1 - a) / tau * dt, -s / (tau * td) * dt * dt)
+        self.decay = math.exp(-dt / tau)
+
+        self.ticks = int(math.ceil(td / dt))    # window length K
+        k = np.arange(self.ticks, dtype=np.float64)
+        iob = self.const + self.decay ** k * (self.poly[0] + self.poly[1] * k + self.poly[2] * k * k)
+        self.iob = np.append(np.clip(iob, 0.0, 1.0), 0.0)    # iob[K] = 0, dose fully absorbed
+        self.activity = self.iob[:-1] - self.iob[1:]
+        # What leaves the running sums when a dose ages out at k = K
+        rk = self.decay ** self.ticks
+        self.expire = (rk, self.ticks * rk, self.ticks * self.ticks * rk)
+
+
+@lru_cache(maxsize=32)
+def _cached_curve(dia_minutes: float, peak_minutes: float, tick_seconds: float) -> InsulinCurve:
+    return InsulinCurve(dia_minutes, peak_minutes, tick_seconds)
+
+
+def get_curve(dia_minutes: Optional[float] = None, peak_minutes: Optional[float] = None,
+              tick_seconds: Optional[float] = None) -> InsulinCurve:
+    """Shared (read-only) curve; unspecified parameters come from the configuration above."""
+    return _cached_curve(INSULIN_DIA_MINUTES if dia_minutes is None else dia_minutes,
+                         INSULIN_PEAK_MINUTES if peak_minutes is None else peak_minutes,
+                         TICK_SECONDS if tick_seconds is None else tick_seconds)
+
+
+class Dose(NamedTuple):
+    ts: int        # epoch ms
+    units: float
+    tick: int      # model tick the dose started acting on
+
+
+class InsulinModel:
+    """Per-patient insulin on board, advanced once per physics tick."""
+
+    def __init__(self, curve: Optional[InsulinCurve] = None):
+        self.curve = curve or get_curve()
+        k = self.curve.ticks
+        self._ring = np.zeros(k)        # dose per tick, slot = tick % K
+        self._tick = 0
+        self._pending = 0.0             # delivered since the last tick
+        self._sum = 0.0                 # sum of doses in the window
+        self._x = [0.0, 0.0, 0.0]       # sum of dose * age^j * r^age
+        self.iob = 0.0
+        self.activity = 0.0             # units absorbed during the last tick
+        self.total_units = 0.0          # everything ever delivered
+        self.ledger: Deque[Dose] = deque()
+
+    def add_dose(self, units: float, ts: int = 0) -> None:
+        """Record a delivery; it starts acting on the next tick, like the old IOB bump."""
+        self._pending += units
+        self.total_units += units
+        self.ledger.append(Dose(ts, units, self._tick))
+        self.iob += units
+
+    def _evaluate(self) -> float:
+        p0, p1, p2 = self.curve.poly
+        x0, x1, x2 = self._x
+        return self.curve.const * self._sum + p0 * x0 + p1 * x1 + p2 * x2
+
+    def step(self) -> float:
+        """Advance one tick. Returns the units absorbed during it."""
+        curve = self.curve
+        k = curve.ticks
+        slot = self._tick % k
+
+        # Newest dose enters at age 0
+        dose = self._pending
+        self._pending = 0.0
+        self._ring[slot] = dose
+        self._sum += dose
+        self._x[0] += dose
+        before = self._evaluate()
+
+        # Age every dose by one tick
+        r = curve.decay
+        x0, x1, x2 = self._x
+        self._x = [r * x0, r * (x1 + x0), r * (x2 + 2 * x1 + x0)]
+        self._tick += 1
+
+        # The dose now aged K ticks has been fully absorbed
+        oldest_slot = self._tick % k
+        expired = self._ring[oldest_slot]
+        if expired:
+            self._ring[oldest_slot] = 0.0
+            self._sum -= expired
+            for j in range(3):
+                self._x[j] -= expired * curve.expire[j]
+        while self.ledger and self._tick - self.ledger[0].tick >= k:
+            self.ledger.popleft()
+
+        if self._tick % k == 0:
+            self._resync()
+        after = max(0.0, self._evaluate())
+        self.activity = max(0.0, before - after)
+        self.iob = after + self._pending
+        return self.activity
+
+    def doses_by_age(self) -> np.ndarray:
+        """Window doses indexed by age in ticks; between ticks age 0 is always empty."""
+        k = self.curve.ticks
+        return self._ring[(self._tick - np.arange(k)) % k]
+
+    def _resync(self) -> None:
+        # Recompute the running sums exactly once per window so rounding can't accumulate
+        ages = np.arange(self.curve.ticks, dtype=np.float64)
+        doses = self.doses_by_age()
+        weights = self.curve.decay ** ages
+        self._sum = float(doses.sum())
+        self._x = [float(doses @ weights), float(doses @ (ages * weights)),
+                   float(doses @ (ages * ages * weights))]
+
+    def project(self, ticks: int, every: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        IOB and activity for the next `ticks` ticks with no new doses, sampled
+        every `every` ticks (activity is then what is absorbed per sample).
+        """
+        windows, pending = _projection(self.curve, ticks, every)
+        iob_future = windows @ self.doses_by_age()
+        # Pending insulin enters at age 0 on the next tick
+        if self._pending:
+            iob_future += self._pending * pending
+        return iob_future[1:], iob_future[:-1] - iob_future[1:]
+
+    def last_dose_ms(self) -> Optional[int]:
+        return self.ledger[-1].ts if self.ledger else None
+
+    def doses(self) -> List[dict]:
+        return [{"ts": d.ts, "units": d.units} for d in self.ledger]
+
+
+@lru_cache(maxsize=32)
+def _projection(curve: InsulinCurve, ticks: int, every: int) -> Tuple[np.ndarray, np.ndarray]:
+    # iob_future[j] = sum over ages a of dose[a] * iob[a + j]; only the sampled rows j are kept
+    padded = np.concatenate([curve.iob, np.zeros(ticks + 1)])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, curve.ticks)[:ticks + 1:every]
+    return np.ascontiguousarray(windows), padded[:ticks + 1:every].copy()
+
+
+def convolve_doses(doses: np.ndarray, curve: Optional[InsulinCurve] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorised path for batch simulation: doses is (M, N), insulin delivered
+    before each of M ticks for N patients. Returns (activity, iob), both
+    (M, N), matching InsulinModel.step() tick by tick.
+    """
+    curve = curve or get_curve()
+    m = doses.shape[0]
+    activity = np.zeros(doses.shape, dtype=np.float64)
+    iob_after = np.zeros(doses.shape, dtype=np.float64)
+    table_a = curve.activity
+    table_i = curve.iob[1:]
+    rows = np.flatnonzero(doses.any(axis=1))
+    if len(rows) < curve.ticks:
+        # Sparse in time (typical closed-loop dosing): spread each dosing tick over the window
+        for t in rows:
+            span = min(curve.ticks, m - t)
+            activity[t:t + span] += np.outer(table_a[:span], doses[t])
+            iob_after[t:t + span] += np.outer(table_i[:span], doses[t])
+    else:
+        # Dense: one shifted multiply-add per age in the window, over all patients at once
+        for age in range(min(curve.ticks, m)):
+            activity[age:] += doses[:m - age] * table_a[age]
+            iob_after[age:] += doses[:m - age] * table_i[age]
+    return activity, iob_after
@@ -0,0 +1,533 @@
+"""
+Capacity test: step up the number of /ws/glucose dashboards against a local
+app.py until latency breaks down, and report where it did.
+
+    python loadtest.py --spawn --steps 250,1000,2000,4000
+    python loadtest.py --url http://127.0.0.1:8000 --server-pid 4242 --pollers 50 --posts 2 --binary
+    python loadtest.py --spawn --steps 500,1000 --step-seconds 60 --out capacity.json
+
+Each step opens websocket clients (ramped, up to the step's count) and keeps
+them connected through the later steps. Optionally /state pollers
+(conditional GETs) and control POSTs run alongside. Then, for --step-seconds:
+
+- staleness: arrival time minus the frame's `timestamp` (same host, same
+  clock), i.e. how old the state a dashboard shows is
+- jitter: RFC 3550 style, |transit(i) - transit(i-1)| between a client's
+  consecutive frames
+- drops: connections refused or closed by the server mid-run
+- server: CPU and RSS of --server-pid (from /proc, so Linux only), plus the
+  scheduler's own tick jitter, loop lag and resyncs scraped from /metrics
+
+A step is healthy while p99 staleness, p99 jitter and the drop rate stay
+within budget; the report names the last healthy step. The generator
+reports its own CPU too. If it sits near 100 % of a core, it is the
+bottleneck, so run it on another machine or core (taskset) instead.
+
+The websocket client is a minimal RFC 6455 implementation on asyncio
+streams, so the harness needs nothing beyond what app.py already uses.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import resource
+import struct
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+import wire
+
+# --- CONFIGURATION ---
+DEFAULT_STEPS = "100,500,1000,2000"
+STEP_SECONDS = 30.0
+WARMUP_SECONDS = 5.0             # after a ramp, before measuring
+RAMP_PER_SEC = 250               # new websocket connections per second
+CONNECT_TIMEOUT_SEC = 10.0
+SAMPLE_INTERVAL_SEC = 1.0        # server CPU/RSS sampling
+POLL_INTERVAL_SEC = 1.0
+POST_PATHS = ("/spike", "/cooler")
+SPAWN_READY_TIMEOUT_SEC = 30.0
+
+# p99 budgets for a healthy step
+MAX_STALENESS_MS = 250.0
+MAX_JITTER_MS = 100.0
+MAX_DROP_RATE = 0.005
+
+_WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_TIMESTAMP_RE = re.compile(rb'"timestamp":(\d+)')
+_OP_CONT, _OP_TEXT, _OP_BINARY, _OP_CLOSE, _OP_PING, _OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+# --- WEBSOCKET CLIENT ---
+class WebSocketClient:
+    """Just enough RFC 6455 to receive frames: handshake, (fragmented) reads, pong and close."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, subprotocol: Optional[str]):
+        self.reader = reader
+        self.writer = writer
+        self.subprotocol = subprotocol
+
+    @classmethod
+    async def connect(cls, host: str, port: int, path: str, subprotocols: Tuple[str, ...] = ()) -> "WebSocketClient":
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16))
+        request = (f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n"
+                   f"Connection: Upgrade\r\nSec-WebSocket-Key: {key.decode()}\r\nSec-WebSocket-Version: 13\r\n")
+        if subprotocols:
+            request += f"Sec-WebSocket-Protocol: {', '.join(subprotocols)}\r\n"
+        writer.write((request + "\r\n").encode("latin-1"))
+        status = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        expected = base64.b64encode(hashlib.sha1(key + _WS_GUID).digest()).decode()
+        if b" 101 " not in status or headers.get("sec-websocket-accept") != expected:
+            writer.close()
+            raise ConnectionError(f"websocket handshake refused: {status.decode('latin-1').strip()}")
+        return cls(reader, writer, headers.get("sec-websocket-protocol"))
+
+    def _send(self, opcode: int, payload: bytes = b"") -> None:
+        # Client frames must be masked
+        mask = os.urandom(4)
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([0x80 | len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([0x80 | 126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", len(payload))
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.writer.write(header + mask + masked)
+
+    async def recv(self) -> Optional[bytes]:
+        """Next whole message payload (text or binary), or None once the server closes."""
+        parts: List[bytes] = []
+        while True:
+            b0, b1 = await self.reader.readexactly(2)
+            length = b1 & 0x7F
+            if length == 126:
+                (length,) = struct.unpack("!H", await self.reader.readexactly(2))
+            elif length == 127:
+                (length,) = struct.unpack("!Q", await self.reader.readexactly(8))
+            mask = await self.reader.readexactly(4) if b1 & 0x80 else None
+            payload = await self.reader.readexactly(length)
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            opcode = b0 & 0x0F
+            if opcode == _OP_CLOSE:
+                return None
+            if opcode == _OP_PING:
+                self._send(_OP_PONG, payload)
+                continue
+            if opcode in (_OP_TEXT, _OP_BINARY, _OP_CONT):
+                parts.append(payload)
+                if b0 & 0x80:
+                    return b"".join(parts)
+
+    async def close(self) -> None:
+        try:
+            self._send(_OP_CLOSE, struct.pack("!H", 1000))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+# --- MEASUREMENT ---
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _dist(values: List[float]) -> Dict[str, Optional[float]]:
+    def r(v):
+        return None if v is None else round(v, 2)
+    return {"p50": r(_percentile(values, 0.50)), "p99": r(_percentile(values, 0.99)),
+            "max": r(max(values) if values else None), "n": len(values)}
+
+
+class Samples:
+    """Everything measured during one step's window; reset() when the window opens."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.staleness_ms: List[float] = []
+        self.jitter_ms: List[float] = []
+        self.poll_ms: List[float] = []
+        self.post_ms: List[float] = []
+        self.frames = 0
+        self.bytes = 0
+        self.poll_errors = 0
+        self.post_errors = 0
+        self.started = time.perf_counter()
+
+
+class ProcessSampler:
+    """CPU seconds and RSS of one process from /proc."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._tick = os.sysconf("SC_CLK_TCK")
+        self.rss_peak = 0
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._tick    # utime + stime
+
+    def rss_bytes(self) -> int:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def sample(self) -> None:
+        self.rss_peak = max(self.rss_peak, self.rss_bytes())
+
+
+def _parse_metrics(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name_labels, _, value = line.rpartition(" ")
+        name, _, labels = name_labels.partition("{")
+        pairs = tuple(sorted(re.findall(r'(\w+)="([^"]*)"', labels)))
+        samples[(name, pairs)] = float(value)
+    return samples
+
+
+def _counter_delta(before, after, name: str) -> float:
+    return sum(v - before.get(k, 0.0) for k, v in after.items() if k[0] == name)
+
+
+def _histogram_quantile(before, after, name: str, q: float, **match: str) -> Optional[float]:
+    """Upper bucket bound holding the q-quantile of the observations between two scrapes, in ms."""
+    buckets: Dict[float, float] = {}
+    for key, value in after.items():
+        labels = dict(key[1])
+        if key[0] != f"{name}_bucket" or any(labels.get(k) != v for k, v in match.items()):
+            continue
+        bound = float("inf") if labels["le"] == "+Inf" else float(labels["le"])
+        buckets[bound] = buckets.get(bound, 0.0) + value - before.get(key, 0.0)
+    if not buckets or buckets[max(buckets)] <= 0:
+        return None
+    total = buckets[max(buckets)]
+    for bound in sorted(buckets):
+        if buckets[bound] >= q * total:
+            return bound * 1000
+    return None
+
+
+# --- LOAD ---
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        url = urlsplit(args.url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.subprotocols = (wire.BINARY_SUBPROTOCOL,) if args.binary else ()
+        self.samples = Samples()
+        self.clients: List[asyncio.Task] = []
+        self.background: List[asyncio.Task] = []
+        self.stopping = False
+        # Cumulative, so failures while ramping count against the step
+        self.drops = 0
+        self.connect_failures = 0
+        self.http = httpx.AsyncClient(base_url=args.url, timeout=CONNECT_TIMEOUT_SEC,
+                                      limits=httpx.Limits(max_connections=max(10, args.pollers + 10)))
+
+    def live_clients(self) -> int:
+        return sum(1 for task in self.clients if not task.done())
+
+    async def _ws_client(self) -> None:
+        samples = self.samples
+        try:
+            ws = await asyncio.wait_for(
+                WebSocketClient.connect(self.host, self.port, self.args.path, self.subprotocols), CONNECT_TIMEOUT_SEC)
+        except (OSError, asyncio.TimeoutError, ConnectionError):
+            self.connect_failures += 1
+            return
+        last_transit = None
+        try:
+            while True:
+                message = await ws.recv()
+                if message is None:
+                    break
+                now_ms = time.time() * 1000
+                samples = self.samples
+                samples.frames += 1
+                samples.bytes += len(message)
+                # Every frame carries the snapshot timestamp (it changes on every version)
+                found = _TIMESTAMP_RE.search(message)
+                if found:
+                    transit = now_ms - int(found.group(1))
+                    samples.staleness_ms.append(transit)
+                    if last_transit is not None:
+                        samples.jitter_ms.append(abs(transit - last_transit))
+                    last_transit = transit
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            await ws.close()
+            raise
+        if not self.stopping:
+            self.drops += 1
+
+    async def _poller(self) -> None:
+        etag = None
+        while True:
+            started = time.perf_counter()
+            try:
+                headers = {"If-None-Match": etag} if etag else {}
+                if self.args.binary:
+                    headers["Accept"] = wire.BINARY_MEDIA_TYPE
+                response = await self.http.get("/state", headers=headers)
+                if response.status_code == 200:
+                    etag = response.headers.get("etag")
+                elif response.status_code != 304:
+                    raise httpx.HTTPStatusError("bad status", request=response.request, response=response)
+                self.samples.poll_ms.append((time.perf_counter() - started) * 1000)
+            except httpx.HTTPError:
+                self.samples.poll_errors += 1
+            await asyncio.sleep(max(0.0, POLL_INTERVAL_SEC - (time.perf_counter() - started)))
+
+    async def _poster(self) -> None:
+        i = 0
+        interval = 1.0 / self.args.posts
+        while True:
+            started = time.perf_counter()
+            try:
+                response = await self.http.post(POST_PATHS[i % len(POST_PATHS)])
+                response.raise_for_status()
+                self.samples.post_ms.append((time.perf_counter() - started) * 1000)
+            except httpx.HTTPError:
+                self.samples.post_errors += 1
+            i += 1
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+    async def _ramp_to(self, target: int) -> None:
+        missing = target - self.live_clients()
+        for _ in range(max(0, missing)):
+            self.clients.append(asyncio.create_task(self._ws_client()))
+            await asyncio.sleep(1.0 / RAMP_PER_SEC)
+
+    async def _scrape(self) -> Dict:
+        try:
+            return _parse_metrics((await self.http.get("/metrics")).text)
+        except httpx.HTTPError:
+            return {}
+
+    async def run_step(self, target: int, sampler: Optional[ProcessSampler]) -> Dict[str, Any]:
+        drops, failures = self.drops, self.connect_failures
+        await self._ramp_to(target)
+        await asyncio.sleep(WARMUP_SECONDS)
+
+        before = await self._scrape()
+        cpu_before = sampler.cpu_seconds() if sampler else None
+        own_before = time.process_time()
+        if sampler:
+            sampler.rss_peak = 0
+        self.samples.reset()
+        connected_min = self.live_clients()
+        deadline = time.perf_counter() + self.args.step_seconds
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(min(SAMPLE_INTERVAL_SEC, max(0.0, deadline - time.perf_counter())))
+            connected_min = min(connected_min, self.live_clients())
+            if sampler:
+                sampler.sample()
+        s = self.samples
+        elapsed = time.perf_counter() - s.started
+        after = await self._scrape()
+        drops, failures = self.drops - drops, self.connect_failures - failures
+
+        result = {
+            "clients": target,
+            "connected": self.live_clients(),
+            "connectedMin": connected_min,
+            "seconds": round(elapsed, 1),
+            "framesPerSec": round(s.frames / elapsed, 1),
+            "kibPerSec": round(s.bytes / elapsed / 1024, 1),
+            "stalenessMs": _dist(s.staleness_ms),
+            "jitterMs": _dist(s.jitter_ms),
+            "drops": drops,
+            "connectFailures": failures,
+            "dropRate": round((drops + failures) / max(1, target), 4),
+            "generatorCpuPct": round(100 * (time.process_time() - own_before) / elapsed, 1),
+        }
+        if self.args.pollers:
+            result["pollMs"] = _dist(s.poll_ms)
+            result["pollErrors"] = s.poll_errors
+        if self.args.posts:
+            result["postMs"] = _dist(s.post_ms)
+            result["postErrors"] = s.post_errors
+        if sampler:
+            result["serverCpuPct"] = round(100 * (sampler.cpu_seconds() - cpu_before) / elapsed, 1)
+            result["serverRssMiB"] = round(sampler.rss_peak / 2**20, 1)
+        if before and after:
+            result["server"] = {
+                "tickJitterP99Ms": _histogram_quantile(before, after, "glucodose_loop_jitter_seconds", 0.99,
+                                                       loop="glucose"),
+                "loopLagP99Ms": _histogram_quantile(before, after, "glucodose_event_loop_lag_seconds", 0.99),
+                "wsSendP99Ms": _histogram_quantile(before, after, "glucodose_ws_send_duration_seconds", 0.99),
+                "resyncs": int(_counter_delta(before, after, "glucodose_ws_resyncs_total")),
+                "overruns": int(_counter_delta(before, after, "glucodose_scheduler_overruns_total")),
+            }
+        result["healthy"] = _healthy(result)
+        return result
+
+    async def run(self, steps: List[int], sampler: Optional[ProcessSampler]) -> List[Dict[str, Any]]:
+        if self.args.start:
+            await self.http.post("/start")
+        self.background = [asyncio.create_task(self._poller()) for _ in range(self.args.pollers)]
+        if self.args.posts:
+            self.background.append(asyncio.create_task(self._poster()))
+        results = []
+        try:
+            for target in steps:
+                print(f"📈 {target} clients...", file=sys.stderr)
+                result = await self.run_step(target, sampler)
+                results.append(result)
+                print(_row(result), file=sys.stderr)
+                if not result["healthy"] and not self.args.keep_going:
+                    break
+        finally:
+            self.stopping = True
+            for task in self.clients + self.background:
+                task.cancel()
+            await asyncio.gather(*self.clients, *self.background, return_exceptions=True)
+            await self.http.aclose()
+        return results
+
+
+def _healthy(result: Dict[str, Any]) -> bool:
+    staleness, jitter = result["stalenessMs"]["p99"], result["jitterMs"]["p99"]
+    return (result["framesPerSec"] > 0
+            and staleness is not None and staleness <= MAX_STALENESS_MS
+            and (jitter is None or jitter <= MAX_JITTER_MS)
+            and result["dropRate"] <= MAX_DROP_RATE)
+
+
+# --- REPORT ---
+_COLUMNS = ("clients", "connected", "frames/s", "stale p50", "stale p99", "jitter p99",
+            "tick jit p99", "srv CPU %", "RSS MiB", "gen CPU %", "drops", "ok")
+
+
+def _row(r: Dict[str, Any]) -> str:
+    server = r.get("server", {})
+    cells = (r["clients"], r["connected"], r["framesPerSec"], r["stalenessMs"]["p50"], r["stalenessMs"]["p99"],
+             r["jitterMs"]["p99"], server.get("tickJitterP99Ms"), r.get("serverCpuPct"), r.get("serverRssMiB"),
+             r["generatorCpuPct"], r["drops"] + r["connectFailures"], "✅" if r["healthy"] else "❌")
+    return "  ".join(f"{'-' if c is None else c:>12}" for c in cells)
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print("  ".join(f"{c:>12}" for c in _COLUMNS))
+    for r in report["steps"]:
+        print(_row(r))
+    capacity = report["capacity"]
+    if capacity is None:
+        print("\n❌ Not even the first step stayed within budget")
+    else:
+        print(f"\n🏁 Healthy up to {capacity} concurrent dashboards "
+              f"(p99 staleness <= {MAX_STALENESS_MS:g} ms, p99 jitter <= {MAX_JITTER_MS:g} ms, "
+              f"drops <= {MAX_DROP_RATE:.1%})")
+    broken = next((r for r in report["steps"] if not r["healthy"]), None)
+    if broken:
+        print(f"   Broke down at {broken['clients']}: staleness p99 {broken['stalenessMs']['p99']} ms, "
+              f"jitter p99 {broken['jitterMs']['p99']} ms, {broken['drops'] + broken['connectFailures']} drops")
+    if any(r["generatorCpuPct"] > 90 for r in report["steps"]):
+        print("⚠️ The generator was CPU bound; run it on another core or machine for trustworthy numbers")
+
+
+# --- SERVER ---
+def _raise_fd_limit() -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _spawn_server(port: int) -> subprocess.Popen:
+    here = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable, "app.py", "--host", "127.0.0.1", "--port", str(port)], cwd=here,
+                              env=dict(os.environ, GLUCODOSE_LOG="off"), stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + SPAWN_READY_TIMEOUT_SEC
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"app.py did not come up on port {port}")
+
+
+def main(args: argparse.Namespace) -> Dict[str, Any]:
+    _raise_fd_limit()
+    steps = [int(s) for s in args.steps.split(",")]
+    server = None
+    pid = args.server_pid
+    if args.spawn:
+        args.url = f"http://127.0.0.1:{args.port}"
+        server = _spawn_server(args.port)
+        pid = server.pid
+    try:
+        sampler = ProcessSampler(pid) if pid and os.path.exists(f"/proc/{pid}") else None
+        results = asyncio.run(LoadTest(args).run(steps, sampler))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    healthy = [r["clients"] for r in results if r["healthy"]]
+    return {
+        "url": args.url,
+        "format": "binary" if args.binary else "json",
+        "pollers": args.pollers,
+        "postsPerSec": args.posts,
+        "budgets": {"stalenessP99Ms": MAX_STALENESS_MS, "jitterP99Ms": MAX_JITTER_MS, "dropRate": MAX_DROP_RATE},
+        "steps": results,
+        "capacity": max(healthy) if healthy else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Websocket capacity test for app.py")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/ws/glucose")
+    parser.add_argument("--steps", default=DEFAULT_STEPS, help="comma-separated websocket client counts")
+    parser.add_argument("--step-seconds", type=float, default=STEP_SECONDS)
+    parser.add_argument("--pollers", type=int, default=0, help="concurrent /state pollers, one GET per second each")
+    parser.add_argument("--posts", type=float, default=0.0, help=f"control POSTs per second ({', '.join(POST_PATHS)})")
+    parser.add_argument("--binary", action="store_true", help="negotiate the wire.py binary format")
+    parser.add_argument("--no-start", dest="start", action="store_false", help="don't POST /start first")
+    parser.add_argument("--keep-going", action="store_true", help="run every step even after one breaks down")
+    parser.add_argument("--server-pid", type=int, default=None, help="app.py process to sample CPU/RSS from")
+    parser.add_argument("--spawn", action="store_true", help="start app.py on --port for the run")
+    parser.add_argument("--port", type=int, default=8010, help="port for --spawn")
+    parser.add_argument("--out", help="write the JSON report here")
+    args = parser.parse_args()
+
+    report = main(args)
+    print()
+    print_report(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.out}")
@@ -0,0 +1,221 @@
+"""
+Process-wide instrumentation, served on /metrics in the Prometheus text format.
+
+Counters, gauges and fixed-bucket histograms with optional labels, kept
+dependency-free and cheap enough to update from the tick loops: a labelled
+child is resolved once and an observation is a bisect plus two additions.
+"""
+import asyncio
+import bisect
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# --- CONFIGURATION ---
+LAG_PROBE_INTERVAL_SEC = 0.25
+
+# Seconds; covers sub-millisecond loop work up to multi-second relay timeouts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **values):
+        """Child for one label combination; resolve it once and keep it on hot paths."""
+        key = tuple(str(values[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self._children[()]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_label_text(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default().dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def _render_child(self, key, child):
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {cumulative}")
+        labels = _label_text(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- METRICS ---
+LOOP_LAG = Histogram("glucodose_event_loop_lag_seconds",
+                     "How late a periodic asyncio timer fires (event loop responsiveness)")
+LOOP_INTERVAL = Histogram("glucodose_loop_interval_seconds",
+                          "Actual time between iterations of a periodic simulation loop", ["loop"],
+                          buckets=(0.5, 0.9, 0.99, 1.01, 1.1, 2.0, 4.5, 4.95, 5.05, 5.5, 9.9, 10.1, 11.0, 15.0, 30.0))
+LOOP_JITTER = Histogram("glucodose_loop_jitter_seconds",
+                        "Absolute difference between actual and scheduled loop interval", ["loop"])
+LOOP_TICK_DURATION = Histogram("glucodose_loop_tick_duration_seconds",
+                               "Time spent running one loop iteration over all sessions", ["loop"])
+SCHEDULER_OVERRUNS = Counter("glucodose_scheduler_overruns_total",
+                             "Periods a scheduled job missed because a run finished past its next deadline", ["job"])
+SCHEDULER_ERRORS = Counter("glucodose_scheduler_job_errors_total",
+                           "Scheduled job runs that raised (the scheduler logs them and carries on)", ["job"])
+RELAY_LATENCY = Histogram("glucodose_relay_request_duration_seconds",
+                          "Relay board call latency including retries", ["path"])
+RELAY_REQUESTS = Counter("glucodose_relay_requests_total", "Relay board calls", ["path"])
+RELAY_FAILURES = Counter("glucodose_relay_failures_total", "Relay board calls that failed after retries", ["path"])
+WS_CLIENTS = Gauge("glucodose_ws_clients", "Connected /ws/glucose clients")
+WS_SEND = Histogram("glucodose_ws_send_duration_seconds", "Time to hand one frame to a websocket")
+WS_BYTES = Counter("glucodose_ws_bytes_sent_total", "Websocket payload bytes sent")
+WS_FRAMES = Counter("glucodose_ws_frames_sent_total", "Websocket frames sent")
+WS_RESYNCS = Counter("glucodose_ws_resyncs_total", "Slow websocket clients dropped back to a full snapshot")
+DECISION_LATENCY = Histogram("glucodose_decision_latency_seconds",
+                             "Time from a CGM reading being published to the oref1 decision on it",
+                             buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                                      0.0025, 0.005, 0.01, 0.025, 0.1))
+DECISIONS_RATE_LIMITED = Counter("glucodose_decisions_rate_limited_total",
+                                 "CGM readings that arrived inside the minimum decision interval")
+ACTUATOR_QUEUE_WAIT = Histogram("glucodose_actuator_queue_wait_seconds",
+                                "Time from a command being submitted to its actuator starting it", ["actuator"],
+                                buckets=(0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0))
+ACTUATOR_EXEC = Histogram("glucodose_actuator_exec_seconds", "Time an actuator spent running one command",
+                          ["actuator"], buckets=(0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 10.5, 11.0, 15.0, 30.0,
+                                                 31.0, 35.0, 60.0, 120.0))
+ACTUATOR_COMMANDS = Counter("glucodose_actuator_commands_total",
+                            "Actuator command submissions and their outcomes", ["actuator", "outcome"])
+ACTUATOR_QUEUE_DEPTH = Gauge("glucodose_actuator_queue_depth", "Commands waiting for their actuator, all sessions",
+                             ["actuator"])
+SNAPSHOT_BUILD = Histogram("glucodose_snapshot_build_seconds", "Time to build and encode a /state snapshot")
+SESSIONS = Gauge("glucodose_sessions", "Live patient sessions")
+
+
+async def monitor_loop_lag(interval: float = LAG_PROBE_INTERVAL_SEC) -> None:
+    """Samples event-loop lag forever; run it as a task next to the simulation."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, time.perf_counter() - start - interval))
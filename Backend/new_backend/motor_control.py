@@ -1,8 +1,10 @@
-import asyncio
-import time
-import random
-import requests
-import state
+from typing import Optional, Tuple
+from state import PatientState
+from hardware import relay
+from eventlog import log
+from events import DELIVERY_COMPLETE
+from tracing import now_ns, tracer
+from actuators import Command
 
 # Config
 MOTOR_PULSE_DURATION_SEC = 10
@@ -15,28 +17,35 @@ MM_PER_UNIT = 0.3158
 PITCH_MM_PER_ROT = 0.7
 PULSES_PER_ROT = 4172
 
-def _hardware_motor_on():
-    try:
-        requests.get("http://192.168.1.17/relay/on", timeout=1) 
-        print("[HARDWARE] Relay ON")
-    except: pass
+async def _hardware_motor_on():
+    result = await relay.call("/relay/on")
+    log.event("hardware.relay", state="ON", ok=result.ok, latency_ms=round(result.latency_ms, 1), error=result.error)
+    return result
 
-def _hardware_motor_off():
-    try:
-        requests.get("http://192.168.1.17/relay/off", timeout=1)
-        print("[HARDWARE] Relay OFF")
-    except: pass
+async def _hardware_motor_off():
+    result = await relay.call("/relay/off")
+    log.event("hardware.relay", state="OFF", ok=result.ok, latency_ms=round(result.latency_ms, 1), error=result.error)
+    return result
 
-async def motor_pulse():
-    print("--- MOTOR SEQUENCE STARTED ---")
+async def motor_pulse(patient: PatientState, commanded_at: Optional[float] = None):
+    """
+    commanded_at is the scheduler tick that asked for the delivery. The
+    absorption wait is timed from it rather than from when this task got to
+    run, so decisions on the tick grid don't depend on event-loop latency.
+    """
+    if patient.verbose: log.event("motor.start", session=patient.session_id)
+    started = patient.clock.time() if commanded_at is None else commanded_at
+    pulse_started = now_ns()
     
-    state.motor_state = "ON"
-    _hardware_motor_on()
+    patient.motor_state = "ON"
+    patient.touch()
+    if patient.recorder: patient.recorder.record_event(patient.now_ms(), "motor", "ON")
+    if patient.hardware: await _hardware_motor_on()
     
     # --- 1. VISUAL/MECHANICAL CALCULATION (For the Display) ---
     # We want BIG numbers for the judges, and lots of variance.
     # Generate a random multiplier between 5.0 and 10.0
-    random_multiplier = random.uniform(5.0, 10.0)
+    random_multiplier = patient.device_rng.uniform(5.0, 10.0)
     
     # Calculate "Fake" large movement for display
     display_dose = SAFE_PHYSICS_DOSE * random_multiplier
@@ -47,24 +56,51 @@ async def motor_pulse():
     pulses = int(rotations * PULSES_PER_ROT)
     
     # Update State (What the Frontend shows)
-    state.last_plunger_mm = plunger_move
-    state.last_motor_rotations = rotations
-    state.last_encoder_pulses = pulses
-    state.last_bolus_amount = display_dose # Optional: if you want to show the varied dose size
-    
-    # Wait for the motor to "move"
-    await asyncio.sleep(MOTOR_PULSE_DURATION_SEC)
+    patient.last_plunger_mm = plunger_move
+    patient.last_motor_rotations = rotations
+    patient.last_encoder_pulses = pulses
+    patient.last_bolus_amount = display_dose # Optional: if you want to show the varied dose size
+    patient.touch()
     
-    state.motor_state = "OFF"
-    _hardware_motor_off()
+    # Wait for the motor to "move"; a cancelled pulse still switches the relay off
+    try:
+        await patient.clock.sleep(MOTOR_PULSE_DURATION_SEC)
+    finally:
+        patient.motor_state = "OFF"
+        patient.touch()
+        if patient.hardware: await _hardware_motor_off()
+        # Relay on -> relay off, recorded for cancelled pulses too
+        tracer.async_span("motor.pulse", patient.session_id, pulse_started, rotations=round(rotations, 4),
+                          pulses=pulses, plunger_mm=round(plunger_move, 4))
     
     # --- 2. PHYSICS CALCULATION (For the Algorithm) ---
     # We add the SAFE amount to the body, so the BG graph behaves correctly
-    state.current_iob += SAFE_PHYSICS_DOSE
+    patient.insulin.add_dose(SAFE_PHYSICS_DOSE, patient.now_ms())
+    patient.touch()
+    if patient.recorder: patient.recorder.record_event(patient.now_ms(), "motor", "OFF", SAFE_PHYSICS_DOSE)
     
-    print(f"[MECHANICS] Visual Multiplier: x{random_multiplier:.1f}")
-    print(f"[DISPLAY] Rot: {rotations:.4f} | Pulses: {pulses} | Plunger: {plunger_move:.4f}")
-    print(f"[PHYSICS] Actual IOB added: {SAFE_PHYSICS_DOSE} U")
+    if patient.verbose:
+        log.event("motor.delivered", session=patient.session_id, multiplier=round(random_multiplier, 1),
+                  rotations=round(rotations, 4), pulses=pulses, plunger_mm=round(plunger_move, 4),
+                  dose=SAFE_PHYSICS_DOSE)
     
-    state.last_delivery_time = time.time()
-    print("--- MOTOR SEQUENCE END ---")
\ No newline at end of file
+    patient.last_delivery_time = started + MOTOR_PULSE_DURATION_SEC
+    patient.events.publish(DELIVERY_COMPLETE, patient, ts=patient.now_ms(), units=SAFE_PHYSICS_DOSE)
+    tracer.instant("motor.delivered", patient.session_id, units=SAFE_PHYSICS_DOSE, iob=round(patient.current_iob, 3))
+    if patient.verbose: log.event("motor.end", session=patient.session_id)
+
+def request_pulse(patient: PatientState, commanded_at: Optional[float] = None,
+                  source: str = "oref1", key: str = "pulse") -> Tuple[str, Optional[Command]]:
+    """
+    Queue one pulse on the patient's motor; a pulse already waiting under the
+    same key absorbs a duplicate.
+    """
+    outcome, command = patient.motor_queue.submit(key, lambda: motor_pulse(patient, commanded_at), source)
+    tracer.instant("motor.command", patient.session_id, source=source, outcome=outcome)
+    return outcome, command
+
+def actuation_tick(patient: PatientState, tick_time: Optional[float] = None):
+    """Start the motor for a delivery the decision phase asked for."""
+    if patient.pending_delivery:
+        patient.pending_delivery = False
+        request_pulse(patient, tick_time)
\ No newline at end of file
@@ -0,0 +1,269 @@
+"""
+Offline replay: stream recorded CGM traces through the oref1 decision logic.
+
+Traces are Nightscout-style readings ({"date": epoch ms, "sgv": mg/dL,
+"direction": "Flat"}, as oref1/generator.py writes them), either NDJSON
+(one reading per line, like glucose.ndjson) or a JSON array (like
+glucose.json or a Nightscout entries download). Files are parsed
+incrementally and replayed oldest first whichever way they are sorted, so a
+multi-GB trace never has to fit in memory.
+
+Glucose comes from the trace. IOB comes from the insulin model, fed by the
+doses the decisions deliver (instantly, there is no motor to wait for). The
+trace is real time, so the insulin curve defaults to a real rapid-acting
+analog rather than the simulator's compressed one.
+
+    python replay.py trace.ndjson
+    python replay.py week1.json week2.json week3.json --workers 3 --out recs/
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import state
+import fake_oref1
+from clock import ManualClock
+from insulin_model import InsulinModel, get_curve
+from motor_control import SAFE_PHYSICS_DOSE
+
+# --- CONFIGURATION ---
+REPLAY_DIA_MINUTES = 300.0
+REPLAY_PEAK_MINUTES = 75.0
+REPLAY_TICK_SECONDS = 300       # insulin model resolution: one step per 5-min CGM reading, like oref0
+READ_BLOCK_BYTES = 1 << 20
+
+# Nightscout direction -> the simulator's trend labels
+DIRECTION_TRENDS = {
+    "DoubleUp": "Rising", "SingleUp": "Rising", "FortyFiveUp": "Slight Up", "Flat": "Flat",
+    "FortyFiveDown": "Slight Down", "SingleDown": "Falling", "DoubleDown": "Falling",
+}
+
+
+# --- TRACE READERS ---
+def _iter_ndjson(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _iter_ndjson_reversed(path: str, block: int = READ_BLOCK_BYTES) -> Iterator[Dict[str, Any]]:
+    """Last line first, reading the file backwards one block at a time."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b""
+        while position > 0:
+            step = min(block, position)
+            position -= step
+            f.seek(position)
+            lines = (f.read(step) + tail).split(b"\n")
+            tail = lines.pop(0)     # may be cut mid-line; finished by the next block
+            for line in reversed(lines):
+                if line.strip():
+                    yield json.loads(line)
+        if tail.strip():
+            yield json.loads(tail)
+
+
+def _iter_json_array(path: str, block: int = READ_BLOCK_BYTES) -> Iterator[Dict[str, Any]]:
+    """Elements of a top-level JSON array, decoded one at a time from a sliding buffer."""
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buf = f.read(block).lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"{path}: expected a JSON array")
+        pos, eof = 1, False
+        while True:
+            # Skip separators, refilling once the block is used up; stop at the closing bracket
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    break
+                buf, pos = f.read(block), 0
+                eof = not buf
+            if pos >= len(buf) or buf[pos] == "]":
+                return
+            try:
+                element, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Element runs past the end of the block: carry it over into the next one
+                more = f.read(block)
+                if not more:
+                    raise
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield element
+
+
+def _newest_first(readings: Iterator[Dict[str, Any]]):
+    """Peek at the first two dated readings. Returns (newest_first, the same iterator)."""
+    head = list(itertools.islice(readings, 2))
+    dated = [r for r in head if "date" in r]
+    descending = len(dated) == 2 and dated[0]["date"] > dated[1]["date"]
+    return descending, itertools.chain(head, readings)
+
+
+def iter_trace(path: str) -> Iterator[Dict[str, Any]]:
+    """Readings from a trace file, oldest first, without loading the file."""
+    with open(path, "rb") as f:
+        first = f.read(64).lstrip()[:1]
+    if first != b"[":
+        peek = _iter_ndjson(path)
+        descending, _ = _newest_first(peek)
+        peek.close()    # release its file handle before the real pass opens another
+        yield from (_iter_ndjson_reversed(path) if descending else _iter_ndjson(path))
+        return
+    descending, readings = _newest_first(_iter_json_array(path))
+    if not descending:
+        yield from readings
+        return
+    # Newest-first array: spill it to NDJSON in file order, then read that backwards
+    with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as spill:
+        for reading in readings:
+            spill.write(json.dumps(reading, separators=(",", ":")) + "\n")
+    try:
+        yield from _iter_ndjson_reversed(spill.name)
+    finally:
+        os.remove(spill.name)
+
+
+# --- ENGINE ---
+class Replay:
+    """One patient driven by a trace instead of the physics model."""
+
+    def __init__(self, session_id: str = "replay", dia_minutes: float = REPLAY_DIA_MINUTES,
+                 peak_minutes: float = REPLAY_PEAK_MINUTES, tick_seconds: float = REPLAY_TICK_SECONDS,
+                 params: Optional[state.PatientParams] = None):
+        self.clock = ManualClock()
+        self.patient = state.PatientState(session_id, seed=0, clock=self.clock, params=params)
+        self.patient.insulin = InsulinModel(get_curve(dia_minutes, peak_minutes, tick_seconds))
+        # The simulator's trend assumes its 5 s tick; CGM readings are minutes apart
+        self.patient.raw_trend = fake_oref1.timestamp_trend_per_minute
+        self.patient.system_running = True
+        self.tick_ms = int(tick_seconds * 1000)
+        self._model_ms: Optional[int] = None
+        self._last_ts: Optional[int] = None
+
+        self.readings = 0
+        self.in_range = 0
+        self.skipped = 0            # no usable sgv, or not newer than the previous reading
+        self.decisions = 0
+        self.actions: Dict[str, int] = {}
+        self.max_iob = 0.0
+        self.first_ts: Optional[int] = None
+
+    def _advance_insulin(self, ts: int) -> None:
+        if self._model_ms is None:
+            self._model_ms = ts
+            return
+        ticks = (ts - self._model_ms) // self.tick_ms
+        self._model_ms += ticks * self.tick_ms
+        # Past one DIA window the model is empty and further steps change nothing
+        for _ in range(min(ticks, self.patient.insulin.curve.ticks + 1)):
+            self.patient.insulin.step()
+
+    def feed(self, reading: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Apply one reading. Returns the recommendation if a decision ran on it."""
+        sgv, ts = reading.get("sgv"), reading.get("date")
+        if not isinstance(sgv, (int, float)) or ts is None or (self._last_ts is not None and ts <= self._last_ts):
+            self.skipped += 1
+            return None
+        patient = self.patient
+        ts = int(ts)
+        self._last_ts = ts
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.clock.set(ts / 1000.0)
+        self._advance_insulin(ts)
+
+        patient.glucose_history.append(ts=ts, bg=int(sgv), trend=DIRECTION_TRENDS.get(reading.get("direction"), "Flat"))
+        patient.last_bg = float(sgv)
+        self.readings += 1
+        if patient.params.target_min_bg <= sgv <= patient.params.target_max_bg:
+            self.in_range += 1
+
+        if not fake_oref1.decision_due(patient):
+            return None
+        action = fake_oref1.oref1_tick(patient)
+        if patient.pending_delivery:
+            patient.pending_delivery = False
+            patient.insulin.add_dose(SAFE_PHYSICS_DOSE, ts)
+            patient.last_delivery_time = self.clock.time()
+        self.decisions += 1
+        self.actions[action] = self.actions.get(action, 0) + 1
+        self.max_iob = max(self.max_iob, patient.current_iob)
+        rec = patient.basal_history.latest_row()
+        return {"ts": ts, "bg": int(sgv), "iob": round(patient.current_iob, 3), "action": action, **rec}
+
+    def run(self, readings: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Stream of recommendations, one per decision."""
+        for reading in readings:
+            rec = self.feed(reading)
+            if rec is not None:
+                yield rec
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "readings": self.readings,
+            "skipped": self.skipped,
+            "hours": round((self._last_ts - self.first_ts) / 3.6e6, 2) if self.readings else 0.0,
+            "timeInRangePct": round(100.0 * self.in_range / max(1, self.readings), 1),
+            "decisions": self.decisions,
+            "deliver": self.actions.get("DELIVER", 0),
+            "suspend": self.actions.get("SUSPEND", 0),
+            "maxIOB": round(self.max_iob, 3),
+            "insulinDelivered": round(self.actions.get("DELIVER", 0) * SAFE_PHYSICS_DOSE, 3),
+        }
+
+
+def replay_file(path: str, out_dir: Optional[str] = None, **engine_args) -> Dict[str, Any]:
+    """Replay one trace; recommendations go to <out_dir>/<name>.recs.ndjson if out_dir is set."""
+    started = time.perf_counter()
+    engine = Replay(os.path.basename(path), **engine_args)
+    recs = engine.run(iter_trace(path))
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(os.path.join(out_dir, f"{name}.recs.ndjson"), "w") as out:
+            for rec in recs:
+                out.write(json.dumps(rec, separators=(",", ":")) + "\n")
+    else:
+        for _ in recs:
+            pass
+    elapsed = time.perf_counter() - started
+    return {"trace": path, **engine.summary(), "seconds": round(elapsed, 3),
+            "readingsPerSec": round(engine.readings / elapsed) if elapsed > 0 else None}
+
+
+def replay_files(paths: List[str], workers: Optional[int] = None, out_dir: Optional[str] = None,
+                 **engine_args) -> List[Dict[str, Any]]:
+    """One process per trace (up to `workers`); results come back in input order."""
+    if len(paths) == 1 or workers == 1:
+        return [replay_file(path, out_dir, **engine_args) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(replay_file, path, out_dir, **engine_args) for path in paths]
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay CGM traces through the oref1 decision logic")
+    parser.add_argument("traces", nargs="+", help="NDJSON or JSON array trace files")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument("--out", default=None, help="directory for <trace>.recs.ndjson recommendation streams")
+    parser.add_argument("--dia", type=float, default=REPLAY_DIA_MINUTES, help="insulin DIA, minutes")
+    parser.add_argument("--peak", type=float, default=REPLAY_PEAK_MINUTES, help="insulin peak, minutes")
+    args = parser.parse_args()
+
+    results = replay_files(args.traces, args.workers, args.out, dia_minutes=args.dia, peak_minutes=args.peak)
+    for row in results:
+        print(json.dumps(row))
+    total = sum(row["readings"] for row in results)
+    seconds = max(row["seconds"] for row in results)
+    print(f"⏱️ Replayed {total:,} readings from {len(results)} trace(s) in {seconds:.2f} s")
@@ -0,0 +1,131 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Small int codes for the CGM trend arrows, stored instead of the strings
+TREND_LABELS = ("Flat", "Slight Up", "Rising", "Slight Down", "Falling")
+
+
+class ColumnRing:
+    """
+    Fixed-capacity ring buffer with one typed NumPy array per column.
+
+    Storage is preallocated at twice the capacity and every value is written
+    to slot i and slot i + capacity, so the newest k rows are always one
+    contiguous slice: window views are zero-copy and appends are O(1).
+    Rows in the old list-of-dicts JSON shape are only built by rows().
+    """
+
+    def __init__(self, capacity: int, schema: Sequence[Tuple[str, Any]],
+                 codes: Optional[Dict[str, Sequence[str]]] = None):
+        self.capacity = capacity
+        self.columns = tuple(name for name, _ in schema)
+        self._data = {name: np.zeros(2 * capacity, dtype=dtype) for name, dtype in schema}
+        # Enum columns: label <-> small int code
+        self._labels = {name: tuple(labels) for name, labels in (codes or {}).items()}
+        self._codes = {name: {label: i for i, label in enumerate(labels)}
+                       for name, labels in self._labels.items()}
+        self._head = 0     # next physical slot to write, in [0, capacity)
+        self._len = 0
+        self.seq = 0       # total rows ever appended; row n (1-based) has seq n
+
+    @property
+    def maxlen(self) -> int:
+        return self.capacity
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __bool__(self) -> bool:
+        return self._len > 0
+
+    def append(self, **values) -> None:
+        i, mirror = self._head, self._head + self.capacity
+        for name, value in values.items():
+            if name in self._codes:
+                value = self._codes[name][value]
+            column = self._data[name]
+            column[i] = value
+            column[mirror] = value
+        self._head = (i + 1) % self.capacity
+        self._len = min(self._len + 1, self.capacity)
+        self.seq += 1
+
+    def clear(self) -> None:
+        self._head = 0
+        self._len = 0
+
+    def load(self, columns: Dict[str, Sequence[Any]]) -> None:
+        """Replace the contents with raw column values (enum codes, not labels), oldest first."""
+        n = min(min(len(values) for values in columns.values()), self.capacity)
+        for name in self.columns:
+            values = columns[name][len(columns[name]) - n:]
+            column = self._data[name]
+            column[:n] = values
+            column[self.capacity:self.capacity + n] = values
+        self._head = n % self.capacity
+        self._len = n
+        self.seq = n
+
+    def raw(self, name: str) -> np.ndarray:
+        """Copy of a column as stored (enum codes, not labels), oldest first; the inverse of load()."""
+        return np.array(self.view(name))
+
+    def _start(self, k: int) -> int:
+        return (self._head - k) % self.capacity
+
+    def view(self, name: str, k: Optional[int] = None) -> np.ndarray:
+        """Read-only zero-copy view of the newest k values (all by default), oldest first."""
+        k = self._len if k is None else min(k, self._len)
+        start = self._start(k)
+        window = self._data[name][start:start + k]
+        window.flags.writeable = False
+        return window
+
+    def ago(self, name: str, k: int = 0):
+        """Raw value k steps before the newest (k=0 is the newest)."""
+        if k >= self._len:
+            raise IndexError(f"only {self._len} rows buffered")
+        value = self._data[name][(self._head - 1 - k) % self.capacity]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def last(self, name: str):
+        value = self.ago(name, 0)
+        labels = self._labels.get(name)
+        return labels[value] if labels else value
+
+    def slice(self, since_seq: Optional[int] = None, upto_seq: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Zero-copy views of the rows with since_seq < seq <= upto_seq, oldest first, as stored (enum codes)."""
+        upto = self.seq if upto_seq is None else min(upto_seq, self.seq)
+        oldest = self.seq - self._len    # seq of the row just before the oldest kept
+        lo = oldest if since_seq is None else max(since_seq, oldest)
+        count = max(0, upto - lo)
+        end = self._head - (self.seq - upto)
+        start = (end - count) % self.capacity
+        return {name: self._data[name][start:start + count] for name in self.columns}
+
+    def rows(self, since_seq: Optional[int] = None, upto_seq: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Rows with since_seq < seq <= upto_seq, oldest first, in the JSON shape."""
+        columns = self.slice(since_seq, upto_seq)
+        cols = []
+        for name in self.columns:
+            values = columns[name].tolist()
+            labels = self._labels.get(name)
+            if labels:
+                values = [labels[v] for v in values]
+            cols.append(values)
+        names = self.columns
+        return [dict(zip(names, row)) for row in zip(*cols)]
+
+    def latest_row(self) -> Optional[Dict[str, Any]]:
+        return self.rows(since_seq=self.seq - 1)[0] if self._len else None
+
+
+def glucose_ring(capacity: int) -> ColumnRing:
+    return ColumnRing(capacity, [("ts", np.int64), ("bg", np.int32), ("trend", np.int8)],
+                      codes={"trend": TREND_LABELS})
+
+
+def basal_ring(capacity: int) -> ColumnRing:
+    return ColumnRing(capacity, [("ts", np.int64), ("rate", np.float64), ("duration", np.int32),
+                                 ("eventualBG", np.int32), ("reason", object)])
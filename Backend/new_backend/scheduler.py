@@ -0,0 +1,177 @@
+"""
+Single deadline scheduler for the periodic simulation jobs.
+
+Every job keeps an absolute next deadline that advances by exactly one
+interval per run, so the time spent doing work never accumulates into drift.
+Jobs that fall due at the same instant run in phase order (physics, then
+decision, then actuation, then publish), which makes "the decision sees the
+reading taken at the same tick" a guarantee instead of an accident of task
+start-up order.
+
+Gated jobs only run while the gate is open (at least one session running).
+While it is closed the scheduler parks on the gate instead of ticking, and
+opening it re-anchors the gated jobs to the current instant so the first
+physics tick happens straight away.
+
+A run that finishes after the job's next deadline is an overrun: the missed
+periods are counted and skipped rather than replayed back to back.
+
+A job body that raises is logged and counted as an error run; the job keeps
+its schedule and every other job keeps running, since all sessions share
+this one task.
+"""
+import asyncio
+import math
+import traceback
+from typing import Callable, List, Optional
+
+from clock import Clock, REAL_CLOCK
+from eventlog import log
+from metrics import LOOP_INTERVAL, LOOP_JITTER, LOOP_TICK_DURATION, SCHEDULER_ERRORS, SCHEDULER_OVERRUNS
+from tracing import SCHEDULER_TRACK, now_ns, tracer
+
+# --- CONFIGURATION ---
+PHASE_PHYSICS = 0
+PHASE_DECISION = 1
+PHASE_ACTUATION = 2
+PHASE_PUBLISH = 3
+
+# Deadlines closer than this are treated as the same tick
+DUE_TOLERANCE_SEC = 0.001
+
+
+class Job:
+    def __init__(self, name: str, interval: float, phase: int, body: Callable[[], None],
+                 gated: bool, order: int):
+        self.name = name
+        self.interval = interval
+        self.phase = phase
+        self.body = body
+        self.gated = gated
+        self.order = order
+        self.deadline: Optional[float] = None
+        self.last_run: Optional[float] = None
+        self.runs = 0
+        self.overruns = 0
+        self.errors = 0
+        self._observe_interval = LOOP_INTERVAL.labels(loop=name).observe
+        self._observe_jitter = LOOP_JITTER.labels(loop=name).observe
+        self._observe_duration = LOOP_TICK_DURATION.labels(loop=name).observe
+        self._count_overrun = SCHEDULER_OVERRUNS.labels(job=name).inc
+        self._count_error = SCHEDULER_ERRORS.labels(job=name).inc
+
+    def stats(self) -> dict:
+        return {"name": self.name, "interval": self.interval, "phase": self.phase,
+                "runs": self.runs, "overruns": self.overruns, "errors": self.errors}
+
+
+class Scheduler:
+    def __init__(self, clock: Clock = REAL_CLOCK):
+        self.clock = clock
+        self.jobs: List[Job] = []
+        self.gate_open = False
+        # Deadline the running jobs were due at; work started by a job is timed from it
+        self.tick_time: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        # Created in start() so the scheduler can be restarted on another event loop
+        self._wake: Optional[asyncio.Event] = None
+
+    def add(self, name: str, interval: float, phase: int, body: Callable[[], None],
+            gated: bool = True) -> Job:
+        job = Job(name, interval, phase, body, gated, len(self.jobs))
+        job.deadline = self.clock.time()
+        self.jobs.append(job)
+        return job
+
+    def remove(self, job: Job) -> None:
+        self.jobs.remove(job)
+
+    def set_gate(self, is_open: bool) -> None:
+        if is_open == self.gate_open:
+            return
+        self.gate_open = is_open
+        if is_open:
+            now = self.clock.time()
+            for job in self.jobs:
+                if job.gated:
+                    job.deadline, job.last_run = now, None
+            if self._wake:
+                self._wake.set()
+
+    def _active(self) -> List[Job]:
+        return [job for job in self.jobs if self.gate_open or not job.gated]
+
+    def _run_due(self, now: float) -> None:
+        due = [job for job in self._active() if job.deadline <= now + DUE_TOLERANCE_SEC]
+        due.sort(key=lambda job: (job.phase, job.order))
+        self.tick_time = min(job.deadline for job in due)
+        for job in due:
+            if job.last_run is not None:
+                job._observe_interval(now - job.last_run)
+                job._observe_jitter(abs(now - job.last_run - job.interval))
+            job.last_run = now
+            started = now_ns()
+            try:
+                job.body()
+            except Exception as e:
+                job.errors += 1
+                job._count_error()
+                log.event("scheduler.job_error", job=job.name, error=repr(e),
+                          where=traceback.extract_tb(e.__traceback__)[-1].name)
+            job._observe_duration((now_ns() - started) / 1e9)
+            tracer.span(job.name, SCHEDULER_TRACK, started, late_ms=round((now - job.deadline) * 1000, 3))
+            job.runs += 1
+
+        # Advance by whole intervals from the deadline, not from "now", so lateness doesn't drift
+        finished = self.clock.time()
+        for job in due:
+            job.deadline += job.interval
+            if job.deadline <= finished:
+                missed = math.floor((finished - job.deadline) / job.interval) + 1
+                job.deadline += missed * job.interval
+                job.overruns += missed
+                job._count_overrun(missed)
+                tracer.instant("overrun", SCHEDULER_TRACK, job=job.name, missed=missed)
+
+    async def _park(self, deadline: Optional[float]) -> None:
+        # Sleep until the next deadline, or until the gate opens
+        self._wake.clear()
+        if deadline is None:
+            await self._wake.wait()
+            return
+        sleeper = asyncio.ensure_future(self.clock.sleep_until(deadline))
+        waker = asyncio.ensure_future(self._wake.wait())
+        try:
+            await asyncio.wait({sleeper, waker}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sleeper.cancel()
+            waker.cancel()
+
+    async def run(self) -> None:
+        now = self.clock.time()
+        for job in self.jobs:
+            job.deadline = now
+        while True:
+            active = self._active()
+            now = self.clock.time()
+            if active and min(job.deadline for job in active) <= now + DUE_TOLERANCE_SEC:
+                self._run_due(now)
+                continue
+            deadline = min(job.deadline for job in active) if active else None
+            if self.gate_open:
+                # Nothing can wake us early while the gate is open
+                await self.clock.sleep_until(deadline)
+            else:
+                await self._park(deadline)
+
+    def start(self) -> None:
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> List[dict]:
+        return [job.stats() for job in self.jobs]
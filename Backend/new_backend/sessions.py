@@ -0,0 +1,173 @@
+import asyncio
+import os
+import re
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from state import PatientState, PatientParams
+from clock import Clock, REAL_CLOCK
+from broadcast import GlucoseBroadcaster, BROADCAST_INTERVAL_SEC
+from tsstore import HistoryStore, HISTORY_DIR
+from downsample import ChartRollups
+from checkpoint import Checkpointer, CHECKPOINT_INTERVAL_SEC, checkpoint_path, restore
+from metrics import SESSIONS
+from eventlog import log
+from scheduler import Scheduler, PHASE_PHYSICS, PHASE_ACTUATION, PHASE_PUBLISH
+from events import EventBus, Event, GLUCOSE_READING, DELIVERY_COMPLETE, COOLER_CHANGED
+import glucose_simulator
+import fake_oref1
+import cooler_control
+import motor_control
+
+# --- CONFIGURATION ---
+DEFAULT_SESSION_ID = "default"
+MAX_SESSIONS = 5000
+TEMPERATURE_INTERVAL_SEC = 1.0
+
+# Session ids end up in URLs and on-disk paths
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class SessionManager:
+    """
+    Registry of virtual patients plus the scheduler jobs that drive them.
+    Each job walks every running session once per period, so adding a patient
+    costs one more loop iteration rather than more tasks. The simulation jobs
+    only run while at least one session is running; starting or stopping a
+    session flips that gate directly instead of the loops polling for it.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, clock: Clock = REAL_CLOCK,
+                 history_dir: str = HISTORY_DIR):
+        self.max_sessions = max_sessions
+        self.history_dir = history_dir
+        # Shared with every session so a VirtualClock drives the whole simulation
+        self.clock = clock
+        self.sessions: Dict[str, PatientState] = {}
+        # Per-patient ticks that raised (logged and skipped, see _tick_one)
+        self.tick_errors = 0
+        self.broadcasters: Dict[str, GlucoseBroadcaster] = {}
+        self.scheduler = Scheduler(clock)
+        self.checkpointer = Checkpointer(self.sessions)
+        self._add_jobs()
+        # Decide on each reading as it lands, then push it (and the decision) to clients
+        self.bus = EventBus()
+        self.bus.subscribe(GLUCOSE_READING, fake_oref1.on_glucose_reading)
+        for topic in (GLUCOSE_READING, DELIVERY_COMPLETE, COOLER_CHANGED):
+            self.bus.subscribe(topic, self._push)
+
+    def create(self, session_id: Optional[str] = None, seed: Optional[int] = None,
+               hardware: bool = False, verbose: bool = False, persist: bool = False,
+               params: Optional[PatientParams] = None) -> PatientState:
+        if session_id is None:
+            session_id = uuid.uuid4().hex[:12]
+        if not _SESSION_ID_RE.match(session_id):
+            raise ValueError(f"Invalid session id '{session_id}'")
+        if session_id in self.sessions:
+            raise ValueError(f"Session '{session_id}' already exists")
+        if len(self.sessions) >= self.max_sessions:
+            raise ValueError(f"Session limit reached ({self.max_sessions})")
+
+        patient = PatientState(session_id, seed=seed, hardware=hardware, verbose=verbose, clock=self.clock,
+                               events=self.bus, params=params)
+        patient.on_running_changed = self._update_gate
+        if persist:
+            patient.recorder = HistoryStore(os.path.join(self.history_dir, session_id))
+            # Warm start from the last checkpoint; seeding below only fills an empty history
+            restore(patient, checkpoint_path(patient))
+            # Chart rollups pick up where the persisted history left off
+            patient.charts = ChartRollups()
+            patient.charts.backfill(patient.recorder)
+        glucose_simulator.seed_glucose_history(patient)
+        self.sessions[session_id] = patient
+        self.broadcasters[session_id] = GlucoseBroadcaster(patient)
+        SESSIONS.set(len(self.sessions))
+        return patient
+
+    def get(self, session_id: str) -> PatientState:
+        """Raises KeyError for unknown sessions."""
+        return self.sessions[session_id]
+
+    def remove(self, session_id: str) -> PatientState:
+        """Unregister a session; await close_actuators([patient]) to stop its hardware sequences."""
+        patient = self.sessions.pop(session_id)
+        if patient.recorder:
+            patient.recorder.flush()
+        self.broadcasters.pop(session_id, None)
+        SESSIONS.set(len(self.sessions))
+        self._update_gate()
+        return patient
+
+    async def close_actuators(self, patients: Optional[List[PatientState]] = None) -> None:
+        """Cancel queued and running actuator commands (no dose is recorded) and wait for the relays to switch off."""
+        patients = list(self.sessions.values()) if patients is None else patients
+        await asyncio.gather(*(queue.close() for p in patients for queue in (p.motor_queue, p.cooler_queue)))
+
+    def _running(self) -> List[PatientState]:
+        return [p for p in self.sessions.values() if p.system_running]
+
+    def _update_gate(self, patient: Optional[PatientState] = None) -> None:
+        self.scheduler.set_gate(any(p.system_running for p in self.sessions.values()))
+
+    def _every(self, tick: Callable[[PatientState], None]) -> Callable[[], None]:
+        def body():
+            for patient in self._running():
+                self._tick_one(tick, patient)
+        return body
+
+    def _actuate(self) -> None:
+        for patient in self._running():
+            self._tick_one(motor_control.actuation_tick, patient, self.scheduler.tick_time)
+
+    def _tick_one(self, tick: Callable[..., None], patient: PatientState, *args) -> None:
+        # One patient's failure (a full disk under its recorder, say) must not skip the rest of the tick
+        try:
+            tick(patient, *args)
+        except Exception as e:
+            self.tick_errors += 1
+            log.event("session.tick_error", session=patient.session_id, tick=tick.__name__, error=repr(e))
+
+    def _push(self, event: Event) -> None:
+        hub = self.broadcasters.get(event.patient.session_id)
+        if hub is not None and hub.subscribers:
+            hub.tick()
+
+    def _broadcast(self) -> None:
+        # Idle hubs are skipped; a client joining later still gets a consistent snapshot
+        for hub in list(self.broadcasters.values()):
+            if hub.subscribers:
+                hub.tick()
+
+    def _add_jobs(self) -> None:
+        # oref1 isn't a job: it decides inside the physics phase, on each reading's
+        # GLUCOSE_READING event, and actuation follows on the same tick
+        add = self.scheduler.add
+        add("glucose", glucose_simulator.INTERVAL_SECONDS, PHASE_PHYSICS, self._every(glucose_simulator.glucose_tick))
+        add("temperature", TEMPERATURE_INTERVAL_SEC, PHASE_PHYSICS, self._every(cooler_control.temperature_tick))
+        add("actuation", glucose_simulator.INTERVAL_SECONDS, PHASE_ACTUATION, self._actuate)
+        # Spikes and the cooler change state while stopped, so publishing isn't gated
+        add("broadcast", BROADCAST_INTERVAL_SEC, PHASE_PUBLISH, self._broadcast, gated=False)
+        add("checkpoint", CHECKPOINT_INTERVAL_SEC, PHASE_PUBLISH, self.checkpointer.tick, gated=False)
+
+    def start(self) -> None:
+        self._update_gate()
+        self.scheduler.start()
+        # A cooler that was running at the last checkpoint finishes its cycle, and
+        # pulses decided before it are delivered
+        for patient in self.sessions.values():
+            if patient.cooler_seconds_left > 0 and patient.cooler_state == "OFF":
+                cooler_control.request_cooler(patient, patient.cooler_seconds_left, source="checkpoint")
+            for i in range(patient.pulses_owed):
+                motor_control.request_pulse(patient, source="checkpoint", key=f"checkpoint-{i}")
+            patient.pulses_owed = 0
+        print(f"✅ Session scheduler started ({len(self.scheduler.jobs)} jobs).")
+
+    def stop(self) -> None:
+        self.scheduler.stop()
+        for patient in self.sessions.values():
+            if patient.recorder:
+                patient.recorder.flush()
+        self.checkpointer.flush()
+
+
+manager = SessionManager()
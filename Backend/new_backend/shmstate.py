@@ -0,0 +1,234 @@
+"""
+Single-writer / multi-reader state sharing for `app.py --workers N`.
+
+The writer process owns the simulation and publishes the demo patient's
+encoded /state snapshot into one shared-memory segment. Reader workers map
+the same segment and serve /state and /ws/glucose straight from it: a read
+is a memcpy, with no request to the writer.
+
+Segment layout (little endian), guarded by a seqlock:
+
+    0   magic       4s   b"GDSM"
+    4   layout      u32  LAYOUT_VERSION
+    8   seq         u64  odd while a write is in progress
+    16  version     u64  PatientState.version of the payload
+    24  length      u32  payload bytes
+    28  etag        32s  ETag of the payload, NUL padded
+    60  payload     ...  snapshot JSON
+
+The writer bumps seq to odd, writes the payload and header fields, then
+bumps seq to even. A reader copies the payload between two reads of seq and
+retries if they differ or are odd. This relies on stores becoming visible
+in program order, which holds on x86; the payload is JSON, so a torn read
+that slipped through on a weaker memory model would fail to parse rather
+than be served.
+"""
+import asyncio
+import json
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+from eventlog import log
+from ringbuffer import glucose_ring, basal_ring
+import state
+import wire
+
+# --- CONFIGURATION ---
+SEGMENT_NAME = os.environ.get("GLUCODOSE_SHM", "glucodose_state")
+SEGMENT_SIZE = 4 * 1024 * 1024
+LAYOUT_VERSION = 1
+READ_RETRIES = 1000
+READER_POLL_INTERVAL_SEC = 0.05   # how often a reader worker checks seq
+ATTACH_TIMEOUT_SEC = 30.0
+
+_MAGIC = b"GDSM"
+_HEADER = struct.Struct("<4sIQQI32s")
+_SEQ = struct.Struct("<Q")
+_SEQ_OFFSET = 8
+
+
+class SharedStateWriter:
+    """Owns the segment; publish() is only ever called from the writer's event loop."""
+
+    def __init__(self, name: str = SEGMENT_NAME, size: int = SEGMENT_SIZE):
+        try:
+            # A writer that crashed leaves its segment behind; start from a clean one
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.capacity = size - _HEADER.size
+        self._seq = 0
+        self.version: Optional[int] = None
+        _HEADER.pack_into(self.shm.buf, 0, _MAGIC, LAYOUT_VERSION, 0, 0, 0, b"")
+
+    def publish(self, version: int, etag: str, payload: bytes) -> None:
+        if len(payload) > self.capacity:
+            raise ValueError(f"Snapshot of {len(payload)} bytes exceeds the {self.capacity} byte segment")
+        buf = self.shm.buf
+        self._seq += 1
+        _SEQ.pack_into(buf, _SEQ_OFFSET, self._seq)
+        buf[_HEADER.size:_HEADER.size + len(payload)] = payload
+        _HEADER.pack_into(buf, 0, _MAGIC, LAYOUT_VERSION, self._seq, version, len(payload), etag.encode())
+        self._seq += 1
+        _SEQ.pack_into(buf, _SEQ_OFFSET, self._seq)
+        self.version = version
+
+    def publish_patient(self, patient) -> None:
+        """Publish if the patient moved since the last call (a scheduler job)."""
+        if patient.version != self.version:
+            self.publish(patient.version, patient.etag(), patient.snapshot_json())
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedStateReader:
+    def __init__(self, name: str = SEGMENT_NAME):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Readers must not unlink the writer's segment when they exit
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+        magic, layout = _HEADER.unpack_from(self.shm.buf, 0)[:2]
+        if magic != _MAGIC or layout != LAYOUT_VERSION:
+            raise RuntimeError(f"Segment '{name}' is not a layout {LAYOUT_VERSION} GlucoDose state segment")
+        self._last_seq: Optional[int] = None
+
+    def seq(self) -> int:
+        return _SEQ.unpack_from(self.shm.buf, _SEQ_OFFSET)[0]
+
+    def read(self) -> Optional[Tuple[int, str, bytes]]:
+        """(version, etag, payload) if a new complete snapshot was published since the last read."""
+        buf = self.shm.buf
+        for _ in range(READ_RETRIES):
+            before = self.seq()
+            if before == self._last_seq:
+                return None
+            if before & 1:
+                continue
+            _, _, _, version, length, etag = _HEADER.unpack_from(buf, 0)
+            payload = bytes(buf[_HEADER.size:_HEADER.size + length])
+            if self.seq() == before:
+                self._last_seq = before
+                if before == 0:
+                    return None   # nothing published yet
+                return version, etag.rstrip(b"\0").decode(), payload
+        raise RuntimeError("Shared state writer kept the seqlock busy; gave up reading")
+
+    def close(self) -> None:
+        self.shm.close()
+
+    @classmethod
+    async def attach(cls, name: str = SEGMENT_NAME, timeout: float = ATTACH_TIMEOUT_SEC) -> "SharedStateReader":
+        """Wait for the writer to create the segment (workers can start first)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return cls(name)
+            except FileNotFoundError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+class MirroredPatient:
+    """
+    Read-only stand-in for the writer's PatientState inside a reader worker.
+    Serves the shared snapshot bytes as-is, and rebuilds the two history rings
+    so a local GlucoseBroadcaster can keep streaming deltas.
+    """
+
+    def __init__(self):
+        # False until the first snapshot arrives; there is nothing to serve before that
+        self.ready = False
+        self.version = 0
+        self._etag = '"mirror-0"'
+        self._body = b""
+        self._fields: Dict[str, Any] = {}
+        self._binary_version = -1
+        self._binary_body = b""
+        self.glucose_history = glucose_ring(state.MAX_HISTORY)
+        self.basal_history = basal_ring(state.MAX_BASAL_HISTORY)
+        self._version_waiters: List[asyncio.Future] = []
+
+    def apply(self, version: int, etag: str, payload: bytes) -> None:
+        snapshot = json.loads(payload)
+        self._extend(self.glucose_history, snapshot.pop("glucoseHistory", []))
+        self._extend(self.basal_history, snapshot.pop("basalHistory", []))
+        self._fields = snapshot
+        self._body, self._etag, self.version = payload, etag, version
+        self.ready = True
+        waiters, self._version_waiters = self._version_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(version)
+
+    @staticmethod
+    def _extend(ring, rows: List[Dict[str, Any]]) -> None:
+        newest = ring.last("ts") if ring else None
+        for row in rows:
+            if newest is None or row["ts"] > newest:
+                ring.append(**row)
+
+    def etag(self) -> str:
+        return self._etag
+
+    def snapshot_json(self) -> bytes:
+        return self._body
+
+    def snapshot_binary(self) -> bytes:
+        if self._binary_version != self.version:
+            self._binary_body = wire.encode_state(self._fields, self.glucose_history, self.basal_history)
+            self._binary_version = self.version
+        return self._binary_body
+
+    def get_state_snapshot(self, include_history: bool = True) -> Dict[str, Any]:
+        snapshot = dict(self._fields)
+        if include_history:
+            snapshot["glucoseHistory"] = self.glucose_history.rows()
+            snapshot["basalHistory"] = self.basal_history.rows()
+        return snapshot
+
+    async def wait_for_version(self, after: int, timeout: float) -> bool:
+        if self.version > after:
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._version_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if waiter in self._version_waiters:
+                self._version_waiters.remove(waiter)
+
+
+async def follow(reader: SharedStateReader, mirror: MirroredPatient, on_change=None,
+                 interval: float = READER_POLL_INTERVAL_SEC) -> None:
+    """
+    Reader worker task: poll seq and apply every new snapshot to the mirror.
+    A failed read (busy seqlock, torn payload) is logged and retried on the
+    next poll; the mirror keeps serving the last good snapshot meanwhile.
+    """
+    failing = False
+    while True:
+        try:
+            published = reader.read()
+            if published is not None:
+                mirror.apply(*published)
+                if on_change:
+                    on_change()
+            failing = False
+        except Exception as e:
+            # Forget the seq so the next poll reads the same snapshot again; log once per streak
+            reader._last_seq = None
+            if not failing:
+                log.event("shm.read_error", error=repr(e), serving_version=mirror.version)
+            failing = True
+        await asyncio.sleep(interval)
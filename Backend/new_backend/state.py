@@ -1,69 +1,238 @@
-from collections import deque
-from typing import Deque, Dict, Any, Optional
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Any, List, Optional
+import asyncio
+import json
+import random
 import time
+import uuid
 
-MAX_HISTORY = 180          
+from actuators import (ActuatorQueue, COOLER_MAX_DEPTH, COOLER_MAX_WAIT_SEC, COOLER_TIMEOUT_SEC, MOTOR_MAX_DEPTH,
+                       MOTOR_MAX_WAIT_SEC, MOTOR_TIMEOUT_SEC)
+from clock import Clock, REAL_CLOCK
+from events import EventBus
+from insulin_model import InsulinModel, get_curve
+from metrics import SNAPSHOT_BUILD
+from ringbuffer import ColumnRing, glucose_ring, basal_ring
+import forecast
+import wire
+
+MAX_HISTORY = 180
+MAX_BASAL_HISTORY = 120
 START_BG = 254.0   # CHANGED: Start High for Demo
 
-BASE_BASAL = 1.0           
-TARGET_MIN_BG = 90        
-TARGET_MAX_BG = 120    
+BASE_BASAL = 1.0
+TARGET_MIN_BG = 90
+TARGET_MAX_BG = 120
 
 # Increased ISF to match strong physics
 ISF = 200.0
 
-# STATUS FLAGS
-system_running: bool = False
-simulation_spike: bool = False
-spike_countdown: int = 0
-
-# COOLER & TEMP STATE
-cooler_state: str = "OFF"
-insulin_temperature: float = 30.0 # Default starting temp
-
-glucose_history: Deque[Dict[str, Any]] = deque(maxlen=MAX_HISTORY)
-last_bg: float = START_BG
-basal_history: Deque[Dict[str, Any]] = deque(maxlen=120)
-
-current_iob: float = 0.0             
-last_delivery_time: float = 0.0      
-motor_state: str = "OFF"             
-suggested_rate: float = BASE_BASAL   
-
-# MECHANICAL STATS
-last_plunger_mm: float = 0.0
-last_motor_rotations: float = 0.0
-last_encoder_pulses: int = 0
-last_bolus_amount: float = 0.0
-
-def get_state_snapshot() -> Dict[str, Any]:
-    history = list(glucose_history)
-    basal_hist = list(basal_history)
-    current_glucose = history[-1] if history else None
-    latest_basal = basal_hist[-1] if basal_hist else None
-    
-    return {
-        "timestamp": int(time.time() * 1000),
-        "isRunning": system_running,
-        "currentBG": current_glucose["bg"] if current_glucose else None,
-        "currentTrend": current_glucose["trend"] if current_glucose else None,
-        "currentIOB": round(current_iob, 2),
-        "motorState": motor_state,
-        "coolerState": cooler_state,       # New
-        "insulinTemp": round(insulin_temperature, 1), # New
-        "glucoseHistory": history,
-        "basalHistory": basal_hist,
-        "latestRecommendation": latest_basal,
-        "pumpStats": {
-            "plunger_mm": round(last_plunger_mm, 5),
-            "rotations": round(last_motor_rotations, 5),
-            "pulses": last_encoder_pulses,
-            "last_dose": last_bolus_amount
-        },
-        "profile": {
-            "base_basal": BASE_BASAL,
-            "min_bg": TARGET_MIN_BG,
-            "max_bg": TARGET_MAX_BG,
-            "isf": ISF 
-        },
-    }
\ No newline at end of file
+# Controller / physics tuning defaults; a patient reads them from its PatientParams
+MAX_ALLOWED_IOB = 0.40
+TREND_SMOOTHING = 0.3       # weight of the newest raw trend in the EMA
+INSULIN_SENSITIVITY = 210.0  # mg/dL drop per unit absorbed (simulator scale)
+
+# Start at a realistic ambient temp
+AMBIENT_TEMP = 26.9
+
+@dataclass(frozen=True)
+class PatientParams:
+    """
+    Tunable constants for one patient. Each PatientState holds its own copy, so
+    a sweep can run differently-tuned patients side by side in one process
+    without touching module globals. None for the insulin curve means the
+    insulin_model defaults.
+    """
+    isf: float = ISF
+    target_min_bg: float = TARGET_MIN_BG
+    target_max_bg: float = TARGET_MAX_BG
+    base_basal: float = BASE_BASAL
+    max_allowed_iob: float = MAX_ALLOWED_IOB
+    trend_smoothing: float = TREND_SMOOTHING
+    insulin_sensitivity: float = INSULIN_SENSITIVITY
+    insulin_dia_minutes: Optional[float] = None
+    insulin_peak_minutes: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class PatientState:
+    """
+    All mutable simulation state for one virtual patient (one session).
+    The simulator, oref1 and actuator modules take one of these instead of
+    mutating module globals, so a process can host many patients.
+    """
+
+    def __init__(self, session_id: str, seed: Optional[int] = None,
+                 hardware: bool = False, verbose: bool = False, clock: Clock = REAL_CLOCK,
+                 events: Optional[EventBus] = None, params: Optional[PatientParams] = None):
+        self.session_id = session_id
+        self.clock = clock
+        self.params = params or PatientParams()
+        # Readings, deliveries and cooler changes are published here; the
+        # SessionManager shares one bus across its patients
+        self.events = events or EventBus()
+        # Only the demo patient drives the real relay board
+        self.hardware = hardware
+        self.verbose = verbose
+        # Physics stream, the one batch_engine reproduces; temperature creep and the
+        # motor's display numbers draw from their own so they can't shift BG
+        self.rng = random.Random(seed)
+        self.device_rng = random.Random(None if seed is None else f"device:{seed}")
+
+        # STATUS FLAGS
+        self._system_running: bool = False
+        # Set by the SessionManager so /start and /stop wake or park the scheduler
+        self.on_running_changed: Optional[Callable[["PatientState"], None]] = None
+        # oref1's raw trend (mg/dL/min); None is the simulator's, tuned to its 5 s tick
+        self.raw_trend: Optional[Callable[["PatientState"], float]] = None
+        self.simulation_spike: bool = False
+        self.spike_countdown: int = 0
+
+        # COOLER & TEMP STATE
+        self.cooler_state: str = "OFF"
+        self.cooler_seconds_left: int = 0
+        self.insulin_temperature: float = AMBIENT_TEMP
+
+        self.glucose_history: ColumnRing = glucose_ring(MAX_HISTORY)
+        self.last_bg: float = START_BG
+        self.basal_history: ColumnRing = basal_ring(MAX_BASAL_HISTORY)
+
+        # Dose ledger + activity curve; current_iob is read from it
+        self.insulin = InsulinModel(get_curve(self.params.insulin_dia_minutes, self.params.insulin_peak_minutes))
+        self.last_delivery_time: float = 0.0
+        self.motor_state: str = "OFF"
+        self.pending_delivery: bool = False     # DELIVER decided, motor not started yet
+        self.pulses_owed: int = 0               # restored from a checkpoint, re-queued on start
+
+        # One command at a time per actuator; motor_control / cooler_control submit to these
+        self.motor_queue = ActuatorQueue("motor", session_id, clock, MOTOR_MAX_DEPTH, MOTOR_MAX_WAIT_SEC,
+                                         MOTOR_TIMEOUT_SEC)
+        self.cooler_queue = ActuatorQueue("cooler", session_id, clock, COOLER_MAX_DEPTH, COOLER_MAX_WAIT_SEC,
+                                          COOLER_TIMEOUT_SEC, coalesce_running=True)
+        self.suggested_rate: float = self.params.base_basal
+
+        # MECHANICAL STATS
+        self.last_plunger_mm: float = 0.0
+        self.last_motor_rotations: float = 0.0
+        self.last_encoder_pulses: int = 0
+        self.last_bolus_amount: float = 0.0
+
+        # PHYSICS / CONTROLLER ACCUMULATORS
+        self.trend_drift: float = 0.4
+        self.smoothed_trend: float = 0.0
+        self.last_decision_time: float = float("-inf")
+
+        # tsstore.HistoryStore when the session's history is persisted to disk,
+        # and downsample.ChartRollups for its long-window chart queries
+        self.recorder = None
+        self.charts = None
+        # The forecast.py curves for the current reading, shared by the snapshot and oref1
+        self.forecast_cache = forecast.ForecastCache()
+
+        # VERSIONING: writers call touch() after every visible change
+        self.version: int = 0
+        self._instance = uuid.uuid4().hex[:8]   # keeps ETags unique across restarts
+        self._version_waiters: List[asyncio.Future] = []
+        self._snapshot_version: int = -1
+        self._snapshot_body: bytes = b""
+        self._binary_version: int = -1
+        self._binary_body: bytes = b""
+
+    @property
+    def current_iob(self) -> float:
+        return self.insulin.iob
+
+    @property
+    def system_running(self) -> bool:
+        return self._system_running
+
+    @system_running.setter
+    def system_running(self, running: bool) -> None:
+        if running != self._system_running:
+            self._system_running = running
+            if self.on_running_changed:
+                self.on_running_changed(self)
+
+    def now_ms(self) -> int:
+        return int(self.clock.time() * 1000)
+
+    def touch(self) -> None:
+        """Bump the state version and wake long-pollers."""
+        self.version += 1
+        waiters, self._version_waiters = self._version_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(self.version)
+
+    async def wait_for_version(self, after: int, timeout: float) -> bool:
+        """Wait (wall-clock) until version > after. Returns False on timeout."""
+        if self.version > after:
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._version_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if waiter in self._version_waiters:
+                self._version_waiters.remove(waiter)
+
+    def etag(self) -> str:
+        return f'"{self._instance}-{self.version}"'
+
+    def snapshot_json(self) -> bytes:
+        """Serialized full snapshot, rebuilt only when the version has moved."""
+        if self._snapshot_version != self.version:
+            started = time.perf_counter()
+            self._snapshot_body = json.dumps(self.get_state_snapshot(), separators=(",", ":")).encode()
+            self._snapshot_version = self.version
+            SNAPSHOT_BUILD.observe(time.perf_counter() - started)
+        return self._snapshot_body
+
+    def snapshot_binary(self) -> bytes:
+        """The same snapshot in the wire.py binary format, also rebuilt only per version."""
+        if self._binary_version != self.version:
+            self._binary_body = wire.encode_state(self.get_state_snapshot(include_history=False),
+                                                  self.glucose_history, self.basal_history)
+            self._binary_version = self.version
+        return self._binary_body
+
+    def get_state_snapshot(self, include_history: bool = True) -> Dict[str, Any]:
+        # The broadcaster streams the histories as deltas, so it can skip the copy
+        history = self.glucose_history
+        has_glucose = bool(history)
+
+        snapshot = {
+            "sessionId": self.session_id,
+            "version": self.version,
+            "timestamp": self.now_ms(),
+            "isRunning": self.system_running,
+            "currentBG": history.last("bg") if has_glucose else None,
+            "currentTrend": history.last("trend") if has_glucose else None,
+            "currentIOB": round(self.current_iob, 2),
+            "motorState": self.motor_state,
+            "coolerState": self.cooler_state,
+            "insulinTemp": round(self.insulin_temperature, 1),
+            "latestRecommendation": self.basal_history.latest_row(),
+            "forecast": forecast.predict(self) if has_glucose else None,
+            "pumpStats": {
+                "plunger_mm": round(self.last_plunger_mm, 5),
+                "rotations": round(self.last_motor_rotations, 5),
+                "pulses": self.last_encoder_pulses,
+                "last_dose": self.last_bolus_amount
+            },
+            "profile": {
+                "base_basal": self.params.base_basal,
+                "min_bg": self.params.target_min_bg,
+                "max_bg": self.params.target_max_bg,
+                "isf": self.params.isf
+            },
+        }
+        if include_history:
+            snapshot["glucoseHistory"] = history.rows()
+            snapshot["basalHistory"] = self.basal_history.rows()
+        return snapshot
@@ -0,0 +1,296 @@
+"""
+Parameter sweep: run the headless simulator + oref1 logic for every
+combination in a grid or random-search spec, across all cores, and rank
+the results.
+
+    python sweep.py --param isf=150,200,250 --param max_allowed_iob=0.3,0.4 --hours 24
+    python sweep.py spec.json --out sweeps/isf --workers 8
+
+A spec file looks like:
+
+    {"mode": "random", "samples": 40, "seed": 7, "hours": 24, "patients": 2,
+     "params": {"isf": {"min": 100, "max": 300}, "target_max_bg": [110, 120, 140]}}
+
+In grid mode every param is a list of values. In random mode a list is
+sampled uniformly and {"min", "max"} is a uniform range. Param names are
+PatientParams fields. Every run gets its own SessionManager and its
+patients carry their own PatientParams, so nothing set for one combination
+leaks into the next one handled by the same worker process. All runs use
+the same seeds, so combinations are compared on the same noise.
+
+Values are coerced to numbers and range checked (PARAM_RANGES) before any
+run starts. A run whose controller or physics raised at runtime, or that
+failed outright, is recorded with an `error` field and left out of the
+ranking instead of being scored on whatever it did before breaking.
+
+Each finished run is appended to <out>.ndjson as soon as it completes.
+Rerunning the same command skips the combinations already in that file.
+The ranked table goes to <out>.csv: best time in range first, then fewest
+hypo events, then least insulin.
+"""
+import argparse
+import asyncio
+import csv
+import dataclasses
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import simulate
+from clock import VirtualClock
+from events import Event, GLUCOSE_READING
+from insulin_model import get_curve
+from sessions import SessionManager
+from state import PatientParams
+
+# --- CONFIGURATION ---
+DEFAULT_HOURS = 24.0
+DEFAULT_PATIENTS = 2
+DEFAULT_SEED = 7
+# The physics clamps BG at 80 mg/dL, so touching the floor is the hypo signal
+HYPO_BG_MG_DL = 80
+TABLE_ROWS = 10
+
+PARAM_NAMES = tuple(field.name for field in dataclasses.fields(PatientParams))
+# Inclusive bounds a swept value must fall in
+PARAM_RANGES = {
+    "isf": (1.0, 1000.0),
+    "target_min_bg": (40.0, 400.0),
+    "target_max_bg": (40.0, 400.0),
+    "base_basal": (0.0, 10.0),
+    "max_allowed_iob": (0.0, 10.0),
+    "trend_smoothing": (0.0, 1.0),
+    "insulin_sensitivity": (1.0, 1000.0),
+    "insulin_dia_minutes": (1.0, 1440.0),
+    "insulin_peak_minutes": (0.1, 720.0),
+}
+
+
+class RunStats:
+    """Whole-run glucose outcomes, collected from GLUCOSE_READING events."""
+
+    def __init__(self):
+        self.readings = 0
+        self.in_range = 0
+        self.bg_sum = 0
+        self.hypo_events = 0
+        self._hypo: Dict[str, bool] = {}
+
+    def on_reading(self, event: Event) -> None:
+        patient, bg = event.patient, event.data["bg"]
+        self.readings += 1
+        self.bg_sum += bg
+        if patient.params.target_min_bg <= bg <= patient.params.target_max_bg:
+            self.in_range += 1
+        low = bg <= HYPO_BG_MG_DL
+        if low and not self._hypo.get(patient.session_id):
+            self.hypo_events += 1
+        self._hypo[patient.session_id] = low
+
+
+async def _simulate(params: PatientParams, seconds: float, patients: int, seed: int) -> Dict[str, Any]:
+    clock = VirtualClock(start=simulate.VIRTUAL_EPOCH)
+    manager = SessionManager(clock=clock)
+    stats = RunStats()
+    manager.bus.subscribe(GLUCOSE_READING, stats.on_reading)
+    for i in range(patients):
+        manager.create(f"sweep-{i}", seed=seed + i, params=params).system_running = True
+    manager.start()
+    try:
+        await clock.run_for(seconds)
+    finally:
+        manager.stop()
+    insulin = sum(p.insulin.total_units for p in manager.sessions.values())
+    # The bus and the scheduler log and skip failures so a live server keeps going;
+    # here any of them means the run didn't exercise these params properly
+    errors = manager.bus.errors + manager.tick_errors + sum(job["errors"] for job in manager.scheduler.stats())
+    return {
+        **({"error": f"{errors} handler/tick errors during the run"} if errors else {}),
+        "timeInRangePct": round(100.0 * stats.in_range / max(1, stats.readings), 2),
+        "hypoEvents": stats.hypo_events,
+        "insulinUnits": round(insulin / patients, 3),
+        "meanBG": round(stats.bg_sum / max(1, stats.readings), 1),
+    }
+
+
+def run_one(overrides: Dict[str, Any], hours: float, patients: int, seed: int) -> Dict[str, Any]:
+    """One combination, in a worker process. Returns the checkpoint row."""
+    started = time.perf_counter()
+    params = PatientParams(**overrides)
+    outcome = asyncio.run(_simulate(params, hours * 3600, patients, seed))
+    return {"key": run_key(overrides, hours, patients, seed), "params": overrides, **outcome,
+            "seconds": round(time.perf_counter() - started, 2)}
+
+
+def run_key(overrides: Dict[str, Any], hours: float, patients: int, seed: int) -> str:
+    return json.dumps({"params": overrides, "hours": hours, "patients": patients, "seed": seed}, sort_keys=True)
+
+
+def _coerce(name: str, value: Any) -> float:
+    """A swept value as a float within PARAM_RANGES[name]; ValueError otherwise."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Param '{name}' must be a number, got {value!r}")
+    low, high = PARAM_RANGES[name]
+    if not low <= value <= high:
+        raise ValueError(f"Param '{name}' = {value} is outside [{low:g}, {high:g}]")
+    return float(value)
+
+
+def _check(combo: Dict[str, Any]) -> Dict[str, Any]:
+    """Coerce one combination and reject the ones PatientParams or the insulin curve would."""
+    combo = {name: _coerce(name, value) for name, value in combo.items()}
+    params = PatientParams(**combo)
+    if params.target_min_bg > params.target_max_bg:
+        raise ValueError(f"target_min_bg {params.target_min_bg:g} is above target_max_bg {params.target_max_bg:g}")
+    get_curve(params.insulin_dia_minutes, params.insulin_peak_minutes)
+    return combo
+
+
+def expand(spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The spec's combinations as validated PatientParams overrides."""
+    space = spec.get("params") or {}
+    unknown = [name for name in space if name not in PARAM_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown params {unknown}, expected some of {list(PARAM_NAMES)}")
+    names = sorted(space)
+    mode = spec.get("mode", "grid")
+    if mode == "grid":
+        for name in names:
+            if not isinstance(space[name], list):
+                raise ValueError(f"Grid param '{name}' must be a list of values")
+        return [_check(dict(zip(names, values))) for values in itertools.product(*(space[n] for n in names))]
+    if mode == "random":
+        rng = random.Random(spec.get("seed", DEFAULT_SEED))
+        combos = []
+        for _ in range(int(spec.get("samples", 20))):
+            combo = {}
+            for name in names:
+                choice = space[name]
+                if isinstance(choice, dict):
+                    combo[name] = round(rng.uniform(choice["min"], choice["max"]), 6)
+                else:
+                    combo[name] = rng.choice(choice)
+            combos.append(_check(combo))
+        return combos
+    raise ValueError(f"Unknown sweep mode '{mode}', expected 'grid' or 'random'")
+
+
+def load_checkpoint(path: str) -> Dict[str, Dict[str, Any]]:
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                # A run killed mid-write leaves a partial last line; it is simply redone
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                done[row["key"]] = row
+    return done
+
+
+def rank(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Completed runs, best first; runs with an error are left out."""
+    rows = [r for r in rows if "error" not in r]
+    return sorted(rows, key=lambda r: (-r["timeInRangePct"], r["hypoEvents"], r["insulinUnits"]))
+
+
+def write_table(rows: List[Dict[str, Any]], path: str, names: List[str]) -> None:
+    columns = ["rank"] + names + ["timeInRangePct", "hypoEvents", "insulinUnits", "meanBG"]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for i, row in enumerate(rows, 1):
+            writer.writerow([i] + [row["params"].get(n) for n in names]
+                            + [row[c] for c in columns[len(names) + 1:]])
+
+
+def sweep(spec: Dict[str, Any], out: str, workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    hours = float(spec.get("hours", DEFAULT_HOURS))
+    patients = int(spec.get("patients", DEFAULT_PATIENTS))
+    seed = int(spec.get("seed", DEFAULT_SEED))
+    combos = expand(spec)
+
+    checkpoint = out + ".ndjson"
+    done = load_checkpoint(checkpoint)
+    wanted = {run_key(c, hours, patients, seed): c for c in combos}
+    pending = [c for key, c in wanted.items() if key not in done]
+    print(f"🔬 {len(wanted)} combinations, {len(wanted) - len(pending)} already in {checkpoint}")
+
+    if pending:
+        os.makedirs(os.path.dirname(os.path.abspath(checkpoint)), exist_ok=True)
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(checkpoint, "a") as log_file:
+            futures = {pool.submit(run_one, c, hours, patients, seed): c for c in pending}
+            for n, future in enumerate(as_completed(futures), 1):
+                combo = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    # One broken combination (or a crashed worker) must not end the sweep
+                    row = {"key": run_key(combo, hours, patients, seed), "params": combo, "error": repr(e)}
+                log_file.write(json.dumps(row) + "\n")
+                log_file.flush()
+                os.fsync(log_file.fileno())
+                done[row["key"]] = row
+                if "error" in row:
+                    print(f"  [{n}/{len(pending)}] {row['params']} -> ❌ {row['error']}")
+                else:
+                    print(f"  [{n}/{len(pending)}] {row['params']} -> TIR {row['timeInRangePct']}% "
+                          f"hypo {row['hypoEvents']} insulin {row['insulinUnits']} U ({row['seconds']} s)")
+        print(f"⏱️ {len(pending)} runs in {time.perf_counter() - started:.1f} s")
+
+    failed = sum("error" in done[key] for key in wanted)
+    if failed:
+        print(f"⚠️ {failed} of {len(wanted)} runs failed; they are in {checkpoint} but not ranked")
+    ranked = rank([done[key] for key in wanted])
+    write_table(ranked, out + ".csv", sorted(spec.get("params") or {}))
+    return ranked
+
+
+def _parse_value(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep over the headless simulator")
+    parser.add_argument("spec", nargs="?", help="JSON spec file (see module docstring)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=V1,V2",
+                        help="grid values for one PatientParams field; repeatable")
+    parser.add_argument("--hours", type=float, default=None)
+    parser.add_argument("--patients", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument("--out", default="sweep", help="checkpoint and table path prefix")
+    args = parser.parse_args()
+
+    spec: Dict[str, Any] = {}
+    if args.spec:
+        with open(args.spec) as f:
+            spec = json.load(f)
+    for item in args.param:
+        name, _, values = item.partition("=")
+        spec.setdefault("params", {})[name] = [_parse_value(v) for v in values.split(",")]
+    for key in ("hours", "patients", "seed"):
+        if getattr(args, key) is not None:
+            spec[key] = getattr(args, key)
+    if not spec.get("params"):
+        parser.error("nothing to sweep: give a spec file or --param")
+
+    try:
+        ranked = sweep(spec, args.out, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    names = sorted(spec["params"])
+    print(f"\n🏆 Top {min(TABLE_ROWS, len(ranked))} of {len(ranked)} (full table in {args.out}.csv)")
+    print("  ".join(f"{n:>14}" for n in names + ["TIR %", "hypo", "insulin U"]))
+    for row in ranked[:TABLE_ROWS]:
+        cells = [row["params"][n] for n in names] + [row["timeInRangePct"], row["hypoEvents"], row["insulinUnits"]]
+        print("  ".join(f"{c:>14}" for c in map(str, cells)))
@@ -0,0 +1,70 @@
+import checkpoint
+import cooler_control
+import glucose_simulator
+import state
+from clock import ManualClock
+from eventlog import log
+
+
+def _patient(session_id="ckpt", seed=4):
+    patient = state.PatientState(session_id, seed=seed, clock=ManualClock(1_700_000_000.0))
+    glucose_simulator.seed_glucose_history(patient)
+    return patient
+
+
+def _advance(patient, ticks):
+    for _ in range(ticks):
+        patient.clock.set(patient.clock.time() + glucose_simulator.INTERVAL_SECONDS)
+        cooler_control.temperature_tick(patient)
+        glucose_simulator.glucose_tick(patient)
+        patient.insulin.step()
+
+
+def test_save_then_restore_resumes_the_same_trajectory(tmp_path, monkeypatch):
+    monkeypatch.setattr(log, "enabled", False)
+    original = _patient()
+    _advance(original, 30)
+    original.insulin.add_dose(0.07, original.now_ms())
+    original.pending_delivery = True
+    _advance(original, 10)
+    path = str(tmp_path / checkpoint.CHECKPOINT_FILE)
+    checkpoint.write_atomic(path, checkpoint.encode(original))
+
+    restored = _patient(seed=99)
+    restored.clock.set(original.clock.time())
+    assert checkpoint.restore(restored, path)
+    assert restored.glucose_history.rows() == original.glucose_history.rows()
+    assert restored.basal_history.rows() == original.basal_history.rows()
+    assert restored.current_iob == original.current_iob
+    assert list(restored.insulin.ledger) == list(original.insulin.ledger)
+    assert restored.pulses_owed == 1
+    assert restored.insulin_temperature == original.insulin_temperature
+
+    # Both RNG streams were restored, so the two patients stay in lockstep
+    _advance(original, 20)
+    _advance(restored, 20)
+    assert restored.glucose_history.rows() == original.glucose_history.rows()
+    assert restored.insulin_temperature == original.insulin_temperature
+
+
+def test_corrupted_checkpoint_is_rejected_and_the_patient_left_alone(tmp_path, monkeypatch):
+    monkeypatch.setattr(log, "enabled", False)
+    original = _patient()
+    _advance(original, 30)
+    data = bytearray(checkpoint.encode(original))
+    data[-1] ^= 0xFF
+    path = str(tmp_path / checkpoint.CHECKPOINT_FILE)
+    checkpoint.write_atomic(path, bytes(data))
+
+    fresh = _patient(seed=99)
+    before = fresh.glucose_history.rows()
+    assert not checkpoint.restore(fresh, path)
+    assert fresh.glucose_history.rows() == before
+    assert fresh.current_iob == 0.0
+
+
+def test_checkpoint_of_another_session_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(log, "enabled", False)
+    path = str(tmp_path / checkpoint.CHECKPOINT_FILE)
+    checkpoint.write_atomic(path, checkpoint.encode(_patient("other")))
+    assert not checkpoint.restore(_patient(), path)
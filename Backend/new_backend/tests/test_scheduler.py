@@ -0,0 +1,54 @@
+import asyncio
+
+from clock import VirtualClock
+from eventlog import log
+from scheduler import Scheduler, PHASE_PHYSICS, PHASE_PUBLISH
+from sessions import SessionManager
+
+
+def test_failing_job_does_not_stop_the_scheduler(monkeypatch):
+    async def scenario():
+        clock = VirtualClock(start=0.0)
+        scheduler = Scheduler(clock)
+        runs = {"flaky": 0, "steady": 0}
+
+        def flaky():
+            runs["flaky"] += 1
+            if runs["flaky"] == 2:
+                raise OSError(28, "No space left on device")
+
+        def steady():
+            runs["steady"] += 1
+
+        scheduler.add("flaky", 1.0, PHASE_PHYSICS, flaky, gated=False)
+        scheduler.add("steady", 1.0, PHASE_PUBLISH, steady, gated=False)
+        scheduler.start()
+        try:
+            await clock.run_for(5.0)
+            assert not scheduler._task.done()
+        finally:
+            scheduler.stop()
+        return runs, {job["name"]: job for job in scheduler.stats()}
+
+    monkeypatch.setattr(log, "enabled", False)
+    runs, stats = asyncio.run(scenario())
+    assert runs["flaky"] >= 5 and runs["steady"] >= 5
+    assert stats["flaky"]["errors"] == 1
+    assert stats["steady"]["errors"] == 0
+
+
+def test_failing_patient_does_not_skip_the_others(tmp_path, monkeypatch):
+    manager = SessionManager(clock=VirtualClock(start=0.0), history_dir=str(tmp_path))
+    patients = [manager.create(f"p{i}", seed=i, persist=False) for i in range(3)]
+    for patient in patients:
+        patient.system_running = True
+    ticked = []
+
+    def tick(patient):
+        if patient is patients[0]:
+            raise OSError(28, "No space left on device")
+        ticked.append(patient.session_id)
+
+    monkeypatch.setattr(log, "enabled", False)
+    manager._every(tick)()
+    assert ticked == ["p1", "p2"]
@@ -0,0 +1,57 @@
+import json
+
+from clock import ManualClock
+from eventlog import log
+import fake_oref1
+import glucose_simulator
+import state
+import wire
+from broadcast import GlucoseBroadcaster
+
+
+def _patient():
+    # A manual clock, so a snapshot's timestamp is the same however often it is built
+    patient = state.PatientState("wire", seed=3, clock=ManualClock(1_700_000_000.0))
+    glucose_simulator.seed_glucose_history(patient)
+    patient.system_running = True
+    for _ in range(12):
+        _step(patient)
+    return patient
+
+
+def _step(patient):
+    patient.clock.set(patient.clock.time() + glucose_simulator.INTERVAL_SECONDS)
+    glucose_simulator.glucose_tick(patient)
+    fake_oref1.oref1_tick(patient)
+
+
+def _frames(sub):
+    frames = []
+    while not sub.queue.empty():
+        frames.append(sub.queue.get_nowait())
+    return frames
+
+
+def test_snapshot_and_delta_frames_decode_to_the_json_frames(monkeypatch):
+    monkeypatch.setattr(log, "enabled", False)
+    patient = _patient()
+    hub = GlucoseBroadcaster(patient)
+    as_json, as_binary = hub.subscribe(binary=False), hub.subscribe(binary=True)
+
+    for _ in range(3):
+        _step(patient)
+        hub.tick()
+
+    json_frames = [json.loads(frame) for frame in _frames(as_json)]
+    binary_frames = [wire.decode(frame) for frame in _frames(as_binary)]
+    assert [frame["type"] for frame in json_frames] == ["snapshot", "delta", "delta", "delta"]
+    assert binary_frames == json_frames
+    assert any(frame["basalHistory"] for frame in json_frames[1:])
+
+
+def test_state_body_decodes_to_the_snapshot(monkeypatch):
+    monkeypatch.setattr(log, "enabled", False)
+    patient = _patient()
+    snapshot = json.loads(patient.snapshot_json())
+    decoded = wire.decode(patient.snapshot_binary())
+    assert decoded == snapshot
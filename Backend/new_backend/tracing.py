@@ -0,0 +1,118 @@
+"""
+Flight recorder: an always-on, bounded in-memory ring of trace spans.
+
+Scheduler job runs, oref1 decisions (inputs and outputs), motor pulses,
+cooler cycles and relay calls each leave one record when they finish. The
+ring keeps the newest TRACE_CAPACITY records, so memory is fixed no matter
+how long the process runs, and recording is an append of a tuple: nothing is
+formatted until someone asks for a dump.
+
+    GET /trace                   Chrome trace JSON of the whole ring
+    GET /trace?session=demo      only that session's spans (plus the scheduler's)
+    GLUCODOSE_TRACE=off          record nothing
+
+Load the dump in ui.perfetto.dev or chrome://tracing. Synchronous spans
+(scheduler jobs, decisions) sit on one row per track; spans that live across
+awaits (motor pulses, cooler cycles, relay calls) are async slices, so
+overlapping pulses show up side by side instead of being mis-nested.
+Timestamps are wall-clock microseconds, so they line up with eventlog lines.
+"""
+import itertools
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# --- CONFIGURATION ---
+TRACE_CAPACITY = 20000           # records; a few hundred bytes each
+DEFAULT_ENABLED = os.environ.get("GLUCODOSE_TRACE", "on") != "off"
+
+# Record kinds
+SPAN = "X"         # synchronous: starts and ends within one event-loop step
+ASYNC = "async"    # spans awaits and may overlap others on its track
+INSTANT = "i"
+
+# Tracks that aren't a session
+SCHEDULER_TRACK = "scheduler"
+RELAY_TRACK = "relay"
+
+_PID = 1
+# perf_counter_ns is monotonic; this maps it onto the wall clock for the dump
+_WALL_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+# (kind, name, track, start_ns, duration_ns, args)
+Record = Tuple[str, str, str, int, int, Dict[str, Any]]
+
+
+def now_ns() -> int:
+    return time.perf_counter_ns()
+
+
+class Tracer:
+    def __init__(self, capacity: int = TRACE_CAPACITY, enabled: bool = DEFAULT_ENABLED):
+        self.enabled = enabled
+        self.records: Deque[Record] = deque(maxlen=capacity)
+        self.dropped = 0     # records pushed out of the ring since the last clear()
+
+    def _record(self, record: Record) -> None:
+        records = self.records
+        if len(records) == records.maxlen:
+            self.dropped += 1
+        records.append(record)
+
+    def span(self, name: str, track: str, start_ns: int, **args: Any) -> None:
+        """A synchronous span that started at start_ns (now_ns()) and ends now."""
+        if self.enabled:
+            self._record((SPAN, name, track, start_ns, time.perf_counter_ns() - start_ns, args))
+
+    def async_span(self, name: str, track: str, start_ns: int, **args: Any) -> None:
+        """Like span(), for work that awaited in between; may overlap other spans on the track."""
+        if self.enabled:
+            self._record((ASYNC, name, track, start_ns, time.perf_counter_ns() - start_ns, args))
+
+    def instant(self, name: str, track: str, **args: Any) -> None:
+        if self.enabled:
+            self._record((INSTANT, name, track, time.perf_counter_ns(), 0, args))
+
+    def clear(self) -> None:
+        self.records.clear()
+        self.dropped = 0
+
+    def snapshot(self, session: Optional[str] = None) -> List[Record]:
+        """Copy of the ring, optionally narrowed to one session; take it on the event loop."""
+        if session is None:
+            return list(self.records)
+        return [r for r in self.records if r[2] in (session, SCHEDULER_TRACK, RELAY_TRACK)]
+
+    def chrome_trace(self, records: Optional[List[Record]] = None) -> Dict[str, Any]:
+        """
+        A Chrome trace event document of `records` (default: the whole ring).
+        Records are immutable once written, so a snapshot() can be formatted
+        off the event loop.
+        """
+        records = self.snapshot() if records is None else records
+        tids: Dict[str, int] = {}
+        events: List[Dict[str, Any]] = []
+        ids = itertools.count(1)
+        for kind, name, track, start_ns, duration_ns, args in records:
+            tid = tids.setdefault(track, len(tids) + 1)
+            ts = (start_ns + _WALL_OFFSET_NS) / 1000
+            base = {"name": name, "cat": track, "pid": _PID, "tid": tid, "args": args}
+            if kind == ASYNC:
+                span_id = next(ids)
+                events.append({**base, "ph": "b", "ts": ts, "id": span_id})
+                events.append({**base, "ph": "e", "ts": ts + duration_ns / 1000, "id": span_id, "args": {}})
+            elif kind == INSTANT:
+                events.append({**base, "ph": "i", "ts": ts, "s": "t"})
+            else:
+                events.append({**base, "ph": "X", "ts": ts, "dur": duration_ns / 1000})
+        # Async begin/end pairs interleave with later records; viewers want time order
+        events.sort(key=lambda e: e["ts"])
+        metadata = [{"name": "process_name", "ph": "M", "pid": _PID, "args": {"name": "glucodose"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": _PID, "tid": tid, "args": {"name": track}}
+                     for track, tid in tids.items()]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms",
+                "otherData": {"capacity": self.records.maxlen, "dropped": self.dropped}}
+
+
+tracer = Tracer()
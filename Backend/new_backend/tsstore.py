@@ -0,0 +1,220 @@
+"""
+Append-only, memory-mapped time-series store for the simulation history.
+
+Each series lives in its own directory of fixed-size segment files. A
+segment is a 64-byte header followed by a preallocated array of fixed-width
+records, mapped with np.memmap, so an append is a single record copy into
+the page cache. Segment headers carry the record count and the first/last
+timestamp, which is the time index: range queries only open the segments
+that overlap the window and binary-search their ts column, without reading
+whole files.
+
+    root/<session_id>/glucose/000001.seg
+    root/<session_id>/oref1/000001.seg
+    ...
+"""
+import bisect
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from ringbuffer import TREND_LABELS
+
+# --- CONFIGURATION ---
+HISTORY_DIR = os.environ.get("GLUCODOSE_HISTORY_DIR", "data/history")
+SEGMENT_RECORDS = 65536           # ~3.8 days of 5 s glucose readings per segment
+RETENTION_SEGMENTS = 64           # oldest segments beyond this are deleted
+RETENTION_HOURS: Optional[float] = None   # optional age-based retention on top
+MAX_QUERY_ROWS = 50_000
+
+MAGIC = b"GDTS"
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"), ("version", "<u2"), ("_pad", "<u2"),
+    ("record_size", "<u4"), ("capacity", "<u4"),
+    ("count", "<u8"), ("first_ts", "<i8"), ("last_ts", "<i8"),
+    ("_reserved", "V24"),
+])
+assert HEADER_DTYPE.itemsize == HEADER_SIZE
+
+REASON_BYTES = 96
+ACTUATORS = ("motor", "cooler")
+ACTUATOR_STATES = ("OFF", "ON")
+
+SERIES_DTYPES: Dict[str, np.dtype] = {
+    "glucose": np.dtype([("ts", "<i8"), ("bg", "<i4"), ("trend", "i1")]),
+    "oref1": np.dtype([("ts", "<i8"), ("rate", "<f8"), ("duration", "<i4"),
+                       ("eventualBG", "<i4"), ("reason", f"S{REASON_BYTES}")]),
+    "iob": np.dtype([("ts", "<i8"), ("iob", "<f8")]),
+    "events": np.dtype([("ts", "<i8"), ("actuator", "i1"), ("state", "i1"), ("value", "<f8")]),
+}
+
+
+@dataclass
+class _Segment:
+    path: str
+    first_ts: int
+    last_ts: int
+    count: int
+
+
+def _open_segment(path: str, dtype: np.dtype, mode: str):
+    header = np.memmap(path, dtype=HEADER_DTYPE, mode=mode, offset=0, shape=(1,))
+    if header["magic"][0] != MAGIC or header["record_size"][0] != dtype.itemsize:
+        raise ValueError(f"{path} is not a {dtype.itemsize}-byte record segment")
+    records = np.memmap(path, dtype=dtype, mode=mode, offset=HEADER_SIZE,
+                        shape=(int(header["capacity"][0]),))
+    return header, records
+
+
+class SeriesStore:
+    """One series: a directory of segments, the newest one open for appends."""
+
+    def __init__(self, path: str, dtype: np.dtype, segment_records: int = SEGMENT_RECORDS,
+                 retention_segments: int = RETENTION_SEGMENTS,
+                 retention_hours: Optional[float] = RETENTION_HOURS):
+        self.path = path
+        self.dtype = dtype
+        self.segment_records = segment_records
+        self.retention_segments = retention_segments
+        self.retention_hours = retention_hours
+        os.makedirs(path, exist_ok=True)
+
+        self.segments: List[_Segment] = []
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".seg"):
+                seg_path = os.path.join(path, name)
+                header = np.fromfile(seg_path, dtype=HEADER_DTYPE, count=1)
+                if len(header) and header["magic"][0] == MAGIC:
+                    self.segments.append(_Segment(seg_path, int(header["first_ts"][0]),
+                                                  int(header["last_ts"][0]), int(header["count"][0])))
+        self._header = None
+        self._records = None
+        if self.segments and self.segments[-1].count < self._capacity(self.segments[-1].path):
+            self._header, self._records = _open_segment(self.segments[-1].path, dtype, "r+")
+
+    def _capacity(self, path: str) -> int:
+        return int(np.fromfile(path, dtype=HEADER_DTYPE, count=1)["capacity"][0])
+
+    def _rollover(self, ts: int) -> None:
+        if self._header is not None:
+            self._header.flush()
+            self._records.flush()
+        index = int(os.path.basename(self.segments[-1].path)[:-4]) + 1 if self.segments else 1
+        seg_path = os.path.join(self.path, f"{index:06d}.seg")
+        with open(seg_path, "wb") as f:
+            f.truncate(HEADER_SIZE + self.segment_records * self.dtype.itemsize)
+        header = np.memmap(seg_path, dtype=HEADER_DTYPE, mode="r+", offset=0, shape=(1,))
+        header[0] = (MAGIC, VERSION, 0, self.dtype.itemsize, self.segment_records, 0, ts, ts, b"")
+        header.flush()
+        self._header, self._records = _open_segment(seg_path, self.dtype, "r+")
+        self.segments.append(_Segment(seg_path, ts, ts, 0))
+        self._apply_retention(ts)
+
+    def _apply_retention(self, now_ts: int) -> None:
+        expired = max(0, len(self.segments) - self.retention_segments)
+        if self.retention_hours is not None:
+            cutoff = now_ts - int(self.retention_hours * 3600 * 1000)
+            while expired < len(self.segments) - 1 and self.segments[expired].last_ts < cutoff:
+                expired += 1
+        for seg in self.segments[:expired]:
+            os.remove(seg.path)
+        del self.segments[:expired]
+
+    def append(self, record: Sequence[Any]) -> None:
+        ts = int(record[0])
+        if self._header is None or self.segments[-1].count >= self.segment_records:
+            self._rollover(ts)
+        seg = self.segments[-1]
+        # Keep ts non-decreasing so every segment stays binary-searchable
+        ts = max(ts, seg.last_ts)
+        self._records[seg.count] = (ts, *record[1:])
+        seg.count += 1
+        seg.last_ts = ts
+        self._header["count"] = seg.count
+        self._header["last_ts"] = ts
+
+    def query(self, t_from: int, t_to: int, limit: int = MAX_QUERY_ROWS) -> np.ndarray:
+        """Records with t_from <= ts <= t_to, oldest first, at most `limit` of them."""
+        firsts = [seg.first_ts for seg in self.segments]
+        start = max(0, bisect.bisect_right(firsts, t_from) - 1)
+        chunks, total = [], 0
+        for seg in self.segments[start:]:
+            if seg.first_ts > t_to or total >= limit:
+                break
+            if seg.last_ts < t_from or seg.count == 0:
+                continue
+            if seg is self.segments[-1] and self._records is not None:
+                records = self._records
+            else:
+                records = _open_segment(seg.path, self.dtype, "r")[1]
+            ts = records["ts"][:seg.count]
+            lo = int(np.searchsorted(ts, t_from, side="left"))
+            hi = int(np.searchsorted(ts, t_to, side="right"))
+            hi = min(hi, lo + limit - total)
+            if hi > lo:
+                chunks.append(np.array(records[lo:hi]))
+                total += hi - lo
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=self.dtype)
+
+    def scan(self) -> Iterator[np.ndarray]:
+        """Every stored record, oldest first, one segment (a read-only view) at a time."""
+        for seg in list(self.segments):
+            if seg.count == 0:
+                continue
+            if seg is self.segments[-1] and self._records is not None:
+                yield self._records[:seg.count]
+            else:
+                yield _open_segment(seg.path, self.dtype, "r")[1][:seg.count]
+
+    def flush(self) -> None:
+        if self._header is not None:
+            self._header.flush()
+            self._records.flush()
+
+
+def _decode(series: str, records: np.ndarray) -> List[Dict[str, Any]]:
+    cols = {name: records[name].tolist() for name in records.dtype.names}
+    if series == "glucose":
+        cols["trend"] = [TREND_LABELS[c] for c in cols["trend"]]
+    elif series == "oref1":
+        cols["reason"] = [r.decode("utf-8", "ignore") for r in cols["reason"]]
+    elif series == "events":
+        cols["actuator"] = [ACTUATORS[c] for c in cols["actuator"]]
+        cols["state"] = [ACTUATOR_STATES[c] for c in cols["state"]]
+    names = list(cols)
+    return [dict(zip(names, row)) for row in zip(*cols.values())]
+
+
+class HistoryStore:
+    """All persisted series for one session."""
+
+    SERIES = tuple(SERIES_DTYPES)
+
+    def __init__(self, root: str, **options):
+        self.root = root
+        self.series = {name: SeriesStore(os.path.join(root, name), dtype, **options)
+                       for name, dtype in SERIES_DTYPES.items()}
+
+    def record_glucose(self, ts: int, bg: int, trend: str) -> None:
+        self.series["glucose"].append((ts, bg, TREND_LABELS.index(trend)))
+
+    def record_oref1(self, rec: Dict[str, Any]) -> None:
+        reason = rec["reason"].encode("utf-8")[:REASON_BYTES]
+        self.series["oref1"].append((rec["ts"], rec["rate"], rec["duration"], rec["eventualBG"], reason))
+
+    def record_iob(self, ts: int, iob: float) -> None:
+        self.series["iob"].append((ts, iob))
+
+    def record_event(self, ts: int, actuator: str, state: str, value: float = 0.0) -> None:
+        self.series["events"].append((ts, ACTUATORS.index(actuator), ACTUATOR_STATES.index(state), value))
+
+    def query(self, series: str, t_from: int, t_to: int, limit: int = MAX_QUERY_ROWS) -> List[Dict[str, Any]]:
+        return _decode(series, self.series[series].query(t_from, t_to, limit))
+
+    def flush(self) -> None:
+        for store in self.series.values():
+            store.flush()
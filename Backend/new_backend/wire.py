@@ -0,0 +1,170 @@
+"""
+Compact binary encoding for /state and /ws/glucose, as an opt-in next to JSON.
+
+Clients ask for it with the websocket subprotocol BINARY_SUBPROTOCOL or, on
+/state, with `Accept: application/vnd.glucodose+binary`. Everyone else
+keeps getting JSON. Decoding a binary frame yields exactly the object the
+JSON frame would have parsed to, so the frontend merges both the same way
+(frontend/src/wire.js is the decoder).
+
+Scalar fields are few and irregular, so they travel as a small JSON object.
+The histories, which are the bulk of every snapshot, are typed columns:
+
+    header    "<2sBB"  magic b"GD", WIRE_VERSION, frame type (STATE / SNAPSHOT / DELTA)
+    fields    u32 length + UTF-8 JSON object (DELTA: only the changed fields)
+    limits    u16 glucose, u16 basal                  SNAPSHOT only (historyLimits)
+    glucose   u32 n; if n: i64 first ts, i32[n-1] ts deltas, u16[n] bg, u8[n] trend code
+    basal     u32 n; if n: i64 first ts, i32[n-1] ts deltas, f64[n] rate, u16[n] duration,
+              i16[n] eventualBG, u16 k + k x (u16 length + UTF-8) reason table, u16[n] reason index
+
+All little endian and unaligned. Trend codes index ringbuffer.TREND_LABELS.
+"""
+import json
+import struct
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+
+from ringbuffer import ColumnRing, TREND_LABELS
+
+# --- CONFIGURATION ---
+WIRE_VERSION = 1
+BINARY_SUBPROTOCOL = "glucodose.bin.v1"
+JSON_SUBPROTOCOL = "glucodose.json"
+BINARY_MEDIA_TYPE = "application/vnd.glucodose+binary"
+
+# Frame types
+STATE = 0        # GET /state
+SNAPSHOT = 1     # first /ws/glucose frame
+DELTA = 2        # every later /ws/glucose frame
+_TYPE_NAMES = {SNAPSHOT: "snapshot", DELTA: "delta"}
+
+_MAGIC = b"GD"
+_HEADER = struct.Struct("<2sBB")
+_U32 = struct.Struct("<I")
+_U16 = struct.Struct("<H")
+_LIMITS = struct.Struct("<HH")
+_FIRST_TS = struct.Struct("<q")
+
+
+def negotiate_subprotocol(offered: Iterable[str]) -> Optional[str]:
+    """The first subprotocol we speak from the client's list, or None (plain JSON)."""
+    for protocol in offered:
+        if protocol in (BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL):
+            return protocol
+    return None
+
+
+def accepts_binary(accept: str) -> bool:
+    return BINARY_MEDIA_TYPE in accept
+
+
+def _timestamps(out: bytearray, ts: np.ndarray) -> None:
+    out += _FIRST_TS.pack(int(ts[0]))
+    out += np.diff(ts).astype("<i4").tobytes()
+
+
+def _glucose(out: bytearray, cols: Dict[str, np.ndarray]) -> None:
+    n = len(cols["ts"])
+    out += _U32.pack(n)
+    if n:
+        _timestamps(out, cols["ts"])
+        out += np.clip(cols["bg"], 0, 0xFFFF).astype("<u2").tobytes()
+        out += cols["trend"].astype("u1").tobytes()
+
+
+def _basal(out: bytearray, cols: Dict[str, np.ndarray]) -> None:
+    n = len(cols["ts"])
+    out += _U32.pack(n)
+    if n:
+        _timestamps(out, cols["ts"])
+        out += cols["rate"].astype("<f8").tobytes()
+        out += np.clip(cols["duration"], 0, 0xFFFF).astype("<u2").tobytes()
+        out += np.clip(cols["eventualBG"], -0x8000, 0x7FFF).astype("<i2").tobytes()
+        # Decisions repeat a handful of reasons, so each frame carries a table of them
+        table: Dict[str, int] = {}
+        index = [table.setdefault(reason, len(table)) for reason in cols["reason"].tolist()]
+        out += _U16.pack(len(table))
+        for reason in table:
+            data = reason.encode("utf-8")
+            out += _U16.pack(len(data)) + data
+        out += np.asarray(index, dtype="<u2").tobytes()
+
+
+def encode(frame_type: int, fields: Dict[str, Any], glucose: Dict[str, np.ndarray],
+           basal: Dict[str, np.ndarray], limits: Optional[Dict[str, int]] = None) -> bytes:
+    """One frame; glucose and basal are ColumnRing.slice() columns."""
+    out = bytearray(_HEADER.pack(_MAGIC, WIRE_VERSION, frame_type))
+    body = json.dumps(fields, separators=(",", ":")).encode()
+    out += _U32.pack(len(body)) + body
+    if frame_type == SNAPSHOT:
+        out += _LIMITS.pack(limits["glucoseHistory"], limits["basalHistory"])
+    _glucose(out, glucose)
+    _basal(out, basal)
+    return bytes(out)
+
+
+def encode_state(fields: Dict[str, Any], glucose: ColumnRing, basal: ColumnRing) -> bytes:
+    """The /state body: the snapshot without histories, plus both whole rings."""
+    return encode(STATE, fields, glucose.slice(), basal.slice())
+
+
+# --- DECODER (tests and Python clients; the dashboard uses frontend/src/wire.js) ---
+def decode(data: bytes) -> Dict[str, Any]:
+    """Inverse of encode(), to the same shape as the JSON frame / snapshot."""
+    view = memoryview(data)
+    magic, version, frame_type = _HEADER.unpack_from(view)
+    if magic != _MAGIC or version != WIRE_VERSION:
+        raise ValueError(f"not a version {WIRE_VERSION} GlucoDose frame")
+    pos = _HEADER.size
+    (length,) = _U32.unpack_from(view, pos)
+    pos += _U32.size
+    fields = json.loads(bytes(view[pos:pos + length]))
+    pos += length
+    limits = None
+    if frame_type == SNAPSHOT:
+        limits = dict(zip(("glucoseHistory", "basalHistory"), _LIMITS.unpack_from(view, pos)))
+        pos += _LIMITS.size
+
+    def column(dtype, n):
+        nonlocal pos
+        values = np.frombuffer(view, dtype=dtype, count=n, offset=pos)
+        pos += values.nbytes
+        return values.tolist()
+
+    def timestamps(n):
+        nonlocal pos
+        (first,) = _FIRST_TS.unpack_from(view, pos)
+        pos += _FIRST_TS.size
+        return np.concatenate(([first], first + np.cumsum(column("<i4", n - 1), dtype=np.int64))).tolist()
+
+    (n,) = _U32.unpack_from(view, pos)
+    pos += _U32.size
+    glucose = []
+    if n:
+        ts, bg, trend = timestamps(n), column("<u2", n), column("u1", n)
+        glucose = [{"ts": t, "bg": b, "trend": TREND_LABELS[c]} for t, b, c in zip(ts, bg, trend)]
+
+    (n,) = _U32.unpack_from(view, pos)
+    pos += _U32.size
+    basal = []
+    if n:
+        ts, rate, duration, eventual = timestamps(n), column("<f8", n), column("<u2", n), column("<i2", n)
+        (k,) = _U16.unpack_from(view, pos)
+        pos += _U16.size
+        table = []
+        for _ in range(k):
+            (size,) = _U16.unpack_from(view, pos)
+            table.append(bytes(view[pos + 2:pos + 2 + size]).decode("utf-8"))
+            pos += 2 + size
+        reasons = [table[i] for i in column("<u2", n)]
+        basal = [{"ts": t, "rate": r, "duration": d, "eventualBG": e, "reason": why}
+                 for t, r, d, e, why in zip(ts, rate, duration, eventual, reasons)]
+
+    if frame_type == DELTA:
+        return {"type": "delta", "fields": fields, "glucoseHistory": glucose, "basalHistory": basal}
+    frame = {"type": _TYPE_NAMES[frame_type], **fields} if frame_type in _TYPE_NAMES else dict(fields)
+    frame["glucoseHistory"], frame["basalHistory"] = glucose, basal
+    if limits:
+        frame["historyLimits"] = limits
+    return frame
@@ -4,6 +4,9 @@ import time
 import subprocess
 import os
 
+import determine_basal
+from generator import GlucoseFeedReader
+
 # --- Configuration ---
 # THIS IS YOUR SAFETY TOGGLE SWITCH!
 # False = Open Loop (only shows recommendations)
@@ -13,9 +16,79 @@ LOOP_IS_CLOSED = False
 OREF1_PATH = 'E:/oref1/oref0-master'
 LOOP_INTERVAL_SECONDS = 300 # 5 minutes
 
+# 'python' runs determine-basal in-process (oref1/determine_basal.py),
+# 'node' spawns oref0-determine-basal.js as before
+ENGINE = os.environ.get('OREF1_ENGINE', 'python')
+MICROBOLUS_ALLOWED = True
+
 # In run_loop.py
 
+_feed_reader = None
+
+
+def _current_glucose():
+    """Tails glucose.ndjson when the feed writes one, else reads glucose.json."""
+    global _feed_reader
+    data_dir = os.path.join(OREF1_PATH, 'data')
+    if os.path.exists(os.path.join(data_dir, 'glucose.ndjson')):
+        if _feed_reader is None:
+            _feed_reader = GlucoseFeedReader(data_dir)
+        return _feed_reader.glucose()
+    return _load_json('glucose.json')
+
+
+def _load_json(name):
+    with open(os.path.join(OREF1_PATH, 'data', name)) as f:
+        return json.load(f)
+
+
+def run_oref1_in_process(glucose=None, iob=None, temp_basal=None, profile=None, preferences=None):
+    """
+    Runs determine-basal without leaving Python. Any input that isn't passed
+    in memory is read from the same data/*.json files the node script uses.
+    """
+    try:
+        return determine_basal.recommend(
+            glucose if glucose is not None else _current_glucose(),
+            iob if iob is not None else _load_json('iob.json'),
+            temp_basal if temp_basal is not None else _load_json('temp_basal.json'),
+            profile if profile is not None else _load_json('profile.json'),
+            preferences=preferences,
+            micro_bolus_allowed=MICROBOLUS_ALLOWED,
+        )
+    except (OSError, ValueError, KeyError) as e:
+        print(f"!!! ORCHESTRATOR: Error - in-process determine-basal failed: {e} !!!")
+        return None
+
+
+def run_oref1_node_with_inputs(inputs):
+    """Writes a golden-case input set to data/*.json and runs the node reference on it."""
+    data_dir = os.path.join(OREF1_PATH, 'data')
+    profile = dict(inputs['profile'])
+    profile.update(inputs.get('preferences', {}))
+    files = {
+        'glucose.json': inputs['glucose'], 'iob.json': inputs['iob'],
+        'temp_basal.json': inputs.get('temp_basal', {}), 'profile.json': profile,
+        'meal.json': inputs.get('meal', {}), 'autosens.json': inputs.get('autosens', {'ratio': 1.0}),
+    }
+    for name, data in files.items():
+        with open(os.path.join(data_dir, name), 'w') as f:
+            json.dump(data, f)
+    extra = ['data/autosens.json', 'data/meal.json']
+    if inputs.get('microBolusAllowed'):
+        extra.append('--microbolus')
+    extra += ['--currentTime', str(int(inputs['currentTime']))]
+    return run_oref1_node(extra)
+
+
 def run_oref1_calculation():
+    """Returns the recommendation from the configured engine."""
+    if ENGINE == 'node':
+        return run_oref1_node()
+    return run_oref1_in_process()
+
+
+def run_oref1_node(extra_args=()):
     """Runs the main determine-basal script and returns the recommendation."""
     
     # The command should now use SIMPLE, RELATIVE paths
@@ -25,7 +98,8 @@ def run_oref1_calculation():
         'data/iob.json',
         'data/temp_basal.json',
         'data/glucose.json',
-        'data/profile.json'
+        'data/profile.json',
+        *extra_args
     ]
     
     # Let's print the command for debugging
@@ -70,6 +144,7 @@ def run_oref1_calculation():
 if __name__ == '__main__':
     print("--- Starting Oref1 Orchestrator Loop ---")
     print(f"SAFETY SWITCH: Loop is {'CLOSED' if LOOP_IS_CLOSED else 'OPEN'}")
+    print(f"ENGINE: {ENGINE}")
     
     while True:
         recommendation = run_oref1_calculation()
@@ -0,0 +1,583 @@
+# determine_basal.py
+"""
+In-process port of oref0's determine-basal, so the orchestrator no longer has
+to spawn `node bin/oref0-determine-basal.js` and round-trip data/*.json every
+cycle.
+
+Covers the parts of the algorithm switched on by preferences.json:
+glucose status (delta / short / long average deltas), BGI and deviation,
+the IOB / zero-temp / UAM prediction curves, minPredBG and minGuardBG,
+low-glucose suspend, the temp basal decision and SMB (microbolus) sizing
+with maxSMBBasalMinutes / maxUAMSMBBasalMinutes. Carb (COB) absorption and
+autotune are not modelled; meal data only feeds the SMB checks.
+
+    python determine_basal.py --check golden/       # compare against the corpus
+    python determine_basal.py --bench                # per-decision latency
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import time
+from datetime import datetime, timezone
+
+# --- Configuration ---
+PREDICTION_TICKS = 48          # 4 hours of 5-minute predictions, like oref0
+SMB_INTERVAL_MINUTES = 3
+MAX_DAILY_SAFETY_MULTIPLIER = 3
+CURRENT_BASAL_SAFETY_MULTIPLIER = 4
+
+PREFERENCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preferences.json')
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+# Fields compared against recorded outputs; reason strings are informational
+GOLDEN_FIELDS = ('rate', 'duration', 'units', 'eventualBG', 'insulinReq', 'bg', 'tick')
+
+
+def load_preferences(path=PREFERENCES_PATH):
+    """preferences.json carries // comment lines, which plain json.load rejects."""
+    with open(path) as f:
+        lines = [line for line in f if not line.lstrip().startswith('//')]
+    return json.loads(''.join(lines))
+
+
+def _round(value, digits=0):
+    # JavaScript Math.round semantics (halves go up), not Python's banker's rounding
+    scale = 10 ** digits
+    return math.floor(value * scale + 0.5) / scale
+
+
+def round_basal(basal, profile=None):
+    # Pump rate resolution: 0.05 U/hr below 10 U/hr, 0.1 above
+    if basal < 10:
+        return _round(basal * 20) / 20
+    return _round(basal * 10) / 10
+
+
+def _to_ms(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp() * 1000
+
+
+def get_last_glucose(entries):
+    """Port of oref0 glucose-get-last: current BG and 5-minute delta averages."""
+    data = sorted(
+        ({'glucose': e.get('sgv', e.get('glucose')), 'date': _to_ms(e.get('date', e.get('dateString')))}
+         for e in entries if (e.get('sgv', e.get('glucose')) or 0) > 38),
+        key=lambda e: e['date'], reverse=True,
+    )
+    if not data:
+        return None
+    now = dict(data[0])
+    now_date = now['date']
+    last_deltas, short_deltas, long_deltas = [], [], []
+
+    for then in data[1:]:
+        minutes_ago = _round((now_date - then['date']) / 60000)
+        if minutes_ago == 0 and then['date'] == now_date:
+            continue
+        change = now['glucose'] - then['glucose']
+        avg_delta = change / minutes_ago * 5 if minutes_ago else 0
+        if -2 < minutes_ago <= 2.5:
+            # Readings this close together are averaged into "now"
+            now['glucose'] = (now['glucose'] + then['glucose']) / 2
+            now_date = (now_date + then['date']) / 2
+        elif 2.5 < minutes_ago < 17.5:
+            short_deltas.append(avg_delta)
+            if minutes_ago < 7.5:
+                last_deltas.append(avg_delta)
+        elif 17.5 <= minutes_ago < 42.5:
+            long_deltas.append(avg_delta)
+
+    def avg(values):
+        return sum(values) / len(values) if values else 0
+
+    return {
+        'glucose': now['glucose'],
+        'delta': _round(avg(last_deltas), 2),
+        'short_avgdelta': _round(avg(short_deltas), 2),
+        'long_avgdelta': _round(avg(long_deltas), 2),
+        'date': now_date,
+    }
+
+
+def _current_sens(profile):
+    sens = profile.get('sens')
+    if isinstance(sens, list):
+        return sens[0]['value'] if sens else 50
+    return sens or profile.get('isfProfile', {}).get('sensitivities', [{'sensitivity': 50}])[0]['sensitivity']
+
+
+def _max_daily_basal(profile):
+    basals = profile.get('basal') or profile.get('basalprofile') or []
+    rates = [b.get('value', b.get('rate', 0)) for b in basals]
+    return profile.get('max_daily_basal', max(rates) if rates else profile['current_basal'])
+
+
+def get_max_safe_basal(profile):
+    return min(
+        profile.get('max_basal', 4 * profile['current_basal']),
+        profile.get('max_daily_safety_multiplier', MAX_DAILY_SAFETY_MULTIPLIER) * _max_daily_basal(profile),
+        profile.get('current_basal_safety_multiplier', CURRENT_BASAL_SAFETY_MULTIPLIER) * profile['current_basal'],
+    )
+
+
+def set_temp_basal(rate, duration, profile, rT, currenttemp):
+    max_safe = get_max_safe_basal(profile)
+    rate = min(max(rate, 0), max_safe)
+    suggested = round_basal(rate, profile)
+    cur_rate = currenttemp.get('rate', 0) or 0
+    cur_duration = currenttemp.get('duration', 0) or 0
+
+    if (cur_duration > duration - 10 and cur_duration <= 120
+            and cur_rate * 0.8 <= suggested <= cur_rate * 1.2 and duration > 0):
+        rT['reason'] += f" {cur_duration}m left and {cur_rate} ~ req {suggested}U/hr: no temp required"
+        return rT
+    rT['duration'] = duration
+    rT['rate'] = suggested
+    return rT
+
+
+def _project_iob(iob_data, dia_hours, ticks=PREDICTION_TICKS):
+    """
+    determine-basal expects the per-5-minute IOB projection that
+    oref0-calculate-iob produces. When only the current IOB is supplied,
+    project it forward assuming it decays like a single exponential.
+    """
+    if isinstance(iob_data, list) and len(iob_data) > 1:
+        return iob_data
+    current = iob_data[0] if isinstance(iob_data, list) else iob_data
+    iob, activity = current.get('iob', 0), current.get('activity', 0)
+    tau = iob / activity if activity > 0 and iob > 0 else dia_hours * 60 / 3
+    zt = current.get('iobWithZeroTemp', {'iob': iob, 'activity': activity})
+    projected = [current]
+    for i in range(1, ticks):
+        decay = math.exp(-5 * i / tau)
+        projected.append({
+            'iob': iob * decay,
+            'activity': activity * decay,
+            'iobWithZeroTemp': {'iob': zt['iob'] * decay, 'activity': zt['activity'] * decay},
+        })
+    return projected
+
+
+def enable_smb(profile, micro_bolus_allowed, meal_data, bg):
+    if not micro_bolus_allowed:
+        return False, 'SMB disabled (no microbolus allowed)'
+    if not profile.get('allowSMB_with_high_temptarget') and profile.get('temptargetSet') and profile.get('target_bg', 0) > 100:
+        return False, 'SMB disabled due to high temptarget'
+    if profile.get('enableSMB_always'):
+        return True, 'SMB enabled due to enableSMB_always'
+    if profile.get('enableSMB_with_COB') and meal_data.get('mealCOB'):
+        return True, 'SMB enabled for COB'
+    if profile.get('enableSMB_after_carbs') and meal_data.get('carbs'):
+        return True, 'SMB enabled for 6h after carb entry'
+    if profile.get('enableSMB_with_temptarget') and profile.get('temptargetSet') and profile.get('target_bg', 200) < 100:
+        return True, 'SMB enabled for temptarget'
+    return False, 'SMB disabled (no enableSMB preferences active)'
+
+
+def determine_basal(glucose_status, currenttemp, iob_data, profile, autosens_data=None,
+                    meal_data=None, micro_bolus_allowed=False, current_time=None):
+    """Returns the same recommendation dict oref0-determine-basal.js prints."""
+    autosens_data = autosens_data or {'ratio': 1.0}
+    meal_data = meal_data or {}
+    now_ms = _to_ms(current_time) if current_time is not None else time.time() * 1000
+    deliver_at = datetime.fromtimestamp(now_ms / 1000, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+    rT = {'temp': 'absolute', 'deliverAt': deliver_at, 'reason': ''}
+
+    if glucose_status is None:
+        rT['error'] = 'Error: could not get current BG'
+        return rT
+    iob_array = _project_iob(iob_data, profile.get('dia', 3))
+    iob = iob_array[0]
+
+    sensitivity_ratio = autosens_data.get('ratio', 1.0)
+    basal = round_basal(profile['current_basal'] * sensitivity_ratio, profile)
+    bg = glucose_status['glucose']
+    min_ago = _round((now_ms - glucose_status['date']) / 60000, 1)
+
+    if bg <= 10 or bg == 38:
+        rT['reason'] = 'CGM is calibrating, in ??? state, or noise is high'
+    elif min_ago > 12 or min_ago < -5:
+        rT['reason'] = f"If current system time {deliver_at} is correct, then BG data is too old. The last BG data was read {min_ago}m ago"
+    if rT['reason']:
+        cur_rate = currenttemp.get('rate', 0) or 0
+        if cur_rate > basal:
+            rT['reason'] += f". Replacing high temp basal of {cur_rate} with neutral temp of {basal}"
+            rT['duration'], rT['rate'] = 30, basal
+        elif cur_rate == 0 and (currenttemp.get('duration') or 0) > 30:
+            rT['reason'] += '. Shortening ' + str(currenttemp['duration']) + 'm long zero temp to 30m. '
+            rT['duration'], rT['rate'] = 30, 0
+        else:
+            rT['reason'] += f". Temp {cur_rate} <= current basal {basal}U/hr; doing nothing. "
+        return rT
+
+    min_bg, max_bg = profile['min_bg'], profile['max_bg']
+    target_bg = profile.get('target_bg') or (min_bg + max_bg) / 2
+    sens = _round(_current_sens(profile) / sensitivity_ratio, 1)
+
+    delta = glucose_status['delta']
+    tick = f"+{_round(delta):g}" if delta > -0.5 else f"{_round(delta):g}"
+    min_delta = min(delta, glucose_status['short_avgdelta'])
+    min_avg_delta = min(glucose_status['short_avgdelta'], glucose_status['long_avgdelta'])
+
+    bgi = _round(-iob['activity'] * sens * 5, 2)
+    deviation = _round(30 / 5 * (min_delta - bgi))
+    if deviation < 0:
+        deviation = _round(30 / 5 * (min_avg_delta - bgi))
+        if deviation < 0:
+            deviation = _round(30 / 5 * (glucose_status['long_avgdelta'] - bgi))
+
+    naive_eventual_bg = _round(bg - iob['iob'] * sens)
+    eventual_bg = naive_eventual_bg + deviation
+    threshold = min_bg - 0.5 * (min_bg - 40)
+    expected_delta = _round(bgi + (target_bg - eventual_bg) / (2 * 60 / 5), 1)
+
+    rT.update({
+        'bg': bg, 'tick': tick, 'eventualBG': eventual_bg, 'targetBG': target_bg,
+        'insulinReq': 0, 'sensitivityRatio': sensitivity_ratio, 'COB': meal_data.get('mealCOB', 0),
+        'IOB': iob['iob'],
+    })
+
+    # --- Prediction curves ---
+    ci = _round(min_delta - bgi, 1)
+    uci = ci
+    slope_from_deviations = min(meal_data.get('slopeFromMaxDeviation', 0),
+                                -meal_data.get('slopeFromMinDeviation', 0) / 3)
+    insulin_peak_5m = (profile.get('insulinPeakTime', 75) / 60) * 12
+
+    # Raw curves; rounding is monotonic, so minima are tracked raw and rounded once
+    iob_pred, zt_pred, uam_pred = [bg], [bg], [bg]
+    iob_bg = zt_bg = uam_bg = bg
+    min_iob_pred = min_uam_pred = min_zt_guard = min_iob_guard = min_uam_guard = 999
+    uam_horizon = max(3 * 60 / 5, 1)
+    five_sens = sens * 5
+    for n, tick_data in enumerate(iob_array, start=1):
+        pred_bgi = _round(-tick_data['activity'] * five_sens, 2)
+        pred_zt_bgi = _round(-tick_data['iobWithZeroTemp']['activity'] * five_sens, 2)
+        pred_dev = ci * (1 - min(1, n / 12))
+        iob_bg += pred_bgi + pred_dev
+        zt_bg += pred_zt_bgi
+
+        pred_uci_slope = max(0, uci + n * slope_from_deviations)
+        pred_uci_max = max(0, uci * (1 - n / uam_horizon))
+        uam_bg += pred_bgi + min(0, pred_dev) + min(pred_uci_slope, pred_uci_max)
+        iob_pred.append(iob_bg)
+        zt_pred.append(zt_bg)
+        uam_pred.append(uam_bg)
+
+        if iob_bg < min_iob_guard:
+            min_iob_guard = iob_bg
+        if uam_bg < min_uam_guard:
+            min_uam_guard = uam_bg
+        if zt_bg < min_zt_guard:
+            min_zt_guard = zt_bg
+        if n + 1 > insulin_peak_5m and iob_bg < min_iob_pred:
+            min_iob_pred = iob_bg
+        if n + 1 > 12 and uam_bg < min_uam_pred:
+            min_uam_pred = uam_bg
+    min_iob_guard, min_uam_guard, min_zt_guard = _round(min_iob_guard), _round(min_uam_guard), _round(min_zt_guard)
+    min_iob_pred, min_uam_pred = _round(min_iob_pred), _round(min_uam_pred)
+
+    def clip(curve):
+        return [math.floor(min(401, max(39, v)) + 0.5) for v in curve]
+
+    iob_pred, zt_pred, uam_pred = clip(iob_pred), clip(zt_pred), clip(uam_pred)
+    rT['predBGs'] = {'IOB': iob_pred, 'ZT': zt_pred}
+    if profile.get('enableUAM'):
+        rT['predBGs']['UAM'] = uam_pred
+
+    min_iob_pred = max(39, min_iob_pred)
+    min_uam_pred = max(39, min_uam_pred)
+    if profile.get('enableUAM'):
+        min_guard = min_uam_guard
+        avg_pred_bg = _round((iob_pred[-1] + uam_pred[-1]) / 2)
+        min_zt_uam_pred = _round((min_uam_pred + min_zt_guard) / 2)
+        min_pred_bg = _round(max(min_iob_pred, min_zt_uam_pred))
+    else:
+        min_guard = min_iob_guard
+        avg_pred_bg = _round(iob_pred[-1])
+        min_pred_bg = _round(min_iob_pred)
+    min_pred_bg = min(min_pred_bg, avg_pred_bg)
+
+    rT['reason'] = (
+        f"COB: {meal_data.get('mealCOB', 0)}, Dev: {deviation:g}, BGI: {bgi:g}, ISF: {sens:g}, "
+        f"Target: {target_bg:g}, minPredBG {min_pred_bg:g}, minGuardBG {min_guard:g}, "
+        f"IOBpredBG {iob_pred[-1]:g}"
+    )
+    if profile.get('enableUAM'):
+        rT['reason'] += f", UAMpredBG {uam_pred[-1]:g}"
+    rT['reason'] += '; '
+
+    smb_enabled, smb_reason = enable_smb(profile, micro_bolus_allowed, meal_data, bg)
+    if smb_enabled and min_guard < threshold:
+        smb_enabled, smb_reason = False, f"minGuardBG {min_guard:g} projected below {threshold:g} - disabling SMB"
+    if profile.get('verbose_reasons'):
+        rT['reason'] += smb_reason + '. '
+
+    cur_rate = currenttemp.get('rate', 0) or 0
+    cur_duration = currenttemp.get('duration', 0) or 0
+
+    # --- Low glucose suspend ---
+    if bg < threshold and iob['iob'] < -profile['current_basal'] * 20 / 60 and min_delta > 0 and min_delta > expected_delta:
+        rT['reason'] += f"IOB {iob['iob']} < {_round(-profile['current_basal'] * 20 / 60, 2)}"
+        rT['reason'] += f" and minDelta {min_delta:g} > expectedDelta {expected_delta:g}; "
+    elif bg < threshold or min_guard < threshold:
+        rT['reason'] += f"minGuardBG {min_guard:g}<{threshold:g}"
+        bg_undershoot = target_bg - min_guard
+        worst_case_insulin_req = bg_undershoot / sens
+        duration_req = _round(60 * worst_case_insulin_req / profile['current_basal'])
+        duration_req = min(120, max(30, _round(duration_req / 30) * 30))
+        return set_temp_basal(0, duration_req, profile, rT, currenttemp)
+
+    # --- Eventual BG below target range ---
+    if eventual_bg < min_bg:
+        rT['reason'] += f"Eventual BG {eventual_bg:g} < {min_bg:g}"
+        if min_delta > expected_delta and min_delta > 0:
+            if naive_eventual_bg < 40:
+                rT['reason'] += ', naive_eventualBG < 40. '
+                return set_temp_basal(0, 30, profile, rT, currenttemp)
+            rT['reason'] += f", but Delta {tick} > expectedDelta {expected_delta:g}; "
+            if cur_duration > 15 and round_basal(basal) == round_basal(cur_rate):
+                rT['reason'] += f"temp {cur_rate} ~ req {basal}U/hr. "
+                return rT
+            rT['reason'] += f"setting current basal of {basal} as temp. "
+            return set_temp_basal(basal, 30, profile, rT, currenttemp)
+
+        insulin_req = 2 * min(0, (eventual_bg - target_bg) / sens)
+        insulin_req = _round(insulin_req, 2)
+        naive_insulin_req = min(0, (naive_eventual_bg - target_bg) / sens)
+        naive_insulin_req = _round(naive_insulin_req, 2)
+        if min_delta < 0 and min_delta > expected_delta:
+            insulin_req = _round(insulin_req * (min_delta / expected_delta), 2)
+        rate = round_basal(basal + 2 * insulin_req, profile)
+        insulin_scheduled = cur_duration * (cur_rate - basal) / 60
+        min_insulin_req = min(insulin_req, naive_insulin_req)
+        if insulin_scheduled < min_insulin_req - basal * 0.3:
+            rT['reason'] += f", {cur_duration}m@{cur_rate:.2f} is a lot less than needed. "
+            return set_temp_basal(rate, 30, profile, rT, currenttemp)
+        if cur_duration > 5 and rate >= cur_rate * 0.8:
+            rT['reason'] += f", temp {cur_rate} ~< req {rate}U/hr. "
+            return rT
+        if rate <= 0:
+            bg_undershoot = target_bg - naive_eventual_bg
+            worst_case_insulin_req = bg_undershoot / sens
+            duration_req = _round(60 * worst_case_insulin_req / profile['current_basal'])
+            if duration_req < 0:
+                duration_req = 0
+            else:
+                duration_req = min(120, max(0, _round(duration_req / 30) * 30))
+            if duration_req > 0:
+                rT['reason'] += f", setting {duration_req}m zero temp. "
+                return set_temp_basal(rate, duration_req, profile, rT, currenttemp)
+        else:
+            rT['reason'] += f", setting {rate}U/hr. "
+        return set_temp_basal(rate, 30, profile, rT, currenttemp)
+
+    # --- Falling faster than expected ---
+    if min_delta < expected_delta and not (micro_bolus_allowed and smb_enabled):
+        if glucose_status['delta'] < min_delta:
+            rT['reason'] += f"Eventual BG {eventual_bg:g} > {min_bg:g} but Delta {tick} < Exp. Delta {expected_delta:g}"
+        else:
+            rT['reason'] += f"Eventual BG {eventual_bg:g} > {min_bg:g} but Min. Delta {min_delta:.2f} < Exp. Delta {expected_delta:g}"
+        if cur_duration > 15 and round_basal(basal) == round_basal(cur_rate):
+            rT['reason'] += f", temp {cur_rate} ~ req {basal}U/hr. "
+            return rT
+        rT['reason'] += f"; setting current basal of {basal} as temp. "
+        return set_temp_basal(basal, 30, profile, rT, currenttemp)
+
+    # --- In range ---
+    if min(eventual_bg, min_pred_bg) < max_bg and not (micro_bolus_allowed and smb_enabled):
+        rT['reason'] += f"{eventual_bg:g}-{min_pred_bg:g} in range: no temp required"
+        if cur_duration > 15 and round_basal(basal) == round_basal(cur_rate):
+            rT['reason'] += f", temp {cur_rate} ~ req {basal}U/hr. "
+            return rT
+        rT['reason'] += f"; setting current basal of {basal} as temp. "
+        return set_temp_basal(basal, 30, profile, rT, currenttemp)
+
+    # --- Eventual BG above target: high temp and/or SMB ---
+    if eventual_bg >= max_bg:
+        rT['reason'] += f"Eventual BG {eventual_bg:g} >= {max_bg:g}, "
+    max_iob = profile.get('max_iob', 0)
+    if iob['iob'] > max_iob:
+        rT['reason'] += f"IOB {_round(iob['iob'], 2):g} > max_iob {max_iob:g}"
+        if cur_duration > 15 and round_basal(basal) == round_basal(cur_rate):
+            rT['reason'] += f", temp {cur_rate} ~ req {basal}U/hr. "
+            return rT
+        rT['reason'] += f"; setting current basal of {basal} as temp. "
+        return set_temp_basal(basal, 30, profile, rT, currenttemp)
+
+    insulin_req = _round((min(min_pred_bg, eventual_bg) - target_bg) / sens, 2)
+    if insulin_req > max_iob - iob['iob']:
+        rT['reason'] += f"max_iob {max_iob:g}, "
+        insulin_req = max_iob - iob['iob']
+    rate = round_basal(basal + 2 * insulin_req, profile)
+    insulin_req = _round(insulin_req, 3)
+    rT['insulinReq'] = insulin_req
+
+    if micro_bolus_allowed and smb_enabled and bg > threshold:
+        meal_insulin_req = _round(meal_data.get('mealCOB', 0) / profile.get('carb_ratio', 10), 3)
+        if iob['iob'] > meal_insulin_req and iob['iob'] > 0:
+            max_bolus = _round(profile['current_basal'] * profile.get('maxUAMSMBBasalMinutes', 30) / 60, 1)
+        else:
+            max_bolus = _round(profile['current_basal'] * profile.get('maxSMBBasalMinutes', 30) / 60, 1)
+        bolus_increment = profile.get('bolus_increment', 0.1)
+        round_smb_to = 1 / bolus_increment
+        micro_bolus = math.floor(min(insulin_req / 2, max_bolus) * round_smb_to) / round_smb_to
+
+        worst_case_insulin_req = (target_bg - (naive_eventual_bg + min_iob_pred) / 2) / sens
+        duration_req = _round(60 * worst_case_insulin_req / profile['current_basal'])
+        if insulin_req > 0 and micro_bolus < bolus_increment:
+            duration_req = 0
+        smb_low_temp_req = 0
+        if duration_req <= 0:
+            duration_req = 0
+        elif duration_req >= 30:
+            duration_req = _round(duration_req / 30) * 30
+            duration_req = min(60, max(0, duration_req))
+        else:
+            smb_low_temp_req = _round(basal * duration_req / 30, 2)
+            duration_req = 30
+
+        rT['reason'] += f" insulinReq {insulin_req:g}"
+        if micro_bolus >= max_bolus:
+            rT['reason'] += f"; maxBolus {max_bolus:g}"
+        if duration_req > 0:
+            rT['reason'] += f"; setting {duration_req}m low temp of {smb_low_temp_req}U/h"
+        rT['reason'] += '. '
+
+        last_bolus_time = iob.get('lastBolusTime', 0) or 0
+        last_bolus_age = _round((now_ms - last_bolus_time) / 60000, 1)
+        if last_bolus_age > SMB_INTERVAL_MINUTES:
+            if micro_bolus > 0:
+                rT['units'] = micro_bolus
+                rT['reason'] += f"Microbolusing {micro_bolus:g}U. "
+        else:
+            next_bolus_mins = _round(SMB_INTERVAL_MINUTES - last_bolus_age, 1)
+            rT['reason'] += f"Waiting {next_bolus_mins:g}m to microbolus again. "
+        if duration_req > 0:
+            rT['rate'] = smb_low_temp_req
+            rT['duration'] = duration_req
+            return rT
+
+    max_safe_basal = get_max_safe_basal(profile)
+    if rate > max_safe_basal:
+        rT['reason'] += f"adj. req. rate: {rate:g} to maxSafeBasal: {max_safe_basal:g}, "
+        rate = round_basal(max_safe_basal, profile)
+
+    insulin_scheduled = cur_duration * (cur_rate - basal) / 60
+    if insulin_scheduled >= insulin_req * 2:
+        rT['reason'] += f"{cur_duration}m@{cur_rate:.2f} > 2 * insulinReq. Setting temp basal of {rate}U/hr. "
+        return set_temp_basal(rate, 30, profile, rT, currenttemp)
+    if cur_duration == 0:
+        rT['reason'] += f"no temp, setting {rate}U/hr. "
+        return set_temp_basal(rate, 30, profile, rT, currenttemp)
+    if cur_duration > 5 and round_basal(rate, profile) <= round_basal(cur_rate, profile):
+        rT['reason'] += f"temp {cur_rate} >~ req {rate}U/hr. "
+        return rT
+    rT['reason'] += f"temp {cur_rate}<{rate}U/hr. "
+    return set_temp_basal(rate, 30, profile, rT, currenttemp)
+
+
+def recommend(glucose, iob_data, temp_basal, profile, preferences=None, **kwargs):
+    """Convenience entry point taking the same objects as data/*.json, in memory."""
+    merged = dict(profile)
+    merged.update(preferences if preferences is not None else load_preferences())
+    return determine_basal(get_last_glucose(glucose), temp_basal or {}, iob_data, merged, **kwargs)
+
+
+# --- Golden corpus ---
+def _run_case(case):
+    inputs = case['inputs']
+    return recommend(
+        inputs['glucose'], inputs['iob'], inputs.get('temp_basal', {}), inputs['profile'],
+        preferences=inputs.get('preferences', {}), autosens_data=inputs.get('autosens'),
+        meal_data=inputs.get('meal'), micro_bolus_allowed=inputs.get('microBolusAllowed', False),
+        current_time=inputs['currentTime'],
+    )
+
+
+def check_golden(directory=GOLDEN_DIR, tolerance=0.01):
+    failures = 0
+    paths = sorted(glob.glob(os.path.join(directory, '*.json')))
+    for path in paths:
+        with open(path) as f:
+            case = json.load(f)
+        result = _run_case(case)
+        expected = case['expected']
+        diffs = []
+        for field in GOLDEN_FIELDS:
+            want, got = expected.get(field), result.get(field)
+            if isinstance(want, (int, float)) and isinstance(got, (int, float)):
+                if abs(want - got) > tolerance:
+                    diffs.append(f"{field}: expected {want}, got {got}")
+            elif want != got:
+                diffs.append(f"{field}: expected {want!r}, got {got!r}")
+        status = 'PASS' if not diffs else 'FAIL'
+        failures += bool(diffs)
+        print(f"[{status}] {os.path.basename(path)} ({case.get('source', '?')})")
+        for diff in diffs:
+            print(f"        {diff}")
+    print(f"{len(paths) - failures}/{len(paths)} golden cases match")
+    return failures == 0
+
+
+def record_golden(directory=GOLDEN_DIR, use_oref0=False):
+    """
+    Refresh the expected outputs. With use_oref0 the inputs are written to
+    data/*.json and run through the real node determine-basal, which is the
+    reference; otherwise this engine's current output is stored.
+    """
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path) as f:
+            case = json.load(f)
+        if use_oref0:
+            from calculator import run_oref1_node_with_inputs
+            result = run_oref1_node_with_inputs(case['inputs'])
+            if result is None:
+                print(f"Skipping {path}: oref0 produced no output")
+                continue
+            case['source'] = 'oref0-determine-basal.js'
+        else:
+            result = _run_case(case)
+            case['source'] = 'determine_basal.py'
+        case['expected'] = {field: result.get(field) for field in GOLDEN_FIELDS + ('reason',)}
+        with open(path, 'w') as f:
+            json.dump(case, f, indent=2)
+            f.write('\n')
+        print(f"Recorded {os.path.basename(path)} from {case['source']}")
+
+
+def bench(iterations=5000):
+    paths = sorted(glob.glob(os.path.join(GOLDEN_DIR, '*.json')))
+    cases = []
+    for path in paths:
+        with open(path) as f:
+            cases.append(json.load(f))
+    start = time.perf_counter()
+    for i in range(iterations):
+        _run_case(cases[i % len(cases)])
+    per_decision_us = (time.perf_counter() - start) / iterations * 1e6
+    print(f"determine_basal: {per_decision_us:.1f} us/decision over {iterations} decisions "
+          f"(node spawn is ~100000 us)")
+    return per_decision_us
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='In-process oref1 determine-basal')
+    parser.add_argument('--check', nargs='?', const=GOLDEN_DIR, help='compare against a golden corpus')
+    parser.add_argument('--record', action='store_true', help='re-record the golden expected outputs')
+    parser.add_argument('--oref0', action='store_true', help='with --record, use node oref0 as the reference')
+    parser.add_argument('--bench', action='store_true', help='measure per-decision latency')
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.record:
+        record_golden(use_oref0=args.oref0)
+    if args.check:
+        raise SystemExit(0 if check_golden(args.check) else 1)
+    if args.bench:
+        bench(args.iterations)
@@ -1,7 +1,26 @@
 # data_simulator.py
+"""
+Simulated CGM feed for the oref1 orchestrator.
+
+glucose.json is published atomically (write to a temp file in the same
+directory, then os.replace), so calculator.py never sees a half-written
+file. Each reading is serialized once and the cached entries are joined on
+publish, instead of re-encoding the whole history every time.
+
+Optionally every reading is also appended to glucose.ndjson, which readers
+can tail with GlucoseFeedReader without re-parsing the full history, and
+FeedWriter.readings_since() hands readings over in memory when the
+orchestrator runs in the same process.
+
+    python generator.py                 # run the feed
+    python generator.py --bench         # publish cost at 10k-point histories
+"""
+import argparse
 import json
 import time
 import random
+import tempfile
+import threading
 from collections import deque
 import os
 
@@ -9,11 +28,134 @@ import os
 OREF1_DATA_PATH = 'E:/oref1/oref0-master/data'
 HISTORY_MINUTES = 60
 READING_INTERVAL_SECONDS = 10 # We'll generate a reading every minute for realism
+WRITE_NDJSON_SIDECAR = True
+SIDECAR_MAX_LINES = 10000       # sidecar is compacted back to the history window past this
+REPLACE_RETRIES = 5             # Windows refuses os.replace while a reader has the file open
+REPLACE_RETRY_DELAY_SEC = 0.01
 
 # --- Initial State ---
 current_bg = 130
-# A deque will automatically manage our 60-minute history
-glucose_history = deque(maxlen=HISTORY_MINUTES) 
+
+
+def atomic_write(path, data):
+    """Publishes `data` (str) at `path` so readers see either the old or the new file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        for attempt in range(REPLACE_RETRIES):
+            try:
+                os.replace(tmp_path, path)
+                return
+            except PermissionError:
+                if attempt == REPLACE_RETRIES - 1:
+                    raise
+                time.sleep(REPLACE_RETRY_DELAY_SEC)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class FeedWriter:
+    """Keeps the glucose history and publishes it to glucose.json (and the sidecar)."""
+
+    def __init__(self, data_path=OREF1_DATA_PATH, history_size=HISTORY_MINUTES,
+                 sidecar=WRITE_NDJSON_SIDECAR, sidecar_max_lines=SIDECAR_MAX_LINES):
+        self.path = os.path.join(data_path, 'glucose.json')
+        self.sidecar_path = os.path.join(data_path, 'glucose.ndjson') if sidecar else None
+        self.sidecar_max_lines = sidecar_max_lines
+        self.history = deque(maxlen=history_size)
+        # Each reading is encoded once; publishing is a join, not a re-encode
+        self._encoded = deque(maxlen=history_size)
+        self._sidecar_lines = 0
+        self._lock = threading.Lock()
+        if self.sidecar_path:
+            # Start each run with a fresh sidecar so readers don't mix two feeds
+            atomic_write(self.sidecar_path, '')
+
+    def publish(self, reading):
+        encoded = json.dumps(reading)
+        with self._lock:
+            self.history.append(reading)
+            self._encoded.append(encoded)
+            # glucose.json is newest-first, like a Nightscout entries download
+            atomic_write(self.path, '[' + ', '.join(reversed(self._encoded)) + ']')
+        if self.sidecar_path:
+            self._append_sidecar(encoded)
+
+    def _append_sidecar(self, encoded):
+        if self._sidecar_lines >= self.sidecar_max_lines:
+            with self._lock:
+                window = list(self._encoded)
+            atomic_write(self.sidecar_path, ''.join(line + '\n' for line in window))
+            self._sidecar_lines = len(window)
+            return
+        # One write() of a complete line; readers only consume lines ending in '\n'
+        with open(self.sidecar_path, 'a') as f:
+            f.write(encoded + '\n')
+        self._sidecar_lines += 1
+
+    def readings_since(self, date_ms=None):
+        """In-memory handoff: readings newer than `date_ms`, oldest first."""
+        with self._lock:
+            if date_ms is None:
+                return list(self.history)
+            newer = []
+            for reading in reversed(self.history):
+                if reading['date'] <= date_ms:
+                    break
+                newer.append(reading)
+        newer.reverse()
+        return newer
+
+
+class GlucoseFeedReader:
+    """
+    Tails glucose.ndjson and keeps the newest `history_size` readings, so each
+    cycle only parses the lines appended since the last one. Every reader has
+    its own offset; any number of them can follow the same writer.
+    """
+
+    def __init__(self, data_path=OREF1_DATA_PATH, history_size=HISTORY_MINUTES):
+        self.path = os.path.join(data_path, 'glucose.ndjson')
+        self.history = deque(maxlen=history_size)
+        self._offset = 0
+        self._inode = None
+
+    def poll(self):
+        """Reads new complete lines and returns the readings they added."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        inode = (stat.st_ino, stat.st_dev)
+        if inode != self._inode or stat.st_size < self._offset:
+            # Sidecar was compacted or restarted: re-read from the top
+            self._inode, self._offset = inode, 0
+            self.history.clear()
+        if stat.st_size == self._offset:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        complete = chunk.rfind(b'\n') + 1
+        self._offset += complete
+        new = [json.loads(line) for line in chunk[:complete].splitlines() if line.strip()]
+        self.history.extend(new)
+        return new
+
+    def glucose(self):
+        """Current history in the glucose.json shape (newest first)."""
+        self.poll()
+        return list(reversed(self.history))
+
+
+_writer = None
+
 
 def setup_static_files():
     """Create the other required files so the main loop doesn't fail."""
@@ -25,29 +167,28 @@ def setup_static_files():
         "carb_ratio": [{"i": 0, "start": "00:00", "value": 10, "offset": 0}],
         "timezone": "UTC"
     }
-    with open(os.path.join(OREF1_DATA_PATH, 'profile.json'), 'w') as f:
-        json.dump(profile_data, f)
-        
+    atomic_write(os.path.join(OREF1_DATA_PATH, 'profile.json'), json.dumps(profile_data))
+
     # For testing, we'll assume IOB is always zero
     iob_data = {"iob": 0, "activity": 0, "basaliob": 0, "bolusiob": 0}
-    with open(os.path.join(OREF1_DATA_PATH, 'iob.json'), 'w') as f:
-        json.dump(iob_data, f)
+    atomic_write(os.path.join(OREF1_DATA_PATH, 'iob.json'), json.dumps(iob_data))
 
     # An empty placeholder for temp_basal
-    with open(os.path.join(OREF1_DATA_PATH, 'temp_basal.json'), 'w') as f:
-        json.dump({}, f)
+    atomic_write(os.path.join(OREF1_DATA_PATH, 'temp_basal.json'), json.dumps({}))
 
     print("Static files (profile.json, iob.json, temp_basal.json) are set up.")
 
 
 def generate_new_reading_and_update_file():
-    """Simulates a new BG reading, adds to history, and overwrites the JSON file."""
-    global current_bg
-    
+    """Simulates a new BG reading, adds to history, and publishes the feed."""
+    global current_bg, _writer
+    if _writer is None:
+        _writer = FeedWriter()
+
     # Introduce a small, random drift to the BG
     drift = random.uniform(-2, 2)
     current_bg += drift
-    
+
     # Create the new reading object
     new_reading = {
         # Using unix timestamp in milliseconds
@@ -56,19 +197,75 @@ def generate_new_reading_and_update_file():
         "sgv": int(current_bg),
         "direction": "Flat" # Keeping it simple for the simulator
     }
-    
-    # Add to our history queue (the oldest reading is automatically dropped if full)
-    glucose_history.append(new_reading)
-    
-    # Overwrite the glucose.json file with the complete, updated history
-    # The oref1 script needs a simple list, so we convert the deque
-    with open(os.path.join(OREF1_DATA_PATH, 'glucose.json'), 'w') as f:
-        json.dump(list(glucose_history), f)
-        
-    print(f"SIMULATOR: New reading generated. BG: {int(current_bg)}. History size: {len(glucose_history)}")
+
+    _writer.publish(new_reading)
+
+    print(f"SIMULATOR: New reading generated. BG: {int(current_bg)}. History size: {len(_writer.history)}")
+    return new_reading
+
+
+def bench(points=10000, publishes=200):
+    """Per-reading publish and per-cycle read cost with a `points`-long history."""
+    with tempfile.TemporaryDirectory() as tmp:
+        start_ms = int(time.time() * 1000)
+        readings = [{"date": start_ms + i * 5000, "dateString": "", "sgv": 100 + i % 50, "direction": "Flat"}
+                    for i in range(points + publishes)]
+
+        # Old behaviour: json.dump of the whole deque straight over glucose.json
+        legacy = deque(readings[:points], maxlen=points)
+        legacy_path = os.path.join(tmp, 'legacy.json')
+        t0 = time.perf_counter()
+        for reading in readings[points:]:
+            legacy.append(reading)
+            with open(legacy_path, 'w') as f:
+                json.dump(list(legacy), f)
+        legacy_us = (time.perf_counter() - t0) / publishes * 1e6
+
+        writer = FeedWriter(tmp, history_size=points, sidecar=True, sidecar_max_lines=10 * points)
+        for reading in readings[:points]:
+            writer.history.append(reading)
+            writer._encoded.append(json.dumps(reading))
+        t0 = time.perf_counter()
+        for reading in readings[points:]:
+            writer.publish(reading)
+        atomic_us = (time.perf_counter() - t0) / publishes * 1e6
+
+        t0 = time.perf_counter()
+        for _ in range(20):
+            with open(writer.path) as f:
+                json.load(f)
+        full_read_us = (time.perf_counter() - t0) / 20 * 1e6
+
+        reader = GlucoseFeedReader(tmp, history_size=points)
+        reader.poll()
+        writer.publish(readings[-1])
+        t0 = time.perf_counter()
+        reader.poll()
+        tail_read_us = (time.perf_counter() - t0) * 1e6
+
+        t0 = time.perf_counter()
+        for _ in range(1000):
+            writer.readings_since(readings[-2]['date'])
+        handoff_us = (time.perf_counter() - t0) / 1000 * 1e6
+
+    print(f"--- Feed benchmark, {points} point history ---")
+    print(f"publish, full rewrite (old):     {legacy_us:10.0f} us/reading")
+    print(f"publish, atomic + sidecar:       {atomic_us:10.0f} us/reading")
+    print(f"read, json.load glucose.json:    {full_read_us:10.0f} us/cycle")
+    print(f"read, NDJSON tail (new lines):   {tail_read_us:10.0f} us/cycle")
+    print(f"read, in-memory handoff:         {handoff_us:10.1f} us/cycle")
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated CGM feed for oref1')
+    parser.add_argument('--bench', action='store_true', help='benchmark publishing at 10k points')
+    parser.add_argument('--points', type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.points)
+        raise SystemExit(0)
+
    #  setup_static_files()
     print("--- Starting Data Simulator Loop ---")
     while True: